@@ -0,0 +1,358 @@
+# pylint: disable=no-member
+"""
+a small json api over courses, schedules and shopping carts, so pages can poll
+or change one thing without reloading a whole template.
+
+Schedules and carts have an updated_at (bumped by save() and whenever their
+courses change, see signals.py) that serves as their ETag and Last-Modified,
+so a conditional GET for something that hasn't changed gets its 304 after one
+small query, before anything is serialized. Course lookups are tagged with a
+hash of the response instead. Writes honour If-Match, answering 412 when the
+client's copy is out of date.
+
+Only the ETag decides: Last-Modified is to the second, so two changes in the
+same second look alike. If-Modified-Since is ignored (the answer is a 200),
+and a write with If-Unmodified-Since but no If-Match is refused with a 428.
+"""
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET, require_http_methods
+
+from .approvals import allowed_statuses
+from .conflicts import conflicting_pairs
+from .decorators import api_login_required
+from .metrics import query_budget
+from .models import Course, Schedule, ShoppingCart
+
+# most courses one lookup returns
+MAX_COURSES = 100
+
+# ------- Serializers -------
+def course_json(course, seats=False):
+    """ the parts of a course a client needs to show it; `seats` adds enrollment, which changes often """
+    data = {
+        'class_nbr': course.class_nbr,
+        'strm': course.strm,
+        'subject': course.subject,
+        'catalog_nbr': course.catalog_nbr,
+        'class_section': course.class_section,
+        'descr': course.descr,
+        'topic': course.topic,
+        'units': course.units,
+        'instructors': [instructor.get('name') for instructor in course.instructors or []],
+        'meetings': [{key: meeting.get(key) for key in ('days', 'start_time', 'end_time', 'facility_descr')}
+                     for meeting in course.meetings or []],
+    }
+    if seats:
+        data.update(class_capacity=course.class_capacity, enrollment_total=course.enrollment_total,
+                    enrollment_available=course.enrollment_available, wait_tot=course.wait_tot)
+    return data
+
+def _courses_json(courses):
+    return {
+        'courses': [course_json(course) for course in courses],
+        'conflicts': [[first.pk, second.pk] for first, second in conflicting_pairs(courses)],
+    }
+
+def schedule_json(schedule):
+    """ a schedule with its courses and the pairs of them that conflict """
+    return dict({
+        'id': schedule.pk,
+        'name': schedule.name,
+        'approval_status': schedule.approval_status,
+        'submitted_at': schedule.submitted_at,
+        'updated_at': schedule.updated_at,
+        'student': schedule.student.username,
+        'approver': schedule.approver.username,
+    }, **_courses_json(list(schedule.courses.all())))
+
+def cart_json(cart):
+    """ a shopping cart's courses and the pairs of them that conflict """
+    return dict({
+        'strm': cart.strm,
+        'updated_at': cart.updated_at,
+    }, **_courses_json(list(cart.courses.all())))
+
+# ------- Conditional requests -------
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+def _json_response(data, status=200):
+    return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder), status=status, content_type='application/json')
+
+def _version(instance):
+    """ (ETag, Last-Modified timestamp) of a schedule or cart, from its updated_at """
+    updated_at = instance.updated_at
+    etag = quote_etag(f"{instance._meta.model_name}-{instance.pk}-{updated_at.timestamp() if updated_at else 0}")
+    return etag, int(updated_at.timestamp()) if updated_at else None
+
+def _tag(response, etag, last_modified=None):
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    return response
+
+def _precondition(request, instance):
+    """ the 412 (or 428) for a write to `instance` whose conditions fail, or None to go ahead """
+    if 'HTTP_IF_UNMODIFIED_SINCE' in request.META and 'HTTP_IF_MATCH' not in request.META:
+        return _error("Send If-Match with the ETag; If-Unmodified-Since can't tell apart two changes "
+                      "in the same second.", 428)
+    return get_conditional_response(request, etag=_version(instance)[0])
+
+def _versioned(request, instance, serialize):
+    """ 304/412 for `instance` if the request's conditions say so, otherwise its json, tagged """
+    etag, last_modified = _version(instance)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = _json_response(serialize())
+    return _tag(response, etag, last_modified)
+
+def _current(instance, serialize):
+    """ `instance` as json, tagged with its version; what a write answers with """
+    return _tag(_json_response(serialize()), *_version(instance))
+
+def _hashed(request, data):
+    """ json for `data` tagged with a hash of itself, or a 304 if the client already has it """
+    body = json.dumps(data, cls=DjangoJSONEncoder)
+    etag = quote_etag(hashlib.md5(body.encode(), usedforsecurity=False).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    return _tag(response, etag)
+
+def _body(request):
+    """ the fields of a json or form-encoded request body """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return {}
+        return data if isinstance(data, dict) else {}
+    return request.POST
+
+def _class_nbr(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+# ------- Courses -------
+@api_login_required
+@require_GET
+def course_detail(request, class_nbr):
+    """ GET one course, with its seats """
+    course = Course.objects.filter(pk=class_nbr).first()
+    if course is None:
+        return _error('No such course.', 404)
+    return _hashed(request, {'course': course_json(course, seats=True)})
+
+@api_login_required
+@require_GET
+def course_lookup(request):
+    """ GET up to MAX_COURSES courses at once: ?class_nbr=15529&class_nbr=15537 """
+    class_nbrs = [class_nbr for class_nbr in map(_class_nbr, request.GET.getlist('class_nbr')) if class_nbr is not None]
+    found = Course.objects.in_bulk(class_nbrs[:MAX_COURSES])
+    return _hashed(request, {'courses': [course_json(found[pk], seats=True) for pk in class_nbrs if pk in found]})
+
+# ------- Schedules -------
+def _schedule(request, pk, for_update=False):
+    # the schedule, if it's the user's or they approve it
+    schedules = Schedule.objects.select_related('student', 'approver')
+    if for_update:
+        schedules = schedules.select_for_update(of=('self',))
+    schedule = schedules.filter(pk=pk).first()
+    if schedule is None or request.user.pk not in (schedule.student_id, schedule.approver_id):
+        return None
+    return schedule
+
+@query_budget(8)
+@api_login_required
+@require_GET
+def schedule_detail(request, pk):
+    """ GET a schedule: its courses, conflicts and approval status """
+    schedule = _schedule(request, pk)
+    if schedule is None:
+        return _error('No such schedule.', 404)
+    return _versioned(request, schedule, lambda: schedule_json(schedule))
+
+@api_login_required
+@require_http_methods(['POST'])
+def schedule_status(request, pk):
+    """
+    POST {"status": "pending"} to move a schedule through approval: students can
+    submit (pending) or withdraw (unsubmitted) their own, the approving advisor
+    can approve, deny, or send it back to pending
+    """
+    status = _body(request).get('status')
+    with transaction.atomic():
+        schedule = _schedule(request, pk, for_update=True)
+        if schedule is None:
+            return _error('No such schedule.', 404)
+
+        precondition = _precondition(request, schedule)
+        if precondition is not None:
+            return precondition
+        if status not in allowed_statuses(request.user):
+            return _error(f'{status!r} is not a status you can set.', 400)
+        if request.user.pk != (schedule.approver_id if request.user.is_advisor else schedule.student_id):
+            return _error('You can not change the status of this schedule.', 403)
+
+        schedule.set_approval_status(status)
+        schedule.save()
+    return _current(schedule, lambda: schedule_json(schedule))
+
+# ------- Batch schedule changes -------
+# most operations one batch can carry
+MAX_OPERATIONS = 50
+
+class OperationError(Exception):
+    """ a batch operation that can't be applied; the whole batch is refused """
+
+def plan_operations(class_nbrs, operations):
+    """
+    the class_nbrs a schedule would have after `operations`, applied in order to
+    the set `class_nbrs`, without touching the database:
+        {"op": "add", "class_nbr": 15529}
+        {"op": "remove", "class_nbr": 15529}
+        {"op": "swap", "from": 15529, "to": 15530}
+    adding a course that's already there, or removing one that isn't, does nothing
+    """
+    planned = set(class_nbrs)
+    for number, operation in enumerate(operations, 1):
+        if not isinstance(operation, dict):
+            raise OperationError(f'operation {number} is not an object')
+        op = operation.get('op')
+        if op in ('add', 'remove'):
+            class_nbr = _class_nbr(operation.get('class_nbr'))
+            if class_nbr is None:
+                raise OperationError(f'operation {number} needs a class_nbr')
+            if op == 'add':
+                planned.add(class_nbr)
+            else:
+                planned.discard(class_nbr)
+        elif op == 'swap':
+            old, new = _class_nbr(operation.get('from')), _class_nbr(operation.get('to'))
+            if old is None or new is None:
+                raise OperationError(f'operation {number} needs a from and a to class_nbr')
+            if old not in planned:
+                raise OperationError(f'operation {number} swaps out {old}, which is not in the schedule')
+            planned.discard(old)
+            planned.add(new)
+        else:
+            raise OperationError(f'operation {number} has an unknown op {op!r}')
+    return planned
+
+def _check_swaps(operations, courses):
+    # a swap trades one section of a course for another section of the same course
+    for number, operation in enumerate(operations, 1):
+        if operation.get('op') != 'swap':
+            continue
+        old, new = courses.get(_class_nbr(operation['from'])), courses.get(_class_nbr(operation['to']))
+        if old and new and (old.strm, old.crse_id) != (new.strm, new.crse_id):
+            raise OperationError(f'operation {number} swaps {old} for {new}, which is not a section of the same course')
+
+@api_login_required
+@require_http_methods(['POST'])
+def schedule_courses(request, pk):
+    """
+    POST {"operations": [...]} (see plan_operations) to add, remove and swap the
+    sections in a schedule in one go. The batch is checked for conflicts once,
+    against the schedule it would produce: if anything it adds conflicts with
+    another course nothing changes and the answer is a 409 listing the pairs.
+    Otherwise every change is made in one transaction and the schedule comes back
+    """
+    operations = _body(request).get('operations')
+    if not isinstance(operations, list) or len(operations) > MAX_OPERATIONS:
+        return _error(f'operations must be a list of at most {MAX_OPERATIONS} operations.', 400)
+
+    with transaction.atomic():
+        schedule = _schedule(request, pk, for_update=True)
+        if schedule is None:
+            return _error('No such schedule.', 404)
+        if request.user.pk != schedule.student_id:
+            return _error('Only the student can change a schedule.', 403)
+        precondition = _precondition(request, schedule)
+        if precondition is not None:
+            return precondition
+
+        current = set(schedule.courses.values_list('pk', flat=True))
+        try:
+            planned = plan_operations(current, operations)
+            courses = Course.objects.in_bulk(planned | {_class_nbr(operation.get('from')) for operation in operations
+                                                        if operation.get('op') == 'swap'})
+            missing = sorted(planned - set(courses))
+            if missing:
+                raise OperationError(f'no such course: {", ".join(map(str, missing))}')
+            _check_swaps(operations, courses)
+        except OperationError as error:
+            return _error(str(error), 400)
+
+        added, removed = planned - current, current - planned
+        # only conflicts the batch brings in count; ones the schedule already had are left to the student
+        conflicts = [[first.pk, second.pk] for first, second in conflicting_pairs([courses[pk] for pk in sorted(planned)])
+                     if first.pk in added or second.pk in added]
+        if conflicts:
+            return JsonResponse({'error': 'These changes would make courses in the schedule conflict.',
+                                 'conflicts': conflicts}, status=409)
+
+        if removed:
+            schedule.courses.remove(*removed)
+        if added:
+            schedule.courses.add(*added)
+        schedule.refresh_from_db(fields=['updated_at'])
+    return _current(schedule, lambda: schedule_json(schedule))
+
+# ------- Shopping carts -------
+def _cart(request, strm, create=False):
+    if create:
+        return ShoppingCart.objects.get_or_create(user=request.user, strm=strm)[0]
+    return ShoppingCart.objects.filter(user=request.user, strm=strm).first()
+
+@query_budget(8)
+@api_login_required
+@require_GET
+def cart_detail(request, strm):
+    """ GET the student's cart for a term """
+    cart = _cart(request, strm)
+    if cart is None:
+        return _json_response({'strm': strm, 'updated_at': None, 'courses': [], 'conflicts': []})
+    return _versioned(request, cart, lambda: cart_json(cart))
+
+@api_login_required
+@require_http_methods(['POST', 'DELETE'])
+def cart_courses(request, strm, class_nbr=None):
+    """
+    POST {"class_nbr": 15529} to api/carts/<strm>/courses/ to add a course to the
+    student's cart for a term, DELETE api/carts/<strm>/courses/<class_nbr>/ to
+    take one out. Either way the cart comes back
+    """
+    if request.user.is_advisor:
+        return _error('Only students have shopping carts.', 403)
+    if request.method == 'POST':
+        class_nbr = _class_nbr(_body(request).get('class_nbr'))
+    course = Course.objects.filter(pk=class_nbr).first() if class_nbr is not None else None
+    if course is None:
+        return _error('No such course.', 404)
+    if str(course.strm) != str(strm):
+        return _error(f'{course} is not offered in term {strm}.', 400)
+
+    with transaction.atomic():
+        cart = _cart(request, strm, create=request.method == 'POST')
+        if cart is None:
+            return _error('No such cart.', 404)
+        precondition = _precondition(request, cart)
+        if precondition is not None:
+            return precondition
+
+        if request.method == 'POST':
+            cart.courses.add(course)
+        else:
+            cart.courses.remove(course)
+        cart.refresh_from_db(fields=['updated_at'])
+    return _current(cart, lambda: cart_json(cart))
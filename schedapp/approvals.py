@@ -0,0 +1,68 @@
+# pylint: disable=no-member
+"""
+the advisor approval queue: the schedules submitted to an advisor, oldest
+submission first, a page at a time.
+
+Pages are keyed on the last (submitted_at, id) of the previous page rather
+than an offset, so every page is an index range scan no matter how deep
+into the queue an advisor goes, and approving a schedule doesn't shift the
+rows of the next page.
+"""
+from datetime import datetime
+
+from django.db.models import Count, Q
+
+from .models import ApprovalStatus, Schedule
+from .summaries import with_summaries
+
+# the statuses of schedules that have been submitted, i.e. that an advisor sees
+SUBMITTED_STATUSES = [ApprovalStatus.PD.value, ApprovalStatus.AP.value, ApprovalStatus.DN.value]
+
+# the statuses an advisor can move a schedule to, and the ones a student can
+ADVISOR_STATUSES = (ApprovalStatus.PD.value, ApprovalStatus.AP.value, ApprovalStatus.DN.value)
+STUDENT_STATUSES = (ApprovalStatus.PD.value, ApprovalStatus.UN.value)
+
+def allowed_statuses(user):
+    """ the approval statuses `user` may set on a schedule """
+    return ADVISOR_STATUSES if user.is_advisor else STUDENT_STATUSES
+
+def make_cursor(schedule):
+    """ the `after` value for the page following this schedule """
+    return f'{schedule.submitted_at.isoformat()}_{schedule.pk}'
+
+def parse_cursor(cursor):
+    """ (submitted_at, id) from an `after` value, or None if it isn't one """
+    try:
+        submitted_at, pk = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(submitted_at), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+def approval_queue(advisor, status=None, after=None, limit=25):
+    """
+    one page of the schedules submitted to `advisor` (only those with `status`,
+    if given), oldest submission first, starting after the `after` cursor.
+    returns (schedules, cursor for the next page or None)
+    """
+    schedules = Schedule.objects.filter(approver=advisor, approval_status__in=[status] if status else SUBMITTED_STATUSES)
+    position = parse_cursor(after)
+    if position:
+        submitted_at, pk = position
+        schedules = schedules.filter(Q(submitted_at__gt=submitted_at) | Q(submitted_at=submitted_at, pk__gt=pk))
+
+    page = with_summaries(schedules.select_related('student', 'summary')
+                                   .order_by('submitted_at', 'pk')[:limit + 1])
+    if len(page) > limit:
+        return page[:limit], make_cursor(page[limit - 1])
+    return page, None
+
+def status_counts(advisor):
+    """ how many schedules `advisor` has in each submitted status, in one query """
+    counts = dict.fromkeys(SUBMITTED_STATUSES, 0)
+    rows = (Schedule.objects.filter(approver=advisor, approval_status__in=SUBMITTED_STATUSES)
+                            .values('approval_status')
+                            .annotate(count=Count('pk'))
+                            .order_by())
+    for row in rows:
+        counts[row['approval_status']] = row['count']
+    return counts
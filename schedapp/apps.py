@@ -6,3 +6,7 @@ class SchedappConfig(AppConfig):
     '''
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'schedapp'
+
+    def ready(self):
+        from . import checks, metrics, signals  # pylint: disable=import-outside-toplevel,unused-import
+        metrics.install()
@@ -0,0 +1,565 @@
+"""
+microbenchmarks for the hot paths, run with `python manage.py benchmark [name ...]`
+
+Everything runs offline: SIS is a local stub server and catalogs are made up
+from SAMPLE_COURSE, or from a recorded SIS response (--fixture). The ones that
+need a database (ingest, pages) build a scratch one the way the test runner
+does, so they never touch real data. Results come out as json with the
+revision and versions they were measured on (run_metadata), so runs can be
+saved with --output and compared across releases.
+"""
+import asyncio
+import copy
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl
+
+import django
+import requests
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test import Client, override_settings
+from django.test.utils import (CaptureQueriesContext, setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from django.urls import reverse
+from django.utils import timezone
+
+from .catalog import bulk_upsert_courses
+from .catalog_snapshot import TermSnapshot, clear_snapshots, load_term
+from .generator import ScheduleGenerator
+from .results import assemble_results, paginate_results
+from .models import ApprovalStatus, CartSummary, Course, Schedule, ScheduleSummary, ShoppingCart, jsonCourseFields
+from .sis import (_fetch_search_pages, fetch_search_pages, iter_search_pages, normalize_course, request_stats,
+                  reset_request_stats, search_query)
+from .sis_async import afetch_search_pages, httpx
+from .sis_stub import StubSISServer
+from .summaries import course_totals, schedule_totals
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """ registers a benchmark function under `name` """
+    def decorator(function):
+        BENCHMARKS[name] = function
+        return function
+    return decorator
+
+def percentile(samples, pct):
+    """ nearest-rank percentile of a list of numbers """
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(samples):
+    """ p50/p99/mean of a list of timings in seconds, reported in milliseconds """
+    return {
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(samples) * 1000, 3),
+    }
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(__file__), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_metadata():
+    """ what a run was measured on, so results from different releases and machines can be told apart """
+    return {
+        'started_at': timezone.now().isoformat(),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+@contextmanager
+def scratch_database():
+    """
+    a throwaway database, migrated the way the test runner does it, for
+    benchmarks that need data. Nothing in the real database is touched
+    """
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+    try:
+        yield
+    finally:
+        clear_snapshots()
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+# ------- Synthetic data -------
+SAMPLE_COURSE = {"index": 1, "crse_id": "001140", "crse_offer_nbr": 1, "strm": "1228", "session_code": "SRT", "session_descr": "Short Add", "class_section": "001", "location": "MAIN", "location_descr": "On Grounds", "start_dt": "08/23/2022", "end_dt": "12/06/2022", "class_stat": "A", "campus": "MAIN", "campus_descr": "Main Campus", "class_nbr": 15529, "acad_career": "UGRD", "acad_career_descr": "Undergraduate", "component": "LEC", "subject": "APMA", "subject_descr": "Applied Mathematics", "catalog_nbr": "1110", "class_type": "E", "schedule_print": "Y", "acad_group": "ENGR", "instruction_mode": "P", "instruction_mode_descr": "In Person", "acad_org": "APMA", "wait_tot": 0, "wait_cap": 0, "class_capacity": 45, "enrollment_total": 44, "enrollment_available": 1, "descr": "Single Variable Calculus II", "rqmnt_designtn": "", "units": "4", "combined_section": "N", "enrl_stat": "O", "enrl_stat_descr": "Open", "topic": "", "instructors": [{"name": "Monika Abramenko", "email": "ma2ke@virginia.edu"}], "section_type": "Lecture", "meetings": [{"days": "MoWeFr", "start_time": "09.00.00.000000-05:00", "end_time": "09.50.00.000000-05:00", "start_dt": "08/23/2022", "end_dt": "12/06/2022", "bldg_cd": "OLS", "bldg_has_coordinates": True, "facility_descr": "Olsson Hall 005", "room": "005", "facility_id": "OLS 005", "instructor": "Monika Abramenko"}], "crse_attr": "", "crse_attr_value": "", "reserve_caps": []}
+
+def make_sis_courses(count, first_class_nbr=10000):
+    """ `count` distinct courses shaped like raw SIS search results """
+    courses = []
+    for i in range(count):
+        course = copy.deepcopy(SAMPLE_COURSE)
+        course['index'] = i + 1
+        course['class_nbr'] = first_class_nbr + i
+        course['class_section'] = f'{i % 20 + 1:03}'
+        course['catalog_nbr'] = str(1000 + i // 20)
+        course['crse_id'] = f'{1000 + i // 20:06}'
+        courses.append(course)
+    return courses
+
+DAY_PATTERNS = ('MoWeFr', 'TuTh', 'MoWe', 'Mo', 'Tu', 'We', 'Th', 'Fr')
+
+def _reschedule(meeting, rng):
+    # moves a raw SIS meeting to random days and a random start time
+    start = rng.randrange(8 * 60, 20 * 60, 30)
+    length = 50 if rng.random() < 0.6 else 75
+    meeting['days'] = rng.choice(DAY_PATTERNS)
+    meeting['start_time'] = f'{start // 60:02}.{start % 60:02}.00.000000-05:00'
+    meeting['end_time'] = f'{(start + length) // 60:02}.{(start + length) % 60:02}.00.000000-05:00'
+    return meeting
+
+def make_courses(count, seed=0):
+    """ `count` unsaved Course objects with assorted days and start times """
+    rng = random.Random(seed)
+    courses = []
+    for course in make_sis_courses(count):
+        _reschedule(course['meetings'][0], rng)
+        courses.append(Course(**jsonCourseFields(normalize_course(course))))
+    return courses
+
+SUBJECTS = ('APMA', 'ASTR', 'BIOL', 'CHEM', 'CS', 'ECON', 'ENWR', 'HIST', 'MATH', 'PHYS', 'PSYC', 'STAT')
+
+def load_fixture(path):
+    """
+    the courses in a recorded SIS search response: a json list of course dicts
+    (what addJsonCourse takes), or an object with them under "courses"
+    """
+    with open(path, encoding='utf-8') as file:
+        data = json.load(file)
+    courses = data.get('courses') if isinstance(data, dict) else data
+    if not courses:
+        raise ValueError(f"no courses in {path}")
+    return courses
+
+def make_catalog(size, fixture=None, strm='1228', seed=0, sections=8, first_class_nbr=10000):
+    """
+    a made-up term of `size` sections shaped like raw SIS search results. Each
+    is a copy of one of the `fixture` courses (SAMPLE_COURSE if there are none)
+    with its own class_nbr, seat counts, and one or two meetings at random
+    times, spread over SUBJECTS about `sections` sections to a course
+    """
+    templates = fixture or [SAMPLE_COURSE]
+    rng = random.Random(seed)
+    catalog = []
+    for i in range(size):
+        course = copy.deepcopy(templates[i % len(templates)])
+        number = i // sections
+        capacity = rng.choice((20, 30, 45, 100, 250))
+        enrolled = rng.randint(0, capacity)
+        course.update(index=i + 1, class_nbr=first_class_nbr + i, strm=strm,
+                      subject=SUBJECTS[number % len(SUBJECTS)], catalog_nbr=str(1000 + number // len(SUBJECTS)),
+                      crse_id=f'{number:06}', class_section=f'{i % sections + 1:03}',
+                      class_capacity=capacity, enrollment_total=enrolled, enrollment_available=capacity - enrolled)
+        meeting = (course.get('meetings') or SAMPLE_COURSE['meetings'])[0]
+        course['meetings'] = [_reschedule(dict(meeting), rng) for _ in range(1 if rng.random() < 0.8 else 2)]
+        catalog.append(course)
+    return catalog
+
+# ------- Benchmarks -------
+def _sequential_search(url, params, max_pages=7):
+    """ the old course_list fetch loop: every page, one after another, no session """
+    courses = []
+    for page in range(1, max_pages + 1):
+        response = requests.get(url, params=search_query(params, page))
+        if response.status_code == 200:
+            courses.extend(response.json())
+    return courses
+
+@benchmark('search')
+def bench_search(iterations=20, latency=0.05, results=170, page_size=50, **_):
+    """
+    p50/p99 latency of one class search against a local stub SIS server with
+    `latency` seconds per request, sequential (old) vs concurrent fetching
+    """
+    params = {'term': '1228', 'subject': 'APMA'}
+    report = {'latency_s': latency, 'results': results, 'page_size': page_size}
+    with StubSISServer(make_sis_courses(results), page_size=page_size, latency=latency) as stub:
+        searches = (
+            ('sequential', lambda params: _sequential_search(stub.url, params)),
+            ('concurrent', fetch_search_pages),
+        )
+        with override_settings(SIS_SEARCH_URL=stub.url, SIS_PAGE_SIZE=None):
+            for label, search in searches:
+                samples = []
+                for _ in range(iterations):
+                    start = time.perf_counter()
+                    found = search(params)
+                    samples.append(time.perf_counter() - start)
+                report[label] = dict(summarize(samples), courses=len(found))
+    return report
+
+@benchmark('stream')
+def bench_stream(iterations=20, latency=0.05, results=170, page_size=50, **_):
+    """ time to the first page of results and to the whole search, streaming pages as they come in """
+    params = {'term': '1228', 'subject': 'APMA'}
+    report = {'latency_s': latency, 'results': results, 'page_size': page_size}
+    with StubSISServer(make_sis_courses(results), page_size=page_size, latency=latency) as stub:
+        with override_settings(SIS_SEARCH_URL=stub.url, SIS_PAGE_SIZE=None):
+            first, total = [], []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                for i, _courses in enumerate(iter_search_pages(params)):
+                    if not i:
+                        first.append(time.perf_counter() - start)
+                total.append(time.perf_counter() - start)
+    report['first_page'] = summarize(first)
+    report['all_pages'] = summarize(total)
+    return report
+
+@benchmark('async-search')
+def bench_async_search(iterations=20, latency=0.05, concurrency=20, results=170, page_size=50, **_):
+    """
+    searches per second one worker gets through when `concurrency` students
+    search at once: a sync worker takes them one at a time, an async worker
+    (one event loop, as under uvicorn) has them all in flight together
+    """
+    params = [{'term': '1228', 'subject': f'S{i}'} for i in range(concurrency)]
+    report = {'latency_s': latency, 'concurrency': concurrency, 'client': 'httpx' if httpx else 'threads'}
+
+    async def search_all():
+        return await asyncio.gather(*[afetch_search_pages(search) for search in params])
+
+    with StubSISServer(make_sis_courses(results), page_size=page_size, latency=latency) as stub:
+        workers = (
+            ('sync', lambda: [fetch_search_pages(search) for search in params]),
+            ('async', lambda: asyncio.run(search_all())),
+        )
+        with override_settings(SIS_SEARCH_URL=stub.url, SIS_PAGE_SIZE=None):
+            for label, run in workers:
+                samples = []
+                for _ in range(max(1, iterations // 10)):
+                    start = time.perf_counter()
+                    run()
+                    samples.append(time.perf_counter() - start)
+                report[label] = {'searches_per_second': round(concurrency / statistics.median(samples), 1),
+                                 'batch_p50_ms': round(statistics.median(samples) * 1000, 3)}
+    report['speedup'] = round(report['async']['searches_per_second'] / report['sync']['searches_per_second'], 1)
+    return report
+
+@benchmark('sis-errors')
+def bench_sis_errors(iterations=20, latency=0.05, recording=None, error_rates=(0.0, 0.05, 0.2, 1.0), seed=0, **_):
+    """
+    how searches hold up as SIS fails more of its requests: search time, the
+    share of searches that came back whole, and the retries and short circuits
+    it took, over `iterations` searches at each error rate. The stub server
+    replays `recording` (every search in it in turn) if there is one, and
+    waits `latency` seconds plus up to as much again per request, seeded so
+    every run sees the same jitter and errors. Resets this process's SIS
+    breakers and request stats
+    """
+    if recording is None:
+        searches = [{'term': '1228', 'subject': 'APMA'}]
+        served = {'courses': make_sis_courses(170), 'page_size': 50}
+    else:
+        searches = [dict(parse_qsl(key)) for key in recording.searches]
+        served = {'recording': recording}
+    report = {'latency_s': latency, 'searches': len(searches)}
+    for rate in error_rates:
+        reset_request_stats()
+        with StubSISServer(latency=latency, jitter=latency, error_rate=rate, seed=seed, **served) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url, SIS_PAGE_SIZE=None):
+                samples, whole = [], 0
+                for i in range(iterations):
+                    start = time.perf_counter()
+                    _courses, complete = _fetch_search_pages(searches[i % len(searches)])
+                    samples.append(time.perf_counter() - start)
+                    whole += complete
+        stats = request_stats()
+        report[f'error_rate_{rate}'] = dict(summarize(samples), complete=round(whole / iterations, 2),
+                                            requests=stats['requests'], retries=stats['retries'],
+                                            short_circuits=stats['short_circuits'], breaker=stats['breakers'].get(stub.url))
+    reset_request_stats()
+    return report
+
+def _legacy_conflicts_with(this, course):
+    """ Course.conflicts_with as it was: strptime on every call, first meeting only """
+    self_meetings = this.meetings
+    course_meetings = course.meetings
+    if this.strm == course.strm:
+        self_days = self_meetings[0]['days']
+        course_days = course_meetings[0]['days']
+        course_days_list = [course_days[i:i+2] for i in range(0, len(course_days), 2)]
+        for day in [self_days[i:i+2] for i in range(0, len(self_days), 2)]:
+            if day in course_days_list:
+                other_course_after = datetime.strptime(course_meetings[0]['start_time'], '%I:%M %p') > datetime.strptime(self_meetings[0]['end_time'], '%I:%M %p')
+                other_course_before = datetime.strptime(self_meetings[0]['start_time'], '%I:%M %p') > datetime.strptime(course_meetings[0]['end_time'], '%I:%M %p')
+                if not other_course_after and not other_course_before:
+                    return True
+    return False
+
+@benchmark('conflicts')
+def bench_conflicts(iterations=20, courses=200, **_):
+    """ conflict checks per second, old strptime implementation vs precomputed intervals """
+    catalog = make_courses(courses)
+    pairs = [(first, second) for first in catalog for second in catalog[:50]]
+    report = {'pairs': len(pairs)}
+    checks = (
+        ('strptime', _legacy_conflicts_with),
+        ('intervals', Course.conflicts_with),
+    )
+    for label, check in checks:
+        samples = []
+        for _ in range(max(1, iterations // 4)):
+            start = time.perf_counter()
+            for first, second in pairs:
+                check(first, second)
+            samples.append(time.perf_counter() - start)
+        report[label] = {'checks_per_second': round(len(pairs) / min(samples))}
+    report['speedup'] = round(report['intervals']['checks_per_second'] / report['strptime']['checks_per_second'], 1)
+    return report
+
+def make_cart(course_count, sections, seed=0):
+    """ a cart of `course_count` courses with `sections` sections each, as unsaved Course objects """
+    cart = make_courses(course_count * sections, seed)
+    for i, course in enumerate(cart):
+        course.catalog_nbr = str(1000 + i // sections)
+    return cart
+
+@benchmark('generator')
+def bench_generator(iterations=20, sections=12, time_budget=5.0, **_):
+    """ time to find the top 10 schedules for carts of 8-10 courses with `sections` sections each """
+    report = {'sections_per_course': sections}
+    for course_count in (8, 9, 10):
+        samples = []
+        for seed in range(iterations):
+            generator = ScheduleGenerator(make_cart(course_count, sections, seed), time_budget=time_budget)
+            start = time.perf_counter()
+            for _ in generator:
+                pass
+            samples.append(time.perf_counter() - start)
+        report[f'{course_count}_courses'] = dict(summarize(samples), explored=generator.explored,
+                                                 found=len(generator.results()), complete=generator.complete)
+    return report
+
+@benchmark('render')
+def bench_render(iterations=20, results=600, **_):
+    """
+    time to assemble and render the course list's results for a big subject
+    (`results` sections, like CS or MATH in a fall term): every section twice,
+    as course_list used to, vs deduplicated, grouped and one page at a time
+    """
+    courses = [normalize_course(course) for course in make_sis_courses(results)]
+    report = {'results': results}
+    renders = (
+        ('all_twice', lambda: [group for group in assemble_results(courses) for _ in (0, 1)]),
+        ('paginated', lambda: paginate_results(assemble_results(courses), 1).object_list),
+    )
+    for label, groups in renders:
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            html = render_to_string('common/includes/course_cards.html', {'groups': groups(), 'csrf_token': 'benchmark'})
+            samples.append(time.perf_counter() - start)
+        report[label] = dict(summarize(samples), html_kb=round(len(html) / 1024))
+    return report
+
+def _traced(build):
+    # what build() returns, and the bytes it still holds on to
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        built = build()
+        return built, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+@benchmark('snapshot')
+def bench_snapshot(iterations=20, sections=10000, **_):
+    """
+    memory and lookup time for a full term (`sections` sections) held as Course
+    objects vs the catalog snapshot's CourseRecords. A lookup is a class_nbr to
+    its meeting intervals: for a Course that's the json decode the ORM does for
+    its row (every JSONField), for a record it's unpacking its interval array.
+    Neither counts the database round trip the snapshot saves
+    """
+    courses, course_bytes = _traced(lambda: make_courses(sections))
+    snapshot, snapshot_bytes = _traced(lambda: TermSnapshot.from_courses('1228', courses))
+    json_fields = [field.attname for field in Course._meta.fields if field.get_internal_type() == 'JSONField']
+    rows = {course.class_nbr: {field: json.dumps(getattr(course, field)) for field in json_fields} for course in courses}
+    rng = random.Random(0)
+    lookups = [rng.choice(courses).class_nbr for _ in range(1000)]
+
+    def from_row(class_nbr):
+        decoded = {field: json.loads(value) for field, value in rows[class_nbr].items()}
+        return decoded['meeting_times']
+
+    report = {'sections': sections}
+    cases = (
+        ('courses', course_bytes, from_row),
+        ('snapshot', snapshot_bytes, lambda class_nbr: snapshot.get(class_nbr).get_meeting_times()),
+    )
+    for label, size, lookup in cases:
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            for class_nbr in lookups:
+                lookup(class_nbr)
+            samples.append((time.perf_counter() - start) / len(lookups))
+        report[label] = dict(bytes_per_section=round(size / sections), total_mb=round(size / 2 ** 20, 1),
+                             lookup_us=round(statistics.median(samples) * 10 ** 6, 2))
+    report['memory_ratio'] = round(course_bytes / snapshot_bytes, 1)
+    return report
+
+# ------- Benchmarks with a database -------
+DEFAULT_SIZES = (1000, 10000, 50000)
+STUDENTS_PER_ADVISOR = 200
+
+def _with_seat_changes(catalog, every=10):
+    # the catalog again with every `every`th section's seats taken, as a later search would see it
+    changed = []
+    for i, course in enumerate(catalog):
+        if i % every == 0 and course['enrollment_available']:
+            course = dict(course, enrollment_total=course['enrollment_total'] + 1,
+                          enrollment_available=course['enrollment_available'] - 1)
+        changed.append(course)
+    return changed
+
+@benchmark('ingest')
+def bench_ingest(sizes=DEFAULT_SIZES, fixture=None, **_):
+    """
+    search ingestion: bulk_upsert_courses of a made-up term of each size into
+    an empty scratch database, then the same results again (nothing changed),
+    then with a tenth of the sections' seat counts changed, as a repeat search
+    brings them in. Each size gets its own class_nbrs
+    """
+    report = {}
+    first_class_nbr = 10000
+    with scratch_database():
+        for size in sizes:
+            catalog = make_catalog(size, fixture, first_class_nbr=first_class_nbr)
+            first_class_nbr += size
+            rounds = (('insert', catalog), ('unchanged', catalog), ('seats_changed', _with_seat_changes(catalog)))
+            report[str(size)] = results = {}
+            for label, courses in rounds:
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    stats = bulk_upsert_courses(courses)
+                    seconds = time.perf_counter() - start
+                results[label] = dict(stats._asdict(), seconds=round(seconds, 3),
+                                      courses_per_second=round(size / seconds), queries=len(queries))
+    return report
+
+def populate_users(students, class_nbrs, strm='1228', schedule_size=6, cart_size=8, seed=0):
+    """
+    bulk-creates `students` students and an advisor for every
+    STUDENTS_PER_ADVISOR of them. Each student gets a schedule of
+    `schedule_size` of `class_nbrs` in a random approval status, submitted to
+    their advisor unless it's unsubmitted, and a cart of `cart_size` in `strm`.
+    returns (schedules, advisors)
+    """
+    User = get_user_model()
+    rng = random.Random(seed)
+    advisors = User.objects.bulk_create([User(username=f'advisor{i}', name=f'Advisor {i}', is_advisor=True, password='!')
+                                         for i in range(max(1, students // STUDENTS_PER_ADVISOR))])
+    learners = User.objects.bulk_create([User(username=f'student{i}', name=f'Student {i}', password='!')
+                                         for i in range(students)])
+
+    now = timezone.now()
+    schedules = []
+    for i, student in enumerate(learners):
+        status = rng.choice(list(ApprovalStatus)).value
+        submitted_at = None if status == ApprovalStatus.UN.value else now - timedelta(minutes=i)
+        schedules.append(Schedule(student=student, approver=advisors[i % len(advisors)], name=f'Schedule {i}',
+                                  approval_status=status, submitted_at=submitted_at))
+    schedules = Schedule.objects.bulk_create(schedules, batch_size=1000)
+    carts = ShoppingCart.objects.bulk_create([ShoppingCart(user=student, strm=int(strm)) for student in learners],
+                                             batch_size=1000)
+
+    ScheduleCourse = Schedule.courses.through
+    CartCourse = ShoppingCart.courses.through
+    in_schedules = [rng.sample(class_nbrs, schedule_size) for _ in schedules]
+    ScheduleCourse.objects.bulk_create([ScheduleCourse(schedule_id=schedule.pk, course_id=class_nbr)
+                                        for schedule, schedule_nbrs in zip(schedules, in_schedules)
+                                        for class_nbr in schedule_nbrs], batch_size=1000)
+    in_carts = [rng.sample(class_nbrs, cart_size) for _ in carts]
+    CartCourse.objects.bulk_create([CartCourse(shoppingcart_id=cart.pk, course_id=class_nbr)
+                                    for cart, cart_nbrs in zip(carts, in_carts) for class_nbr in cart_nbrs],
+                                   batch_size=1000)
+    # bulk inserts skip the signals that keep summaries, so make them here
+    ScheduleSummary.objects.bulk_create([ScheduleSummary(schedule=schedule, **schedule_totals(schedule_nbrs))
+                                         for schedule, schedule_nbrs in zip(schedules, in_schedules)], batch_size=1000)
+    summaries = []
+    for student, cart_nbrs in zip(learners, in_carts):
+        summary = CartSummary(user=student)
+        summary.set_terms([dict(strm=int(strm), **course_totals(cart_nbrs))])
+        summaries.append(summary)
+    CartSummary.objects.bulk_create(summaries, batch_size=1000)
+    return schedules, advisors
+
+def time_pages(schedules, advisors, iterations=20, strm='1228'):
+    """
+    p50/p99 time, and the most queries made, to render a student's schedule
+    detail and schedule list, an advisor's approval queue and a student's
+    shopping cart, each for `iterations` different users, through the whole
+    middleware stack
+    """
+    pages = (
+        ('schedule_detail', [(schedule.student, reverse('student-schedule-detail', args=[schedule.pk]))
+                             for schedule in schedules[:iterations]]),
+        ('schedule_list', [(schedule.student, reverse('student-schedule-list')) for schedule in schedules[:iterations]]),
+        ('advisor_queue', [(advisors[i % len(advisors)], reverse('advisor-schedule-list'))
+                           for i in range(iterations)]),
+        ('cart', [(schedule.student, f"{reverse('shopping_cart')}?strm={strm}")
+                  for schedule in schedules[:iterations]]),
+    )
+    client = Client()
+    report = {}
+    for label, visits in pages:
+        samples, queries = [], []
+        for user, url in visits:
+            client.force_login(user)
+            start = time.perf_counter()
+            response = client.get(url)
+            samples.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"{url} returned {response.status_code}")
+            queries.append(response.wsgi_request.metrics.queries)
+        report[label] = dict(summarize(samples), queries=max(queries))
+    return report
+
+@benchmark('pages')
+def bench_pages(iterations=20, sizes=DEFAULT_SIZES, users=10000, fixture=None, **_):
+    """
+    schedule detail, advisor queue and cart render times (see time_pages) in a
+    scratch database with `users` students (see populate_users), as the
+    catalog grows through each size. The students' schedules and carts are
+    made once, from the smallest catalog. Also the time to rebuild the term's
+    catalog snapshot (done off the request path) at each size
+    """
+    sizes = sorted(sizes)
+    catalog = make_catalog(sizes[-1], fixture)
+    report = {'users': users}
+    # over-budget views are reported here, not raised
+    with scratch_database(), override_settings(QUERY_BUDGET_STRICT=False):
+        schedules = advisors = None
+        loaded = 0
+        for size in sizes:
+            bulk_upsert_courses(catalog[loaded:size])
+            loaded = size
+            if schedules is None:
+                schedules, advisors = populate_users(users, [course['class_nbr'] for course in catalog[:size]])
+            report[str(size)] = time_pages(schedules, advisors, iterations)
+            start = time.perf_counter()
+            load_term('1228')
+            report[str(size)]['snapshot_rebuild_ms'] = round((time.perf_counter() - start) * 1000, 3)
+    return report
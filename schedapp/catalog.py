@@ -0,0 +1,180 @@
+# pylint: disable=no-member
+"""
+the local mirror of the SIS course catalog: syncing whole terms into the
+Course table, and answering searches from it
+"""
+import json
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .catalog_snapshot import SNAPSHOT_FIELDS, invalidate_term
+from .models import Course, CatalogSync, Meeting, jsonCourseFields
+from .sis import fetch_search_page, normalize_course
+
+IngestStats = namedtuple('IngestStats', ['inserted', 'updated', 'unchanged'])
+
+class SyncError(Exception):
+    """ a term sync couldn't finish; its watermark says where to pick back up """
+
+def bulk_upsert_courses(courses, batch_size=500):
+    """
+    writes SIS course dicts to the Course table in a handful of queries: one to
+    find which class_nbrs we already have, then bulk inserts for the new ones
+    and bulk updates (of only the fields that changed, e.g. enrollment counts)
+    for the ones that differ from what we have stored. The Meeting rows of new
+    courses, and of courses whose meetings changed, are rewritten too.
+
+    returns IngestStats(inserted, updated, unchanged)
+    """
+    rows = {}
+    for course in courses:
+        fields = jsonCourseFields(normalize_course(course))
+        rows[fields['class_nbr']] = fields
+
+    existing = Course.objects.in_bulk(list(rows))
+    new_courses = []
+    changed_courses = []
+    changed_fields = set()
+    moved_courses = []  # courses whose Meeting rows need rewriting
+    snapshot_strms = set()  # terms whose catalog snapshot this makes stale
+    for class_nbr, fields in rows.items():
+        current = existing.get(class_nbr)
+        if current is None:
+            new_courses.append(Course(**fields))
+            snapshot_strms.add(fields['strm'])
+            continue
+        changed = [name for name, value in fields.items() if getattr(current, name) != value]
+        if set(changed) & set(SNAPSHOT_FIELDS):
+            snapshot_strms.update((current.strm, fields['strm']))
+        if changed:
+            for name in changed:
+                setattr(current, name, fields[name])
+            changed_courses.append(current)
+            changed_fields.update(changed)
+            if 'meetings' in changed or 'strm' in changed:
+                moved_courses.append(current)
+
+    with transaction.atomic():
+        # another search may have inserted some of these since we looked, that's fine
+        Course.objects.bulk_create(new_courses, batch_size=batch_size, ignore_conflicts=True)
+        if changed_courses:
+            Course.objects.bulk_update(changed_courses, sorted(changed_fields), batch_size=batch_size)
+        if new_courses or moved_courses:
+            Meeting.replace_for(new_courses + moved_courses)
+        invalidate_term(*snapshot_strms)
+
+    return IngestStats(len(new_courses), len(changed_courses),
+                       len(rows) - len(new_courses) - len(changed_courses))
+
+# ------- Page sources for a sync -------
+def sis_pages(strm, start_page=1, delay=0):
+    """
+    yields (page, courses) for every page of a term from the SIS api, starting
+    at start_page, waiting `delay` seconds between requests to stay under
+    their rate limits. raises SyncError if a page can't be fetched.
+    """
+    page = start_page
+    while True:
+        page, courses, ok = fetch_search_page({'term': strm}, page)
+        if not ok:
+            raise SyncError(f"could not fetch page {page} of term {strm} from SIS")
+        yield page, courses
+        if not courses:
+            return
+        page += 1
+        if delay:
+            time.sleep(delay)
+
+def file_pages(path, start_page=1, page_size=100):
+    """
+    yields (page, courses) from a json dump of SIS courses (a list of course
+    dicts), cut into pages of page_size so a sync from a file can be resumed too
+    """
+    with open(path, encoding='utf-8') as dump:
+        courses = json.load(dump)
+    page = start_page
+    while True:
+        chunk = courses[(page - 1) * page_size:page * page_size]
+        yield page, chunk
+        if not chunk:
+            return
+        page += 1
+
+# ------- Syncing -------
+def sync_term(strm, pages, source='', log=None):
+    """
+    syncs one term into the Course table from an iterable of (page, courses).
+
+    Each page is written in the same transaction that moves the term's
+    watermark past it, so if we're stopped partway through the next sync starts
+    at the first page we didn't finish. A page that comes back empty, or
+    shorter than a full page, is the end of the term.
+    returns the term's CatalogSync row.
+    """
+    sync, _ = CatalogSync.objects.get_or_create(strm=strm)
+    if not sync.in_progress:
+        sync.started_at = timezone.now()
+        sync.courses_synced = 0
+        sync.page_size = settings.SIS_PAGE_SIZE
+    sync.source = source
+    sync.save()
+
+    for page, courses in pages:
+        with transaction.atomic():
+            stats = bulk_upsert_courses(courses)
+            written = len(courses)
+            last = not courses or (sync.page_size and len(courses) < sync.page_size)
+            if page == 1 and courses and not sync.page_size:
+                sync.page_size = len(courses)
+            sync.courses_synced += written
+            if last:
+                sync.next_page = 1
+                sync.completed_at = timezone.now()
+            else:
+                sync.next_page = page + 1
+            sync.save()
+        if log:
+            log(f"term {strm} page {page}: {stats.inserted} new, {stats.updated} updated, {stats.unchanged} unchanged")
+        if last:
+            break
+    return sync
+
+def start_page(strm, restart=False):
+    """ where the next sync of a term should start """
+    if restart:
+        CatalogSync.objects.filter(strm=strm).update(next_page=1)
+        return 1
+    sync = CatalogSync.objects.filter(strm=strm).first()
+    return sync.next_page if sync else 1
+
+# ------- Searching -------
+# course_list search parameter -> Course field
+SEARCH_FIELDS = {
+    'term': 'strm',
+    'subject': 'subject',
+    'acad_org': 'acad_org',
+    'catalog_nbr': 'catalog_nbr',
+    'instruction_mode': 'instruction_mode',
+    'session_code': 'session_code',
+    'location': 'location',
+}
+
+def search_local(params):
+    """ a class search (same parameters as the SIS one) answered from the Course table """
+    courses = Course.objects.all()
+    for param, field in SEARCH_FIELDS.items():
+        if params.get(param):
+            courses = courses.filter(**{field: params[param]})
+
+    keyword = params.get('keyword')
+    if keyword:
+        courses = courses.filter(Q(descr__icontains=keyword)
+                                 | Q(topic__icontains=keyword)
+                                 | Q(subject_descr__icontains=keyword)
+                                 | Q(instructors__icontains=keyword))
+    return courses.order_by('subject', 'catalog_nbr', 'class_section')
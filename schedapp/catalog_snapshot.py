@@ -0,0 +1,275 @@
+# pylint: disable=no-member
+"""
+a read-only, in-process copy of a term's catalog for the hot paths that only
+need to know a course exists, what it's called and when it meets (adding to a
+cart or a schedule, conflict checks), so they don't fetch a whole Course row
+and decode its meetings json on every request.
+
+A TermSnapshot holds one CourseRecord per section: a __slots__ object with the
+few fields those paths use and its meeting intervals packed into an array of
+unsigned shorts (minutes since Monday never pass 7 * 24 * 60). Records have
+pk, strm and get_meeting_times() like a Course, so ScheduleIndex and
+conflicting_pairs take either.
+
+Every term has a version token in the default cache. A snapshot remembers the
+token it was built at and, once the token changes, is rebuilt in a background
+thread and swapped in whole, so readers never see half of one; until then
+lookups in that term read the Course table. Only the token of the term a
+lookup is in is checked. A process keeps at most CATALOG_SNAPSHOT_TERMS
+terms, the most recently used, and only loads terms courses were found in. invalidate_term changes it, and is
+called whenever a course's name, section or meetings change: on Course saves
+and deletes (signals.py) and from bulk_upsert_courses. Seat counts aren't in
+the snapshot, so seat updates leave it alone. Every process serving requests
+(and the sync_catalog and refresh_seats commands) has to share the default
+cache (CACHE_URL, checked by `manage.py check --deploy`), or they won't see
+each other's invalidations. Even so, a snapshot is only trusted to say what a
+course looks like, never that it doesn't exist: a course the table has but
+the snapshot doesn't is read from the table, and its term marked out of date.
+"""
+import sys
+import threading
+import uuid
+from array import array
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+
+from .models import Course
+
+CACHE_ALIAS = 'default'
+VERSION_KEY = 'catalog-snapshot'
+
+# the Course fields a snapshot copies, in CourseRecord order (meeting_times last)
+SNAPSHOT_FIELDS = ('class_nbr', 'strm', 'crse_id', 'subject', 'catalog_nbr', 'class_section',
+                   'component', 'units', 'descr', 'meeting_times')
+
+class CourseRecord:
+    """ the parts of a Course the catalog snapshot keeps, in as little memory as we can """
+    __slots__ = SNAPSHOT_FIELDS[:-1] + ('times',)
+
+    def __init__(self, class_nbr, strm, crse_id, subject, catalog_nbr, class_section, component, units, descr,
+                 meeting_times):
+        self.class_nbr = class_nbr
+        # codes repeat across thousands of sections, so keep one copy of each
+        self.strm = _intern(strm)
+        self.crse_id = _intern(crse_id)
+        self.subject = _intern(subject)
+        self.catalog_nbr = _intern(catalog_nbr)
+        self.class_section = _intern(class_section)
+        self.component = _intern(component)
+        self.units = _intern(units)
+        self.descr = descr
+        # [start, end, start, end, ...]
+        self.times = array('H', [minute for interval in meeting_times for minute in interval])
+
+    @property
+    def pk(self):
+        return self.class_nbr
+
+    def get_meeting_times(self):
+        times = self.times
+        return list(zip(times[::2], times[1::2]))
+
+    def __str__(self):
+        return f'{self.subject} {self.catalog_nbr}'
+
+    def __repr__(self):
+        return f'<CourseRecord: {self}>'
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class TermSnapshot:
+    """ every section of one term, by class_nbr, as of `version` """
+    def __init__(self, strm, records, version=None):
+        self.strm = strm
+        self.version = version
+        self.records = {record.class_nbr: record for record in records}
+
+    @classmethod
+    def from_courses(cls, strm, courses, version=None):
+        """ a snapshot of Course objects (saved or not) """
+        return cls(strm, (CourseRecord(*(getattr(course, name) for name in SNAPSHOT_FIELDS[:-1]),
+                                       course.get_meeting_times())
+                          for course in courses), version)
+
+    def get(self, class_nbr):
+        return self.records.get(class_nbr)
+
+    def __contains__(self, class_nbr):
+        return class_nbr in self.records
+
+    def __len__(self):
+        return len(self.records)
+
+# ------- Versions -------
+def _version_key(strm):
+    return f'{VERSION_KEY}:{strm}'
+
+def term_version(strm):
+    """ the term's current version token, making one up if the cache has lost it """
+    cache = caches[CACHE_ALIAS]
+    version = cache.get(_version_key(strm))
+    if version is None:
+        cache.add(_version_key(strm), uuid.uuid4().hex, None)
+        version = cache.get(_version_key(strm))
+    return version
+
+def _bump(strms):
+    caches[CACHE_ALIAS].set_many({_version_key(strm): uuid.uuid4().hex for strm in strms}, None)
+
+def invalidate_term(*strms):
+    """
+    marks the snapshots of these terms out of date, in every process sharing
+    the cache. It's done now, for this transaction's own reads, and again once
+    it commits, so no one keeps a snapshot rebuilt from before the change
+    """
+    strms = {str(strm) for strm in strms if strm is not None}
+    if strms:
+        _bump(strms)
+        transaction.on_commit(lambda: _bump(strms))
+
+# ------- Loaded snapshots -------
+# strm -> TermSnapshot, least recently used first
+_snapshots = OrderedDict()
+_building = set()  # terms being rebuilt in the background
+_lock = threading.Lock()
+
+def load_term(strm):
+    """ a fresh snapshot of a term from the Course table """
+    version = term_version(strm)
+    courses = Course.objects.filter(strm=strm).values_list(*SNAPSHOT_FIELDS)
+    records = (CourseRecord(*row) for row in courses.iterator())
+    return TermSnapshot(strm, records, version)
+
+def _store(snapshot):
+    # keeps only terms that have courses, and only the CATALOG_SNAPSHOT_TERMS most recently used
+    with _lock:
+        if not snapshot:
+            _snapshots.pop(snapshot.strm, None)
+            return
+        _snapshots[snapshot.strm] = snapshot
+        _snapshots.move_to_end(snapshot.strm)
+        while len(_snapshots) > getattr(settings, 'CATALOG_SNAPSHOT_TERMS', 4):
+            _snapshots.popitem(last=False)
+
+def _rebuild(strm):
+    try:
+        _store(load_term(strm))
+    finally:
+        with _lock:
+            _building.discard(strm)
+        connections.close_all()
+
+def _rebuild_later(strm):
+    """
+    rebuilds a term's snapshot off the request path, in a thread (one per term
+    at a time), or right away (returning it) if CATALOG_SNAPSHOT_BACKGROUND is off
+    """
+    if not getattr(settings, 'CATALOG_SNAPSHOT_BACKGROUND', True):
+        snapshot = load_term(strm)
+        _store(snapshot)
+        return snapshot
+    with _lock:
+        if strm in _building:
+            return None
+        _building.add(strm)
+    threading.Thread(target=_rebuild, args=(strm,), name=f'catalog-snapshot-{strm}', daemon=True).start()
+    return None
+
+def term_snapshot(strm):
+    """ this process's snapshot of a term, rebuilt first (here and now) if the catalog has changed since it was taken """
+    strm = str(strm)
+    snapshot = _snapshots.get(strm)
+    if snapshot is None or snapshot.version != term_version(strm):
+        snapshot = load_term(strm)
+        _store(snapshot)
+    return snapshot
+
+def clear_snapshots():
+    """ drops every loaded snapshot, e.g. between tests """
+    with _lock:
+        _snapshots.clear()
+
+def _fresh(strm):
+    # the loaded snapshot of a term if it's up to date; a stale one is rebuilt and, meanwhile, not used
+    snapshot = _snapshots.get(strm)
+    if snapshot is None:
+        return None
+    if snapshot.version != term_version(strm):
+        return _rebuild_later(strm)
+    with _lock:
+        if strm in _snapshots:
+            _snapshots.move_to_end(strm)
+    return snapshot
+
+def _missed(strms):
+    # courses of these terms had to be read from the table
+    for strm in {str(strm) for strm in strms if strm is not None}:
+        snapshot = _snapshots.get(strm)
+        if snapshot is None:
+            _rebuild_later(strm)
+        elif snapshot.version == term_version(strm):
+            # added since the snapshot was taken, by something whose invalidation we didn't see
+            invalidate_term(strm)
+        # otherwise it's already being rebuilt
+
+def _loaded_term(class_nbr, first=None):
+    # the term of the loaded snapshot holding a class_nbr, without checking it's up to date
+    snapshots = list(_snapshots.items())
+    if first is not None:
+        snapshots.sort(key=lambda item: item[0] != first)
+    return next((strm for strm, snapshot in snapshots if class_nbr in snapshot), None)
+
+def catalog_course(class_nbr, strm=None):
+    """
+    the CourseRecord for a class_nbr, or None if there's no such course. It's
+    looked for in the loaded snapshots (`strm` first), and only that term's
+    version is checked. A course that isn't in an up to date snapshot comes
+    back as the Course itself (one query), and its term is loaded or rebuilt
+    """
+    try:
+        class_nbr = int(class_nbr)
+    except (TypeError, ValueError):
+        return None
+    loaded = _loaded_term(class_nbr, None if strm is None else str(strm))
+    snapshot = _fresh(loaded) if loaded is not None else None
+    if snapshot is not None and class_nbr in snapshot:
+        return snapshot.get(class_nbr)
+
+    course = Course.objects.filter(pk=class_nbr).first()
+    if course is not None:
+        _missed([course.strm])
+    return course
+
+def catalog_courses(class_nbrs):
+    """
+    the CourseRecords for many class_nbrs at once, by class_nbr, checking the
+    version of only the terms they're in. Any that aren't in an up to date
+    snapshot come back as Course objects, in one query
+    """
+    by_term = defaultdict(list)
+    missing = []
+    for class_nbr in class_nbrs:
+        strm = _loaded_term(class_nbr)
+        if strm is None:
+            missing.append(class_nbr)
+        else:
+            by_term[strm].append(class_nbr)
+
+    found = {}
+    for strm, in_term in by_term.items():
+        snapshot = _fresh(strm)
+        for class_nbr in in_term:
+            record = snapshot.get(class_nbr) if snapshot is not None else None
+            if record is None:
+                missing.append(class_nbr)
+            else:
+                found[class_nbr] = record
+    if missing:
+        courses = Course.objects.in_bulk(missing)
+        found.update(courses)
+        _missed(course.strm for course in courses.values())
+    return found
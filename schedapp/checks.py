@@ -0,0 +1,19 @@
+"""
+system checks, registered in SchedappConfig.ready
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PER_PROCESS_CACHES = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """ the catalog snapshot versions have to be seen by every process, so the default cache can't be per-process """
+    if settings.CACHES.get('default', {}).get('BACKEND') in PER_PROCESS_CACHES:
+        return [Error(
+            "The default cache is per-process, so catalog changes made by one worker or management command "
+            "won't reach the catalog snapshots of the others.",
+            hint="Set CACHE_URL to a redis:// or file:// cache every process shares.",
+            id='schedapp.E001',
+        )]
+    return []
@@ -0,0 +1,151 @@
+"""
+schedule-level conflict detection, built on the meeting intervals from meetings.py.
+
+ScheduleIndex keeps every meeting interval of a set of courses sorted by start
+time (per term), along with a running maximum of their end times, so asking
+whether a new course fits is a binary search per meeting instead of a pairwise
+comparison against every course. conflicting_pairs finds every conflict in a
+set of courses with one sweep over the sorted intervals. exclude_conflicts
+does the same kind of check in SQL, against the indexed Meeting table, for
+course searches that only want what fits a schedule (search.search_courses).
+"""
+import heapq
+from bisect import bisect_right
+from itertools import accumulate
+
+from django.db.models import Q
+
+from .meetings import MINUTES_PER_DAY
+from .models import Meeting
+
+class _TermIndex:
+    """ the meeting intervals of the courses in one term, sorted when first asked about """
+    def __init__(self):
+        self.intervals = []  # (start, end, class_nbr), sorted once starts is set
+        self.starts = None
+        self.max_ends = None  # max_ends[i] is the latest end among intervals[:i+1]
+
+    def add(self, class_nbr, intervals):
+        self.intervals.extend((start, end, class_nbr) for start, end in intervals)
+        self.starts = None
+
+    def _prepare(self):
+        # one sort for however many courses were added since the last question
+        if self.starts is None:
+            self.intervals.sort()
+            self.starts = [interval[0] for interval in self.intervals]
+            self.max_ends = list(accumulate((interval[1] for interval in self.intervals), max))
+
+    def overlaps(self, start, end):
+        """ whether anything overlaps [start, end], in O(log n) """
+        self._prepare()
+        before = bisect_right(self.starts, end)
+        return before > 0 and self.max_ends[before - 1] >= start
+
+    def overlapping(self, start, end):
+        """ the class_nbrs of everything overlapping [start, end] """
+        self._prepare()
+        found = []
+        i = bisect_right(self.starts, end) - 1
+        # nothing at or before i can overlap once the latest end there is before our start
+        while i >= 0 and self.max_ends[i] >= start:
+            if self.intervals[i][1] >= start:
+                found.append(self.intervals[i][2])
+            i -= 1
+        return found
+
+class ScheduleIndex:
+    """
+    an index of the meeting times of a set of courses (e.g. a schedule or a cart)
+
+        index = ScheduleIndex(schedule.courses.all())
+        if not index.fits(course): ...
+    """
+    def __init__(self, courses=()):
+        self.courses = {}
+        self._terms = {}
+        for course in courses:
+            self.add(course)
+
+    def add(self, course):
+        if course.pk in self.courses:
+            return
+        self.courses[course.pk] = course
+        self._terms.setdefault(course.strm, _TermIndex()).add(course.pk, course.get_meeting_times())
+
+    def fits(self, course):
+        """ whether `course` can be added without a conflict """
+        term = self._terms.get(course.strm)
+        if term is None:
+            return True
+        return not any(term.overlaps(start, end) for start, end in course.get_meeting_times())
+
+    def conflicts_for(self, course):
+        """ the courses in the index that `course` conflicts with, not counting itself """
+        term = self._terms.get(course.strm)
+        if term is None:
+            return []
+        found = {}
+        for start, end in course.get_meeting_times():
+            for class_nbr in term.overlapping(start, end):
+                if class_nbr != course.pk:
+                    found[class_nbr] = self.courses[class_nbr]
+        return sorted(found.values(), key=lambda other: other.pk)
+
+def conflicting_pairs(courses):
+    """
+    every pair of courses that conflict, as (course, course) tuples ordered by
+    class_nbr, found in one sweep over all meeting intervals sorted by start time
+    """
+    by_pk = {}
+    events = []
+    for course in courses:
+        if course.pk in by_pk:
+            continue
+        by_pk[course.pk] = course
+        for start, end in course.get_meeting_times():
+            events.append((course.strm or '', start, end, course.pk))
+    events.sort()
+
+    pairs = set()
+    active = []  # heap of (end, class_nbr) for the current term
+    term = None
+    for strm, start, end, class_nbr in events:
+        if strm != term:
+            term = strm
+            active = []
+        # anything that ended before this meeting starts is out of the running
+        while active and active[0][0] < start:
+            heapq.heappop(active)
+        for _, other in active:
+            if other != class_nbr:
+                pairs.add((min(other, class_nbr), max(other, class_nbr)))
+        heapq.heappush(active, (end, class_nbr))
+
+    return [(by_pk[first], by_pk[second]) for first, second in sorted(pairs)]
+
+def conflicting_meetings(schedule_courses):
+    """
+    the Meeting rows that overlap a meeting of one of `schedule_courses`, or
+    None if they don't meet at all
+    """
+    overlapping = Q()
+    for course in schedule_courses:
+        for start, end in course.get_meeting_times():
+            day = start // MINUTES_PER_DAY
+            offset = day * MINUTES_PER_DAY
+            # inclusive, like intervals_overlap: back to back classes conflict
+            overlapping |= Q(strm=course.strm, day=day, start_min__lte=end - offset, end_min__gte=start - offset)
+    if not overlapping:
+        return None
+    return Meeting.objects.filter(overlapping)
+
+def exclude_conflicts(courses, schedule_courses):
+    """
+    the `courses` queryset without any course that conflicts with one of
+    `schedule_courses`, checked in the database against the Meeting table
+    """
+    meetings = conflicting_meetings(schedule_courses)
+    if meetings is None:
+        return courses
+    return courses.exclude(pk__in=meetings.values('course_id'))
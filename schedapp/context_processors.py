@@ -0,0 +1,23 @@
+"""
+template context processors, listed in settings.TEMPLATES
+"""
+from django.utils.functional import SimpleLazyObject
+
+from .models import CartSummary
+
+def _student_cart_summary(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated or user.is_advisor:
+        return None
+    # the cart page has already read it
+    if getattr(request, 'cart_summary', None) is not None:
+        return request.cart_summary
+    # students get one when they sign up; the cart page builds any that are missing
+    return CartSummary.objects.filter(user=user).first()
+
+def cart(request):
+    """
+    cart_summary: a student's CartSummary, for the navbar, or None. It's only
+    looked up if a template uses it
+    """
+    return {'cart_summary': SimpleLazyObject(lambda: _student_cart_summary(request))}
@@ -1,7 +1,9 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth import REDIRECT_FIELD_NAME
 from django.contrib import messages
 from functools import wraps
 from django.contrib.auth.views import redirect_to_login
+from django.http import JsonResponse
 
 def advisor_required(function=None,
                      redirect_field_name=REDIRECT_FIELD_NAME,
@@ -49,6 +51,39 @@ def student_required(function=None,
         return decorator(function)
     return decorator
 
+def async_login_required(function=None,
+                         redirect_field_name=REDIRECT_FIELD_NAME,
+                         login_url=None):
+    """
+    login_required for async views. request.user is loaded from the session
+    (a database query) so it's looked at off the event loop.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            if await sync_to_async(lambda: request.user.is_authenticated)():
+                return await view_func(request, *args, **kwargs)
+            return redirect_to_login(request.get_full_path(), login_url, redirect_field_name)
+
+        return _wrapped_view
+
+    if function:
+        return decorator(function)
+    return decorator
+
+def api_login_required(view_func):
+    """
+    login_required for the json api (api.py): answers a 401 in json rather than
+    redirecting to the login page
+    """
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return view_func(request, *args, **kwargs)
+        return JsonResponse({'error': 'You need to log in.'}, status=401)
+
+    return _wrapped_view
+
 
 # /***************************************************************************************
 # *  REFERENCES
@@ -0,0 +1,228 @@
+"""
+builds conflict-free schedules out of a shopping cart.
+
+A cart holds several sections of each course a student is interested in. The
+generator picks one section per course (subject + catalog_nbr), keeps the
+total units inside the student's limits, and ranks what it finds by the
+student's preferences (no early classes, compact days).
+
+It's a backtracking search that always branches on the course with the
+fewest sections left that fit. Which sections conflict is worked out once up
+front, as a bitset per section, so "does this section fit with what we've
+picked so far" is a single AND. Every part of a schedule's score only grows
+as sections are added, so a branch can't end up better than its score with
+the best remaining section of any one course added. A branch is dropped as
+soon as a course has no section left that fits, the units can't land inside
+the limits, or that bound can't beat the worst schedule we're keeping. The
+search stops when it runs out of its time budget and returns the best it
+found.
+"""
+import heapq
+import math
+import time
+from collections import namedtuple
+
+from .conflicts import conflicting_pairs
+from .meetings import MINUTES_PER_DAY
+
+# how to rank schedules, lower scores are better:
+#   earliest      classes starting before this (minutes after midnight) are penalized
+#   early_weight  penalty per minute a class starts before `earliest`
+#   day_weight    penalty per day of the week with any class
+#   span_weight   penalty per minute from the first class starting to the last one ending, each day
+Preferences = namedtuple('Preferences', ['earliest', 'early_weight', 'day_weight', 'span_weight'],
+                         defaults=(9 * 60, 1, 60, 0.5))
+
+GeneratedSchedule = namedtuple('GeneratedSchedule', ['score', 'units', 'courses'])
+
+NO_CLASSES = (None,) * 7
+
+def parse_units(units):
+    """ (fewest, most) units for a Course.units string like "3" or "1 - 3" """
+    try:
+        values = [float(part) for part in str(units or '').split('-') if part.strip()]
+    except ValueError:
+        values = []
+    if not values:
+        return (0, 0)
+    low, high = min(values), max(values)
+    return (int(low) if low.is_integer() else low, int(high) if high.is_integer() else high)
+
+class _OutOfTime(Exception):
+    """ the search used up its time budget """
+
+class _Section:
+    """ one course in the cart, with everything the search needs precomputed """
+    __slots__ = ('course', 'low', 'high', 'early_cost', 'days')
+
+    def __init__(self, course, preferences):
+        self.course = course
+        self.low, self.high = parse_units(course.units)
+        intervals = course.get_meeting_times()
+        early = sum(max(0, preferences.earliest - start % MINUTES_PER_DAY) for start, _ in intervals)
+        self.early_cost = early * preferences.early_weight
+        # (day, first start, last end) for each day it meets
+        days = {}
+        for start, end in intervals:
+            day = start // MINUTES_PER_DAY
+            first, last = days.get(day, (start, end))
+            days[day] = (min(first, start), max(last, end))
+        self.days = tuple((day, first, last) for day, (first, last) in sorted(days.items()))
+
+class ScheduleGenerator:
+    """
+    enumerates conflict-free schedules from a cart's courses.
+
+    Iterating over a generator streams each schedule as it makes the running
+    top `limit`; results() gives the final top `limit`, best first.
+
+        generator = ScheduleGenerator(cart.courses.all(), max_units=17)
+        for schedule in generator: ...
+        generator.results()
+
+    Without unit limits every course in the cart has to be in the schedule.
+    With them, courses can be left out as long as the total fits.
+    """
+    def __init__(self, courses, min_units=None, max_units=None, preferences=None, limit=10, time_budget=1.0):
+        self.preferences = preferences or Preferences()
+        self.limit = limit
+        self.time_budget = time_budget
+        self.optional = min_units is not None or max_units is not None
+        self.min_units = min_units or 0
+        self.max_units = math.inf if max_units is None else max_units
+        self.explored = 0
+        self.complete = False
+        self._best = []  # heap of (-score, order, GeneratedSchedule), the worst kept schedule on top
+
+        unique = {}
+        for course in courses:
+            unique.setdefault(course.pk, course)
+        courses = list(unique.values())
+        self.sections = [_Section(course, self.preferences) for course in courses]
+
+        # conflicts[i] has bit j set when section i conflicts with section j
+        position = {course.pk: i for i, course in enumerate(courses)}
+        self.conflicts = [0] * len(courses)
+        for first, second in conflicting_pairs(courses):
+            i, j = position[first.pk], position[second.pk]
+            self.conflicts[i] |= 1 << j
+            self.conflicts[j] |= 1 << i
+
+        groups = {}
+        for i, section in enumerate(self.sections):
+            groups.setdefault((section.course.subject, section.course.catalog_nbr), []).append(i)
+        self.groups = sorted(groups.values(), key=len)
+
+        # the most units each course could add
+        self.units_left = [max(self.sections[i].high for i in group) for group in self.groups]
+
+    def __iter__(self):
+        self._deadline = time.monotonic() + self.time_budget
+        self.explored = 0
+        self._best = []
+        self.complete = False
+        try:
+            yield from self._search(tuple(range(len(self.groups))), 0, (), 0, 0, 0, NO_CLASSES)
+            self.complete = True
+        except _OutOfTime:
+            pass
+
+    def results(self):
+        """ the best schedules found, best first """
+        return sorted((entry[2] for entry in self._best), key=lambda schedule: (schedule.score, -len(schedule.courses)))
+
+    def _worst_kept(self):
+        return -self._best[0][0] if len(self._best) == self.limit else math.inf
+
+    def _added_cost(self, spans, section):
+        """ how much adding `section` raises the score of a schedule with these day spans """
+        preferences = self.preferences
+        cost = section.early_cost
+        for day, start, end in section.days:
+            current = spans[day]
+            if current is None:
+                cost += preferences.day_weight + (end - start) * preferences.span_weight
+            else:
+                first, last = current
+                cost += (max(last, end) - min(first, start) - (last - first)) * preferences.span_weight
+        return cost
+
+    def _options(self, g, blocked, low, score, spans):
+        """ (score, i) with each section of groups[g] that still fits added, best first """
+        options = []
+        for i in self.groups[g]:
+            if blocked >> i & 1:
+                continue
+            section = self.sections[i]
+            if low + section.low > self.max_units:
+                continue
+            options.append((score + self._added_cost(spans, section), i))
+        options.sort()
+        return options
+
+    def _search(self, remaining, blocked, chosen, low, high, score, spans):
+        self.explored += 1
+        if time.monotonic() > self._deadline:
+            raise _OutOfTime()
+
+        if not remaining:
+            if chosen:
+                yield from self._keep(chosen, score, low, high)
+            return
+
+        # look at every course still to be placed: the schedule can't end up
+        # better than adding the best section of any one of them, and we branch
+        # on the course with the fewest sections left that fit
+        worst = self._worst_kept()
+        g = options = None
+        for h in remaining:
+            fits = self._options(h, blocked, low, score, spans)
+            if not self.optional and (not fits or fits[0][0] >= worst):
+                return
+            if options is None or len(fits) < len(options):
+                g, options = h, fits
+        rest = tuple(h for h in remaining if h != g)
+        units_left = sum(self.units_left[h] for h in rest)
+
+        for bound, i in options:
+            section = self.sections[i]
+            if bound >= self._worst_kept():
+                break
+            if high + section.high + units_left < self.min_units:
+                continue
+            yield from self._search(rest, blocked | self.conflicts[i], chosen + (i,), low + section.low,
+                                    high + section.high, bound, _place(spans, section))
+        if self.optional and high + units_left >= self.min_units:
+            yield from self._search(rest, blocked, chosen, low, high, score, spans)
+
+    def _keep(self, chosen, score, low, high):
+        score = round(score, 2)
+        if score >= self._worst_kept():
+            return
+        courses = sorted((self.sections[i].course for i in chosen), key=lambda course: (course.subject, course.catalog_nbr))
+        units = low if low == high else f'{low} - {high}'
+        schedule = GeneratedSchedule(score, units, courses)
+        entry = (-score, -self.explored, schedule)
+        if len(self._best) == self.limit:
+            heapq.heapreplace(self._best, entry)
+        else:
+            heapq.heappush(self._best, entry)
+        yield schedule
+
+def _place(spans, section):
+    """ each day's (first start, last end) after adding a section's meetings """
+    spans = list(spans)
+    for day, start, end in section.days:
+        current = spans[day]
+        spans[day] = (start, end) if current is None else (min(current[0], start), max(current[1], end))
+    return tuple(spans)
+
+def generate_schedules(courses, min_units=None, max_units=None, preferences=None, limit=10, time_budget=1.0):
+    """
+    the top `limit` conflict-free schedules from `courses`, best first, found
+    within `time_budget` seconds. See ScheduleGenerator.
+    """
+    generator = ScheduleGenerator(courses, min_units, max_units, preferences, limit, time_budget)
+    for _ in generator:
+        pass
+    return generator.results()
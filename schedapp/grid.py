@@ -0,0 +1,61 @@
+"""
+the weekly timetable on the schedule detail pages.
+
+The grid is built once per page from the schedule's courses (one query), so
+the templates just walk rows and cells instead of looping over every course
+in every cell.
+"""
+from collections import namedtuple
+
+from .meetings import parse_days, parse_time
+
+DAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+# one meeting of a course, as shown in a grid cell
+GridEntry = namedtuple('GridEntry', ['course', 'meeting'])
+GridRow = namedtuple('GridRow', ['time', 'cells'])
+Grid = namedtuple('Grid', ['days', 'rows'])
+
+def slot_label(minutes):
+    """ 08:00am style label for a time in minutes after midnight """
+    hours, minutes = divmod(minutes, 60)
+    return f"{(hours - 1) % 12 + 1:02}:{minutes:02}{'am' if hours < 12 else 'pm'}"
+
+def schedule_grid(courses, first_hour=8, last_hour=23, slot_minutes=60):
+    """
+    the timetable for a list of courses: a row per `slot_minutes` from
+    first_hour to last_hour (stretched to fit any class outside those hours),
+    and a cell per weekday (plus the weekend, if anything meets then) holding
+    the course meetings that overlap that slot. Every meeting of a course is
+    placed, not just the first.
+    """
+    placed = []  # (day, start, end, GridEntry)
+    for course in courses:
+        for meeting in course.meetings or []:
+            start = parse_time(meeting.get('start_time'))
+            end = parse_time(meeting.get('end_time'))
+            if start is None or end is None:
+                continue
+            for day in parse_days(meeting.get('days')):
+                placed.append((day, start, end, GridEntry(course, meeting)))
+
+    first = first_hour * 60
+    last = last_hour * 60
+    day_count = 5
+    for day, start, end, _ in placed:
+        first = min(first, start - start % slot_minutes)
+        last = max(last, end)
+        day_count = max(day_count, day + 1)
+
+    slots = list(range(first, last, slot_minutes)) or [first]
+    cells = [[[] for _ in range(day_count)] for _ in slots]
+    for day, start, end, entry in sorted(placed, key=lambda item: (item[1], item[0])):
+        # the slot the meeting starts in, and every later slot it runs into
+        first_row = (start - first) // slot_minutes
+        for row in range(first_row, len(slots)):
+            if row > first_row and slots[row] >= end:
+                break
+            cells[row][day].append(entry)
+
+    return Grid(DAY_NAMES[:day_count],
+                [GridRow(slot_label(slot), row) for slot, row in zip(slots, cells)])
@@ -0,0 +1,61 @@
+import argparse
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from schedapp.benchmarks import BENCHMARKS, DEFAULT_SIZES, load_fixture, run_metadata
+from schedapp.sis_recording import SISRecording
+
+def sizes(value):
+    """ a comma separated list of catalog sizes, e.g. 1000,10000 """
+    try:
+        parsed = [int(size) for size in value.split(',') if size.strip()]
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"not a list of numbers: {value!r}") from error
+    if not parsed or min(parsed) < 1:
+        raise argparse.ArgumentTypeError(f"sizes must be positive: {value!r}")
+    return parsed
+
+class Command(BaseCommand):
+    help = "Runs the schedapp benchmarks and prints the results as json"
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+        parser.add_argument('--iterations', type=int, default=20, help="how many times to time each case")
+        parser.add_argument('--latency', type=float, default=0.05, help="seconds the stub SIS server waits per request")
+        parser.add_argument('--sizes', type=sizes, default=list(DEFAULT_SIZES),
+                            help="catalog sizes for the ingest and pages benchmarks (default: %(default)s)")
+        parser.add_argument('--users', type=int, default=10000, help="students for the pages benchmark")
+        parser.add_argument('--fixture', help="a recorded SIS search response (json) to make catalogs from")
+        parser.add_argument('--recording', help="a SIS recording (see record_sis) for the sis-errors benchmark to replay")
+        parser.add_argument('--output', help="write the results to this file instead of printing them")
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"unknown benchmark(s): {', '.join(unknown)}")
+        try:
+            fixture = load_fixture(options['fixture']) if options['fixture'] else None
+        except (OSError, ValueError) as error:
+            raise CommandError(f"can't read fixture: {error}") from error
+        try:
+            recording = SISRecording.load(options['recording']) if options['recording'] else None
+        except (OSError, ValueError) as error:
+            raise CommandError(f"can't read recording: {error}") from error
+
+        report = {'meta': dict(run_metadata(), iterations=options['iterations'], latency=options['latency'],
+                               sizes=options['sizes'], users=options['users'], fixture=options['fixture'],
+                               recording=options['recording']),
+                  'benchmarks': {}}
+        for name in names:
+            report['benchmarks'][name] = BENCHMARKS[name](iterations=options['iterations'], latency=options['latency'],
+                                                          sizes=options['sizes'], users=options['users'],
+                                                          fixture=fixture, recording=recording)
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+            self.stdout.write(f"wrote {', '.join(names)} results to {options['output']}")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,45 @@
+import os
+from urllib.parse import parse_qsl
+
+from django.core.management.base import BaseCommand, CommandError
+
+from schedapp.sis import SEARCH_PARAMS
+from schedapp.sis_recording import SISRecording, record_search, search_key
+
+class Command(BaseCommand):
+    help = ("Records SIS class searches, page by page, to a file the stub SIS server can replay "
+            "(python manage.py sis_stub_server), for testing and benchmarking offline.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="the recording to write, gzipped if it ends in .gz")
+        parser.add_argument('searches', nargs='+',
+                            help=f"searches as query strings, e.g. term=1228&subject=APMA (any of {', '.join(SEARCH_PARAMS)})")
+        parser.add_argument('--append', action='store_true', help="add to the recording if it's already there")
+        parser.add_argument('--max-pages', type=int, help="pages to record per search at most (default: SIS_MAX_PAGES)")
+        parser.add_argument('--delay', type=float, default=0.5, help="seconds to wait between SIS requests")
+
+    def handle(self, *args, **options):
+        searches = []
+        for search in options['searches']:
+            params = dict(parse_qsl(search))
+            unknown = set(params) - set(SEARCH_PARAMS)
+            if not params or unknown:
+                raise CommandError(f"can't search for {search!r}; use {', '.join(SEARCH_PARAMS)}")
+            searches.append(params)
+
+        output = options['output']
+        try:
+            recording = SISRecording.load(output) if options['append'] and os.path.exists(output) else SISRecording()
+        except (OSError, ValueError) as error:
+            raise CommandError(f"can't append to {output}: {error}") from error
+
+        for params in searches:
+            try:
+                found = record_search(recording, params, options['max_pages'], options['delay'])
+            except OSError as error:
+                raise CommandError(f"{error}. Nothing was written.") from error
+            self.stdout.write(f"{search_key(params)}: {found} courses")
+
+        recording.save(output)
+        self.stdout.write(self.style.SUCCESS(
+            f"recorded {len(recording)} pages and {len(recording.courses)} courses to {output}"))
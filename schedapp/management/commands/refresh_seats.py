@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from schedapp.seats import TokenBucket, refresh_seats
+
+class Command(BaseCommand):
+    help = ("Refreshes the seat counts of the courses in students' carts and schedules from SIS, "
+            "most popular and stalest first, within a budget of SIS requests per minute. "
+            "Run it from cron, or leave it running with --loop during registration.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rate', type=int, default=settings.SEATS_REQUESTS_PER_MINUTE,
+                            help="most SIS requests to make per minute")
+        parser.add_argument('--max-requests', type=int, help="stop after this many SIS requests")
+        parser.add_argument('--min-age', type=int, default=settings.SEATS_MIN_AGE,
+                            help="skip courses refreshed less than this many seconds ago")
+        parser.add_argument('--loop', action='store_true', help="keep refreshing until stopped")
+        parser.add_argument('--interval', type=float, default=60,
+                            help="with --loop, seconds to wait when there's nothing to refresh")
+
+    def handle(self, *args, **options):
+        # one bucket for every pass, so --loop stays within the rate too
+        bucket = TokenBucket(options['rate'])
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        while True:
+            stats = refresh_seats(max_requests=options['max_requests'], min_age=options['min_age'],
+                                  bucket=bucket, log=log)
+            self.stdout.write(self.style.SUCCESS(
+                f"refreshed {stats.courses} sections in {stats.requests} requests: "
+                f"{stats.changed} changed, {stats.failed} failed"))
+            if not options['loop']:
+                break
+            if not stats.requests:
+                time.sleep(options['interval'])
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from schedapp.sis_recording import SISRecording
+from schedapp.sis_stub import StubSISServer
+
+class Command(BaseCommand):
+    help = ("Serves a recording made with record_sis as the SIS class search api, optionally slow, "
+            "uneven and failing, until interrupted. Point SIS_SEARCH_URL at it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('recording', help="a recording made with record_sis")
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0.0, help="seconds to wait before every answer")
+        parser.add_argument('--jitter', type=float, default=0.0, help="up to this many more seconds, at random")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests to fail (0 to 1)")
+        parser.add_argument('--error-status', type=int, default=503, help="the status failed requests get")
+        parser.add_argument('--seed', type=int, help="seed for the jitter and errors, to make runs repeatable")
+
+    def handle(self, *args, **options):
+        if not 0 <= options['error_rate'] <= 1:
+            raise CommandError("--error-rate must be between 0 and 1")
+        try:
+            recording = SISRecording.load(options['recording'])
+        except (OSError, ValueError) as error:
+            raise CommandError(f"can't read {options['recording']}: {error}") from error
+
+        stub = StubSISServer(recording=recording, host=options['host'], port=options['port'],
+                             latency=options['latency'], jitter=options['jitter'], error_rate=options['error_rate'],
+                             error_status=options['error_status'], seed=options['seed'])
+        with stub:
+            self.stdout.write(f"replaying {len(recording)} pages of {len(recording.searches)} searches at {stub.url}")
+            self.stdout.write(f"set SIS_SEARCH_URL={stub.url} to use it; Ctrl-C to stop")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
+        self.stdout.write(f"served {len(stub.requests)} requests, {len(stub.misses)} for searches not recorded")
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from schedapp.catalog import SyncError, file_pages, sis_pages, start_page, sync_term
+
+class Command(BaseCommand):
+    help = ("Pulls every course in a term into the local course catalog mirror, from SIS "
+            "or from a json dump of SIS courses. Resumes an interrupted sync where it left off. "
+            "Meant to be run on a schedule (cron, Heroku Scheduler) during registration.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('strms', nargs='+', help="the terms to sync, e.g. 1238")
+        parser.add_argument('--file', help="read courses from this json dump instead of SIS")
+        parser.add_argument('--restart', action='store_true', help="ignore any unfinished sync and start from page 1")
+        parser.add_argument('--delay', type=float, default=0.5, help="seconds to wait between SIS requests")
+        parser.add_argument('--page-size', type=int, default=100, help="courses per page when reading a dump")
+
+    def handle(self, *args, **options):
+        for strm in options['strms']:
+            first_page = start_page(strm, restart=options['restart'])
+            if first_page > 1:
+                self.stdout.write(f"resuming term {strm} at page {first_page}")
+
+            if options['file']:
+                source = options['file']
+                pages = file_pages(source, first_page, options['page_size'])
+            else:
+                source = 'sis'
+                pages = sis_pages(strm, first_page, options['delay'])
+
+            try:
+                sync = sync_term(strm, pages, source=source, log=self.stdout.write)
+            except (SyncError, OSError, ValueError) as error:
+                raise CommandError(f"{error}. Run the command again to resume.") from error
+
+            self.stdout.write(self.style.SUCCESS(
+                f"synced {sync.courses_synced} courses for term {strm}"))
@@ -0,0 +1,84 @@
+"""
+a compact representation of when a course meets.
+
+A course's meetings become a sorted list of [start, end] intervals, in minutes
+since midnight on Monday, one per day the course meets. Two courses conflict
+if any of their intervals overlap, which is just integer comparisons.
+"""
+DAY_CODES = ('Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su')
+MINUTES_PER_DAY = 24 * 60
+
+def parse_time(value):
+    """
+    minutes since midnight for a meeting time, either the way we store them
+    (01:45 PM) or the way SIS sends them (13.45.00.000000-05:00).
+    returns None for missing or unreadable times (like TBA meetings).
+    """
+    if not value:
+        return None
+    try:
+        if value[-2:] in ('AM', 'PM'):
+            hours, minutes = value[:-2].strip().split(':')[:2]
+            hours = int(hours) % 12 + (12 if value[-2:] == 'PM' else 0)
+            return hours * 60 + int(minutes)
+        hours, minutes = value.split('.')[:2]
+        return int(hours) * 60 + int(minutes)
+    except ValueError:
+        return None
+
+def parse_days(days):
+    """ the day indexes (0 is Monday) in a SIS day string like MoWeFr """
+    if not days:
+        return []
+    return [DAY_CODES.index(days[i:i+2]) for i in range(0, len(days), 2) if days[i:i+2] in DAY_CODES]
+
+def meeting_intervals(meetings):
+    """ the sorted [start, end] week-minute intervals for a list of SIS meetings """
+    intervals = []
+    for meeting in meetings or []:
+        start = parse_time(meeting.get('start_time'))
+        end = parse_time(meeting.get('end_time'))
+        if start is None or end is None:
+            continue
+        for day in parse_days(meeting.get('days')):
+            offset = day * MINUTES_PER_DAY
+            intervals.append([offset + start, offset + end])
+    intervals.sort()
+    return intervals
+
+def meeting_rows(meetings):
+    """
+    a list of SIS meetings as one row per day per meeting, with the times in
+    minutes since midnight, for the Meeting table
+    """
+    rows = []
+    for meeting in meetings or []:
+        start = parse_time(meeting.get('start_time'))
+        end = parse_time(meeting.get('end_time'))
+        if start is None or end is None:
+            continue
+        for day in parse_days(meeting.get('days')):
+            rows.append({
+                'day': day,
+                'start_min': start,
+                'end_min': end,
+                'facility': meeting.get('facility_descr') or '',
+                'instructor': meeting.get('instructor') or '',
+            })
+    return rows
+
+def intervals_overlap(first, second):
+    """
+    whether any interval in one sorted interval list overlaps any in the other.
+    Like the old string comparison, a class that starts the minute another ends
+    counts as a conflict.
+    """
+    i = j = 0
+    while i < len(first) and j < len(second):
+        if first[i][0] <= second[j][1] and second[j][0] <= first[i][1]:
+            return True
+        if first[i][1] < second[j][1]:
+            i += 1
+        else:
+            j += 1
+    return False
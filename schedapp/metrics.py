@@ -0,0 +1,277 @@
+"""
+per-request performance numbers: wall time, ORM queries and their time,
+template render time, and SIS calls and their time.
+
+RequestMetricsMiddleware (middleware.py) starts a RequestMetrics for each
+request and makes it current for everything the request does, including
+work handed to threads with sync_to_async or copy_context. The database,
+template and SIS hooks below add to whichever one is current, and do nothing
+outside a request. When the request is done its numbers are added to this
+process's per-view totals, which prometheus_text() writes out for the
+/metrics endpoint.
+
+Views can declare how many queries they may make with @query_budget(n). A
+request that goes over is logged, and with QUERY_BUDGET_STRICT (on wherever
+DEBUG is, so in local test runs) raises QueryBudgetExceeded instead, which
+fails the test that made the request.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# upper bounds, in seconds, of the request duration histogram
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+class QueryBudgetExceeded(AssertionError):
+    """ a view made more queries than its @query_budget allows """
+
+class RequestMetrics:
+    """ what one request has spent so far """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+        self.sis_calls = 0
+        self.sis_seconds = 0.0
+        # stays 0: calls that finish after the request was recorded go straight to its view's totals
+        self.sis_calls_dropped = 0
+        self.rendering = False
+        # the view it was recorded under, once it has been
+        self.view_name = None
+        self._lock = threading.Lock()
+
+    def add_query(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += seconds
+
+    def add_sis_call(self, seconds):
+        with self._lock:
+            view_name = self.view_name
+            if view_name is None:
+                self.sis_calls += 1
+                self.sis_seconds += seconds
+                return
+        # a page fetched ahead that was past the end of its search, and finished after the request did
+        _record_dropped_sis_call(view_name)
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+
+    def server_timing(self):
+        """ the numbers as a Server-Timing header, for the browser's network panel """
+        return ', '.join([f'total;dur={self.seconds * 1000:.1f}',
+                          f'db;desc="{self.queries} queries";dur={self.query_seconds * 1000:.1f}',
+                          f'tpl;dur={self.template_seconds * 1000:.1f}',
+                          f'sis;desc="{self.sis_calls} calls";dur={self.sis_seconds * 1000:.1f}'])
+
+def current():
+    """ the RequestMetrics of the request being handled, or None """
+    return _current.get()
+
+def start_request():
+    """ starts measuring a request; pass what this returns to end_request """
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+def end_request(token):
+    _current.reset(token)
+
+# ------- Hooks -------
+def record_query(execute, sql, params, many, context):
+    """ a database execute wrapper (see connection.execute_wrapper) that times every query """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(time.perf_counter() - start)
+
+def record_sis_call(seconds):
+    """ called by sis.observe for every request made to SIS """
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_sis_call(seconds)
+
+def _connection_created(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+def _timed_render(render):
+    def timed_render(self, context):
+        metrics = _current.get()
+        # includes render inside their parent; only the outermost render is timed
+        if metrics is None or metrics.rendering:
+            return render(self, context)
+        metrics.rendering = True
+        start = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            metrics.rendering = False
+            metrics.template_seconds += time.perf_counter() - start
+    timed_render.timed = True
+    return timed_render
+
+def install():
+    """ hooks the database and the template engine; called once, from SchedappConfig.ready """
+    # pylint: disable=import-outside-toplevel
+    from django.db import connections
+    from django.db.backends.signals import connection_created
+    from django.template.base import Template
+
+    connection_created.connect(_connection_created)
+    for connection in connections.all(initialized_only=True):
+        _connection_created(None, connection)
+    if not getattr(Template.render, 'timed', False):
+        Template.render = _timed_render(Template.render)
+
+# ------- Query budgets -------
+def query_budget(queries):
+    """
+    declares the most queries a view may make in one request, counting the
+    session and user lookups. Works on view functions and view classes
+
+        @query_budget(8)
+        @login_required
+        def shopping_cart(request): ...
+    """
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+def budget_for(view):
+    """ the @query_budget of a resolved view function, or None """
+    budget = getattr(view, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view, 'view_class', None), 'query_budget', None)
+    return budget
+
+def check_budget(view_name, budget, metrics):
+    if budget is None or metrics.queries <= budget:
+        return
+    message = f"{view_name} made {metrics.queries} queries, over its budget of {budget}"
+    if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+# ------- Totals -------
+_FIELDS = ('requests', 'seconds', 'queries', 'query_seconds', 'template_seconds', 'sis_calls', 'sis_seconds',
+           'sis_calls_dropped')
+_totals = defaultdict(lambda: dict.fromkeys(_FIELDS, 0))
+_durations = defaultdict(lambda: [0] * (len(DURATION_BUCKETS) + 1))
+_totals_lock = threading.Lock()
+
+def record_request(view_name, metrics):
+    """ adds a finished request to its view's totals """
+    with metrics._lock:  # pylint: disable=protected-access
+        metrics.view_name = view_name
+    bucket = next((i for i, bound in enumerate(DURATION_BUCKETS) if metrics.seconds <= bound), len(DURATION_BUCKETS))
+    with _totals_lock:
+        totals = _totals[view_name]
+        totals['requests'] += 1
+        for field in _FIELDS[1:]:
+            totals[field] += getattr(metrics, field)
+        _durations[view_name][bucket] += 1
+
+def _record_dropped_sis_call(view_name):
+    with _totals_lock:
+        _totals[view_name]['sis_calls_dropped'] += 1
+
+def view_totals():
+    """ view name -> its totals so far, in this process """
+    with _totals_lock:
+        return {view: dict(totals) for view, totals in _totals.items()}
+
+def reset_totals():
+    with _totals_lock:
+        _totals.clear()
+        _durations.clear()
+
+# ------- Prometheus text format -------
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _family(lines, name, kind, help_text, samples):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+    for suffix, labels, value in samples:
+        lines.append(f'{name}{suffix}{_labels(labels)} {value}')
+
+def _histogram_samples(bounds, counts, total, labels=None):
+    # counts are per bucket (the last one past every bound); prometheus wants them cumulative
+    samples = []
+    running = 0
+    for bound, count in zip(tuple(bounds) + ('+Inf',), counts):
+        running += count
+        samples.append(('_bucket', dict(labels or {}, le=bound), running))
+    samples.append(('_sum', labels, round(total, 6)))
+    samples.append(('_count', labels, running))
+    return samples
+
+def prometheus_text(sis_stats=None, cache_stats=None):
+    """
+    every total as prometheus text exposition format, plus SIS request stats
+    (sis.request_stats()) and SIS cache stats (sis_cache.cache_stats()) if given
+    """
+    with _totals_lock:
+        totals = {view: dict(values) for view, values in _totals.items()}
+        durations = {view: list(counts) for view, counts in _durations.items()}
+
+    lines = []
+    _family(lines, 'schedris_request_duration_seconds', 'histogram', "Wall time of requests, by view.",
+            [sample for view in sorted(durations)
+             for sample in _histogram_samples(DURATION_BUCKETS, durations[view], totals[view]['seconds'], {'view': view})])
+    per_view = (
+        ('schedris_request_queries_total', 'queries', "ORM queries made by requests, by view."),
+        ('schedris_request_query_seconds_total', 'query_seconds', "Time spent in ORM queries, by view."),
+        ('schedris_request_template_seconds_total', 'template_seconds', "Time spent rendering templates, by view."),
+        ('schedris_request_sis_calls_total', 'sis_calls', "Requests made to SIS while handling requests, by view."),
+        ('schedris_request_sis_seconds_total', 'sis_seconds', "Time spent waiting on SIS, by view."),
+        ('schedris_request_sis_calls_dropped_total', 'sis_calls_dropped',
+         "Requests made to SIS for pages past the end of a search that finished after the request, by view."),
+    )
+    for name, field, help_text in per_view:
+        _family(lines, name, 'counter', help_text,
+                [('', {'view': view}, round(totals[view][field], 6)) for view in sorted(totals)])
+
+    if sis_stats is not None:
+        for field, help_text in (('requests', "Requests made to SIS, counting retries."),
+                                 ('failures', "Requests to SIS that failed or were answered with a retryable error."),
+                                 ('retries', "Retried requests to SIS."),
+                                 ('short_circuits', "Calls to SIS refused because its circuit breaker was open.")):
+            _family(lines, f'schedris_sis_{field}_total', 'counter', help_text, [('', None, sis_stats[field])])
+        bounds = [bound for bound, _ in sis_stats['latency_buckets'][:-1]]
+        cumulative = [count for _, count in sis_stats['latency_buckets']]
+        counts = [count - previous for count, previous in zip(cumulative, [0] + cumulative[:-1])]
+        _family(lines, 'schedris_sis_request_duration_seconds', 'histogram', "Latency of requests to SIS.",
+                _histogram_samples(bounds, counts, sis_stats['latency_sum']))
+        _family(lines, 'schedris_sis_circuit_open', 'gauge', "Whether the circuit breaker for a SIS url is open.",
+                [('', {'url': url}, int(state == 'open')) for url, state in sorted(sis_stats['breakers'].items())])
+
+    if cache_stats is not None:
+        for field, help_text in (('hits', "SIS searches answered from the cache."),
+                                 ('misses', "SIS searches fetched from SIS."),
+                                 ('waits', "SIS searches answered by another caller's fetch."),
+                                 ('uncached', "SIS searches not cached because they didn't come back whole.")):
+            _family(lines, f'schedris_sis_cache_{field}_total', 'counter', help_text, [('', None, cache_stats[field])])
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,59 @@
+"""
+middleware for this app. RequestMetricsMiddleware should come first in
+MIDDLEWARE so what it measures includes every other middleware's queries.
+"""
+import asyncio
+
+from django.conf import settings
+
+from . import metrics
+
+class RequestMetricsMiddleware:
+    """
+    measures every request (see metrics.py), adds it to its view's totals,
+    holds the view to its @query_budget, and with METRICS_SERVER_TIMING sends
+    the numbers back in a Server-Timing header. The request's RequestMetrics is
+    at request.metrics.
+
+    A streaming response is measured up to when its first byte is ready, not
+    until it has all been sent.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # mark this instance as a coroutine function, the way django's MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine  # pylint: disable=protected-access
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        request.metrics, token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        request.metrics, token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self.finish(request, response)
+
+    def finish(self, request, response):
+        measured = request.metrics
+        measured.finish()
+        match = getattr(request, 'resolver_match', None)
+        view_name = (match.view_name or match._func_path) if match else 'unresolved'  # pylint: disable=protected-access
+        metrics.record_request(view_name, measured)
+        if getattr(settings, 'METRICS_SERVER_TIMING', False):
+            response['Server-Timing'] = measured.server_timing()
+        if match:
+            metrics.check_budget(view_name, metrics.budget_for(match.func), measured)
+        return response
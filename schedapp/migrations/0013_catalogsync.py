@@ -0,0 +1,26 @@
+# Generated by Django 4.1.6 on 2026-10-18 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedapp', '0012_alter_schedule_approval_status_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogSync',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('strm', models.CharField(max_length=10, unique=True)),
+                ('source', models.CharField(blank=True, max_length=255)),
+                ('next_page', models.IntegerField(default=1)),
+                ('page_size', models.IntegerField(blank=True, null=True)),
+                ('courses_synced', models.IntegerField(default=0)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
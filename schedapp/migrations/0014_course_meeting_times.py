@@ -0,0 +1,30 @@
+# Generated by Django 4.1.6 on 2026-10-18 13:32
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+from schedapp.meetings import meeting_intervals
+
+
+def backfill_meeting_times(apps, schema_editor):
+    Course = apps.get_model('schedapp', 'Course')
+    courses = list(Course.objects.only('class_nbr', 'meetings'))
+    for course in courses:
+        course.meeting_times = meeting_intervals(course.meetings)
+    Course.objects.bulk_update(courses, ['meeting_times'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedapp', '0013_catalogsync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='meeting_times',
+            field=models.JSONField(blank=True, default=list, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+        migrations.RunPython(backfill_meeting_times, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.6 on 2026-10-18 13:42
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_submitted_at(apps, schema_editor):
+    # we don't know when existing schedules were submitted, so they all go in the queue as of now
+    Schedule = apps.get_model('schedapp', 'Schedule')
+    Schedule.objects.filter(approval_status__in=['pending', 'approved', 'denied'], submitted_at=None) \
+        .update(submitted_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedapp', '0014_course_meeting_times'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedule',
+            name='submitted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['approver', 'approval_status', 'submitted_at', 'id'], name='schedule_approval_queue'),
+        ),
+        migrations.RunPython(backfill_submitted_at, migrations.RunPython.noop),
+    ]
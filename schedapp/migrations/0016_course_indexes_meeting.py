@@ -0,0 +1,63 @@
+# Generated by Django 4.1.6 on 2026-10-18 13:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from schedapp.meetings import meeting_rows
+
+
+def backfill_meetings(apps, schema_editor):
+    Course = apps.get_model('schedapp', 'Course')
+    Meeting = apps.get_model('schedapp', 'Meeting')
+    rows = []
+    for course in Course.objects.only('class_nbr', 'strm', 'meetings').iterator(chunk_size=500):
+        rows += [Meeting(course_id=course.class_nbr, strm=course.strm, **row) for row in meeting_rows(course.meetings)]
+    Meeting.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedapp', '0015_schedule_submitted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Meeting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('strm', models.CharField(blank=True, max_length=255, null=True)),
+                ('day', models.PositiveSmallIntegerField()),
+                ('start_min', models.PositiveSmallIntegerField()),
+                ('end_min', models.PositiveSmallIntegerField()),
+                ('facility', models.CharField(blank=True, max_length=255)),
+                ('instructor', models.CharField(blank=True, max_length=255)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['strm', 'subject', 'catalog_nbr'], name='course_term_subject'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['strm', 'acad_org'], name='course_term_acad_org'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['strm', 'crse_id'], name='course_term_crse_id'),
+        ),
+        migrations.AddField(
+            model_name='meeting',
+            name='course',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='meeting_set', to='schedapp.course'),
+        ),
+        migrations.AddIndex(
+            model_name='meeting',
+            index=models.Index(fields=['strm', 'day', 'start_min'], name='meeting_term_day_start'),
+        ),
+        migrations.AddIndex(
+            model_name='meeting',
+            index=models.Index(fields=['instructor'], name='meeting_instructor'),
+        ),
+        migrations.RunPython(backfill_meetings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 4.1.6 on 2026-10-18 13:44
+
+from django.db import migrations, OperationalError
+
+# see schedapp/search.py for how these are queried
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE schedapp_course ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(subject, '') || ' ' || coalesce(catalog_nbr, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(descr, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(topic, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(subject_descr, '')), 'C') ||
+        setweight(jsonb_to_tsvector('english', coalesce(instructors, '[]'::jsonb), '["string"]'), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX course_search_vector ON schedapp_course USING GIN (search_vector)",
+]
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS course_search_vector",
+    "ALTER TABLE schedapp_course DROP COLUMN IF EXISTS search_vector",
+]
+
+FTS_COLUMNS = 'subject, catalog_nbr, descr, topic, subject_descr, instructors'
+SQLITE_FORWARD = [
+    f"""
+    CREATE VIRTUAL TABLE course_fts USING fts5(
+        {FTS_COLUMNS}, content='schedapp_course', content_rowid='class_nbr', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER course_fts_insert AFTER INSERT ON schedapp_course BEGIN
+        INSERT INTO course_fts(rowid, {FTS_COLUMNS})
+        VALUES (new.class_nbr, new.subject, new.catalog_nbr, new.descr, new.topic, new.subject_descr, new.instructors);
+    END
+    """,
+    f"""
+    CREATE TRIGGER course_fts_delete AFTER DELETE ON schedapp_course BEGIN
+        INSERT INTO course_fts(course_fts, rowid, {FTS_COLUMNS})
+        VALUES ('delete', old.class_nbr, old.subject, old.catalog_nbr, old.descr, old.topic, old.subject_descr, old.instructors);
+    END
+    """,
+    f"""
+    CREATE TRIGGER course_fts_update AFTER UPDATE ON schedapp_course BEGIN
+        INSERT INTO course_fts(course_fts, rowid, {FTS_COLUMNS})
+        VALUES ('delete', old.class_nbr, old.subject, old.catalog_nbr, old.descr, old.topic, old.subject_descr, old.instructors);
+        INSERT INTO course_fts(rowid, {FTS_COLUMNS})
+        VALUES (new.class_nbr, new.subject, new.catalog_nbr, new.descr, new.topic, new.subject_descr, new.instructors);
+    END
+    """,
+    "INSERT INTO course_fts(course_fts) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS course_fts_insert",
+    "DROP TRIGGER IF EXISTS course_fts_delete",
+    "DROP TRIGGER IF EXISTS course_fts_update",
+    "DROP TABLE IF EXISTS course_fts",
+]
+
+
+def run(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        run(schema_editor, POSTGRES_FORWARD)
+    elif vendor == 'sqlite':
+        try:
+            run(schema_editor, SQLITE_FORWARD[:1])
+        except OperationalError:
+            # this sqlite was built without FTS5; search falls back to icontains
+            return
+        run(schema_editor, SQLITE_FORWARD[1:])
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        run(schema_editor, POSTGRES_REVERSE)
+    elif vendor == 'sqlite':
+        run(schema_editor, SQLITE_REVERSE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedapp', '0016_course_indexes_meeting'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.6 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedapp', '0018_schedule_cart_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='seats_refreshed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
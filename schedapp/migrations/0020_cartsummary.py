@@ -0,0 +1,28 @@
+# Generated by Django 4.1.6 on 2026-10-18 14:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedapp', '0019_course_seats_refreshed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course_count', models.IntegerField(default=0)),
+                ('min_units', models.FloatField(default=0)),
+                ('max_units', models.FloatField(default=0)),
+                ('conflict_count', models.IntegerField(default=0)),
+                ('terms', models.JSONField(blank=True, default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cart_summary', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
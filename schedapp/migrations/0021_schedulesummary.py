@@ -0,0 +1,28 @@
+# Generated by Django 4.1.6 on 2026-10-18 14:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedapp', '0020_cartsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course_count', models.IntegerField(default=0)),
+                ('min_units', models.FloatField(default=0)),
+                ('max_units', models.FloatField(default=0)),
+                ('conflict_count', models.IntegerField(default=0)),
+                ('earliest_start', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('latest_end', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('schedule', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='schedapp.schedule')),
+            ],
+        ),
+    ]
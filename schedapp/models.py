@@ -1,13 +1,15 @@
 # pylint: disable=no-member
 
 from enum import Enum
-from datetime import datetime
 
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth import get_user_model
 from django.core.serializers.json import DjangoJSONEncoder
 from django.urls import reverse
+from django.utils import timezone
+
+from .meetings import DAY_CODES, meeting_intervals, meeting_rows, intervals_overlap
 
 # ------- User Model -------
 class User(AbstractUser):
@@ -100,141 +102,118 @@ class Course(models.Model):
     crse_attr              = models.CharField(max_length=255, blank=True, null=True)
     crse_attr_value        = models.CharField(max_length=255, blank=True, null=True)
     reserve_caps           = models.JSONField(encoder=DjangoJSONEncoder)
+    # the meetings as sorted [start, end] minutes-since-monday intervals (see meetings.py),
+    # worked out once when the course is stored so conflict checks don't re-parse times
+    meeting_times          = models.JSONField(encoder=DjangoJSONEncoder, default=list, blank=True)
+    # when refresh_seats last brought the enrollment fields up to date from SIS (see seats.py)
+    seats_refreshed_at     = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['strm', 'subject', 'catalog_nbr'], name='course_term_subject'),
+            models.Index(fields=['strm', 'acad_org'], name='course_term_acad_org'),
+            models.Index(fields=['strm', 'crse_id'], name='course_term_crse_id'),
+        ]
 
     def __str__(self):
             return f'{self.subject} {self.catalog_nbr}'
 
-    def conflicts_with(self, course):     
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        # meetings that weren't loaded, or aren't being saved, haven't changed
+        saving_meetings = ('meetings' not in self.get_deferred_fields()
+                           and (update_fields is None or {'strm', 'meetings'} & set(update_fields)))
+        if saving_meetings:
+            self.meeting_times = meeting_intervals(self.meetings)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'meeting_times'}
+        adding = self._state.adding
+        super(Course, self).save(*args, **kwargs)
+        # a save that leaves the meetings alone (e.g. of seat counts) leaves the Meeting rows alone
+        if saving_meetings and (adding or not Meeting.in_sync(self)):
+            Meeting.replace_for([self])
+
+    def get_meeting_times(self):
+        """ the precomputed meeting intervals, working them out if this course hasn't been saved yet """
+        if not self.meeting_times and self.meetings:
+            self.meeting_times = meeting_intervals(self.meetings)
+        return self.meeting_times
+
+    def conflicts_with(self, course):
         """ check if the time of this course conflicts with another """
-        self_meetings = self.meetings
-        course_meetings = course.meetings
-        
-        # check if term overlaps
-        if self.strm == course.strm:
-            # check if days overlap
-            self_days = self_meetings[0]['days']
-            course_days = course_meetings[0]['days']
-
-            # we are going to assume that there are only two-letter date codes in our database . . .
-            course_days_list = [course_days[i:i+2] for i in range(0, len(course_days), 2)]
-
-            for day in [self_days[i:i+2] for i in range(0, len(self_days), 2)]:
-                if day in course_days_list:
-                    # check if times overlap
-                    # either the start of the other course needs to be after the end of this course
-                    # or the end of the other course needs to be before the start of this course
-
-                    other_course_after = datetime.strptime(course_meetings[0]['start_time'], '%I:%M %p') > datetime.strptime(self_meetings[0]['end_time'], '%I:%M %p')
-                    other_course_before = datetime.strptime(self_meetings[0]['start_time'], '%I:%M %p') > datetime.strptime(course_meetings[0]['end_time'], '%I:%M %p')
-                    
-                    if not other_course_after and not other_course_before:
-                        # they must overlap
-                        return True
-
-        # if we get to here, then we didn't have any overlapping times
-        return False
+        # courses in different terms never conflict
+        if self.strm != course.strm:
+            return False
+        return intervals_overlap(self.get_meeting_times(), course.get_meeting_times())
+
+class Meeting(models.Model):
+    """
+    one day of one of a course's weekly meetings, copied out of Course.meetings
+    so searches and conflict checks by day and time can use an index
+    """
+    course     = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='meeting_set')
+    strm       = models.CharField(max_length=255, blank=True, null=True)
+    day        = models.PositiveSmallIntegerField()  # 0 is Monday
+    start_min  = models.PositiveSmallIntegerField()  # minutes since midnight
+    end_min    = models.PositiveSmallIntegerField()
+    facility   = models.CharField(max_length=255, blank=True)
+    instructor = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['strm', 'day', 'start_min'], name='meeting_term_day_start'),
+            models.Index(fields=['instructor'], name='meeting_instructor'),
+        ]
+
+    def __str__(self):
+        return f'{self.course} {DAY_CODES[self.day]} {self.start_min}-{self.end_min}'
+
+    @classmethod
+    def in_sync(cls, course):
+        """ whether the Meeting rows of a saved course match its meetings json (one query) """
+        fields = ('day', 'start_min', 'end_min', 'facility', 'instructor')
+        stored = cls.objects.filter(course=course).values_list('strm', *fields)
+        wanted = [(course.strm, *(row[name] for name in fields)) for row in meeting_rows(course.meetings)]
+        return sorted(stored, key=str) == sorted(wanted, key=str)
+
+    @classmethod
+    def replace_for(cls, courses):
+        """ rewrite the Meeting rows of these courses from their meetings json """
+        courses = list(courses)
+        cls.objects.filter(course__in=[course.pk for course in courses]).delete()
+        cls.objects.bulk_create([cls(course_id=course.pk, strm=course.strm, **row)
+                                 for course in courses for row in meeting_rows(course.meetings)],
+                                batch_size=500)
+
+# Course fields that SIS doesn't always send, and what to store when it doesn't
+JSON_COURSE_DEFAULTS = {'descr': '', 'instructors': [], 'meetings': [], 'reserve_caps': []}
+# Course fields we keep for ourselves, which a course from SIS leaves alone
+LOCAL_COURSE_FIELDS = ('seats_refreshed_at',)
+
+def jsonCourseFields(course):
+    """
+    the Course field values for a course in json representation, converted to
+    the types we store so they can be compared against what's in the database
+    """
+    fields = {}
+    for field in Course._meta.concrete_fields:
+        if field.name in LOCAL_COURSE_FIELDS:
+            continue
+        value = course.get(field.name)
+        if value is None:
+            fields[field.name] = JSON_COURSE_DEFAULTS.get(field.name)
+        else:
+            fields[field.name] = field.to_python(value)
+    fields['meeting_times'] = meeting_intervals(fields['meetings'])
+    return fields
 
 def addJsonCourse(course):
     """
     adds a course in json representation to the database if it doesn't exist therein already
     returns the course regardless.
     """
-    class_nbr_local = course['class_nbr']
-    try: 
-        result = Course.objects.get(pk = class_nbr_local)
-    except Course.DoesNotExist:   
-        index = course['index']
-        crse_id  = course['crse_id']
-        crse_offer_nbr = course['crse_offer_nbr']
-        strm = course['strm']
-        session_code = course['session_code']
-        session_descr = course['session_descr']
-        class_section = course['class_section']
-        location = course['location']
-        location_descr = course['location_descr']
-        start_dt = course['start_dt']
-        end_dt = course['end_dt']
-        class_stat = course['class_stat']
-        campus = course['campus']
-        campus_descr = course['campus_descr']
-        acad_career = course['acad_career']
-        acad_career_descr  = course['acad_career_descr']
-        component              = course['component']
-        subject                = course['subject']
-        subject_descr          = course['subject_descr']
-        catalog_nbr            = course['catalog_nbr']
-        class_type             = course['class_type']
-        schedule_print         = course['schedule_print']
-        acad_group             = course['acad_group']
-        instruction_mode       = course['instruction_mode']
-        instruction_mode_descr = course['instruction_mode_descr']
-        acad_org               = course['acad_org']
-        wait_tot               = course['wait_tot']
-        wait_cap               = course['wait_cap']
-        class_capacity         = course['class_capacity']
-        enrollment_total       = course['enrollment_total']
-        enrollment_available   = course['enrollment_available']
-        descr                  = course['descr']
-        rqmnt_designtn         = course['rqmnt_designtn']
-        units                  = course['units']
-        combined_section       = course['combined_section']
-        enrl_stat              = course['enrl_stat']
-        enrl_stat_descr        = course['enrl_stat_descr']
-        topic                  = course['topic']
-        instructors            = course['instructors']
-        section_type           = course['section_type']
-        meetings               = course['meetings']
-        crse_attr              = course['crse_attr']
-        crse_attr_value        = course['crse_attr_value']
-        reserve_caps           = course['reserve_caps']
-
-        result = Course.objects.create(
-            index = index,
-            crse_id = crse_id,
-            crse_offer_nbr = crse_offer_nbr,
-            strm = strm,
-            session_code = session_code,
-            session_descr = session_descr,
-            class_section = class_section,
-            location = location,
-            location_descr = location_descr,
-            start_dt = start_dt,
-            end_dt = end_dt,
-            class_stat = class_stat,
-            campus = campus,
-            campus_descr = campus_descr,
-            class_nbr = class_nbr_local,
-            acad_career = acad_career,
-            acad_career_descr = acad_career_descr,
-            component = component,
-            subject = subject,
-            subject_descr = subject_descr,
-            catalog_nbr = catalog_nbr,
-            class_type = class_type,
-            schedule_print = schedule_print,
-            acad_group = acad_group,
-            instruction_mode = instruction_mode,
-            instruction_mode_descr = instruction_mode_descr,
-            acad_org = acad_org,
-            wait_tot = wait_tot,
-            wait_cap = wait_cap,
-            class_capacity = class_capacity,
-            enrollment_total = enrollment_total,
-            enrollment_available = enrollment_available,
-            descr = descr,
-            rqmnt_designtn = rqmnt_designtn,
-            units = units,
-            combined_section = combined_section,
-            enrl_stat = enrl_stat,
-            enrl_stat_descr = enrl_stat_descr,
-            topic = topic,
-            instructors = instructors,
-            section_type = section_type,
-            meetings = meetings,
-            crse_attr = crse_attr,
-            crse_attr_value = crse_attr_value,
-            reserve_caps = reserve_caps)
-        result.save()
+    fields = jsonCourseFields(course)
+    result, _ = Course.objects.get_or_create(pk=fields.pop('class_nbr'), defaults=fields)
     return result
 
 class ApprovalStatus(Enum):
@@ -258,9 +237,30 @@ class Schedule(models.Model):
     other_courses = models.ManyToManyField(Other_Course, blank=True)
     courses = models.ManyToManyField(Course, blank=True)
     approval_status = models.CharField(max_length=60, choices=[(status.value, status.name) for status in ApprovalStatus], default=ApprovalStatus.UN.value, blank=True, null=True)
+    # when the student last submitted it for approval; the advisor queue is ordered by this
+    submitted_at = models.DateTimeField(blank=True, null=True)
+    # bumped by save() and when courses are added or removed (see signals.py); the api's ETags come from it
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['approver', 'approval_status', 'submitted_at', 'id'], name='schedule_approval_queue'),
+        ]
 
     def get_absolute_url(self):
         return reverse('student-schedule-list')
+
+    def set_approval_status(self, status):
+        """ change the approval status, noting the time if this is a new submission """
+        if status == ApprovalStatus.PD.value and self.approval_status in (ApprovalStatus.UN.value, None):
+            self.submitted_at = timezone.now()
+        self.approval_status = status
+
+    def save(self, *args, **kwargs):
+        # anything an advisor can see needs a place in their queue
+        if self.approval_status not in (ApprovalStatus.UN.value, None) and self.submitted_at is None:
+            self.submitted_at = timezone.now()
+        super(Schedule, self).save(*args, **kwargs)
     
     def __str__(self):
         return f'{self.name}'
@@ -270,7 +270,85 @@ class ShoppingCart(models.Model):
                                 on_delete=models.CASCADE, default=None)
     strm = models.IntegerField(default=1228)
     courses = models.ManyToManyField(Course)
+    # bumped by save() and when courses are added or removed (see signals.py)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
 
     def __str__(self):
         return f'{self.strm} Cart'
 
+class ScheduleSummary(models.Model):
+    """
+    a schedule's courses added up once instead of on every list page, which
+    read this row alongside the schedule. summaries.py keeps it current as the
+    schedule's courses change.
+    """
+    schedule = models.OneToOneField(Schedule, on_delete=models.CASCADE, related_name='summary')
+    course_count = models.IntegerField(default=0)
+    # units can be a range ("1 - 3") or a fraction, so these are floats
+    min_units = models.FloatField(default=0)
+    max_units = models.FloatField(default=0)
+    # courses that conflict with another course in the schedule
+    conflict_count = models.IntegerField(default=0)
+    # minutes since midnight of the earliest start and latest end on any day; None with no meetings
+    earliest_start = models.PositiveSmallIntegerField(blank=True, null=True)
+    latest_end = models.PositiveSmallIntegerField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.schedule} summary'
+
+class CartSummary(models.Model):
+    """
+    a student's shopping carts, added up once instead of on every page: the
+    cart page and the navbar read this row. summaries.py keeps it current as
+    carts and their courses change.
+
+    terms has an entry for each cart, in strm order:
+    {"strm": 1228, "course_count": 4, "min_units": 12, "max_units": 14,
+     "conflicts": {"15529": ["APMA 3080"], ...}}
+    """
+    user = models.OneToOneField(get_user_model(), on_delete=models.CASCADE, related_name='cart_summary')
+    course_count = models.IntegerField(default=0)
+    # units can be a range ("1 - 3") or a fraction, so these are floats
+    min_units = models.FloatField(default=0)
+    max_units = models.FloatField(default=0)
+    # courses that conflict with another course in the same cart
+    conflict_count = models.IntegerField(default=0)
+    terms = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def set_terms(self, terms):
+        """ replaces the entries, in strm order, and adds up the totals from them """
+        self.terms = sorted(terms, key=lambda term: term['strm'])
+        self.course_count = sum(term['course_count'] for term in self.terms)
+        self.min_units = sum(term['min_units'] for term in self.terms)
+        self.max_units = sum(term['max_units'] for term in self.terms)
+        self.conflict_count = sum(len(term['conflicts']) for term in self.terms)
+
+    def term(self, strm):
+        """ the entry for the cart in a term, or None """
+        return next((term for term in self.terms if term['strm'] == strm), None)
+
+    def __str__(self):
+        return f'{self.user} cart summary'
+
+class CatalogSync(models.Model):
+    """
+    sync watermark for one term (strm) of the local course catalog mirror.
+    next_page is the first page the next run will fetch, so an interrupted
+    sync picks up where it stopped.
+    """
+    strm = models.CharField(max_length=10, unique=True)
+    source = models.CharField(max_length=255, blank=True)
+    next_page = models.IntegerField(default=1)
+    page_size = models.IntegerField(blank=True, null=True)
+    courses_synced = models.IntegerField(default=0)
+    started_at = models.DateTimeField(blank=True, null=True)
+    completed_at = models.DateTimeField(blank=True, null=True)
+
+    @property
+    def in_progress(self):
+        return self.next_page > 1
+
+    def __str__(self):
+        return f'{self.strm} sync (next page {self.next_page})'
@@ -0,0 +1,69 @@
+"""
+turns the courses a class search finds into what the course list shows: each
+class once (SIS can repeat a class across pages), with the sections of a
+course grouped under it, a page of courses at a time.
+
+Search results are SIS dicts or Course objects (from the local mirror); both
+work here and in the templates.
+"""
+from collections import namedtuple
+
+from django.core.paginator import Paginator
+
+# a course (crse_id) in a term, and the sections of it in the results
+CourseGroup = namedtuple('CourseGroup', ['crse_id', 'subject', 'catalog_nbr', 'descr', 'sections'])
+
+# how many courses (not sections) the course list shows per page
+COURSES_PER_PAGE = 20
+
+def _field(course, name):
+    return course.get(name) if isinstance(course, dict) else getattr(course, name, None)
+
+class ResultAssembler:
+    """
+    collects search results as they come in (all at once, or a SIS page at a
+    time), dropping any class it has already seen and grouping sections by course
+    """
+    def __init__(self):
+        self.seen = set()
+        self.groups = {}
+
+    def add(self, courses):
+        """
+        adds a batch of courses, and returns what it added as (index of the
+        course among all the courses so far, CourseGroup of just the new sections)
+        """
+        added = {}
+        for course in courses:
+            class_nbr = _field(course, 'class_nbr')
+            if class_nbr in self.seen:
+                continue
+            self.seen.add(class_nbr)
+
+            # a course without a crse_id is its own group
+            key = (_field(course, 'strm'), _field(course, 'crse_id') or f'class-{class_nbr}')
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = CourseGroup(key[1], _field(course, 'subject'), _field(course, 'catalog_nbr'),
+                                                       _field(course, 'descr'), [])
+            group.sections.append(course)
+            if key not in added:
+                added[key] = group._replace(sections=[])
+            added[key].sections.append(course)
+
+        positions = {key: index for index, key in enumerate(self.groups)}
+        return [(positions[key], group) for key, group in added.items()]
+
+    def results(self):
+        """ every course so far, in the order they were first seen """
+        return list(self.groups.values())
+
+def assemble_results(courses):
+    """ the CourseGroups for a list of search results """
+    assembler = ResultAssembler()
+    assembler.add(courses)
+    return assembler.results()
+
+def paginate_results(groups, page, per_page=COURSES_PER_PAGE):
+    """ the django Page of `groups` for a ?page= value, clamped to the pages there are """
+    return Paginator(groups, per_page).get_page(page)
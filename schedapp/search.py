@@ -0,0 +1,130 @@
+# pylint: disable=no-member
+"""
+ranked full-text search over the local course catalog mirror (descr, topic,
+subject, catalog number, subject_descr and instructors).
+
+Postgres uses the `search_vector` tsvector column and its GIN index, SQLite
+uses the `course_fts` FTS5 table; both are created by migration 0017 and
+kept up to date by the database itself (a generated column / triggers). On
+any other database, or a SQLite built without FTS5, it falls back to
+unranked icontains matching. Every word typed is matched as a prefix, so
+results can follow the search box as the student types.
+"""
+import re
+from collections import namedtuple
+from functools import reduce
+from operator import and_
+
+from django.db import connection
+from django.db.models import Q
+
+from .conflicts import conflicting_meetings, exclude_conflicts
+from .models import Course
+
+SearchPage = namedtuple('SearchPage', ['courses', 'page', 'has_next'])
+
+# most words we'll look at in one query, so a pasted paragraph can't make an expensive search
+MAX_TERMS = 8
+
+def search_terms(query):
+    """ the words of a search, lowercased, with anything that isn't a letter or digit dropped """
+    return re.findall(r'\w+', (query or '').lower())[:MAX_TERMS]
+
+def _fts_table_ready():
+    # sqlite drops a table's triggers when a migration rebuilds it, and without
+    # them course_fts goes stale, so check for the triggers rather than the table.
+    # Asked once per connection: forget_fts_table (on connect and after migrate) clears it
+    ready = getattr(connection, '_fts_table_ready', None)
+    if ready is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+                           ['course_fts_insert', 'course_fts_delete', 'course_fts_update'])
+            ready = connection._fts_table_ready = cursor.fetchone()[0] == 3  # pylint: disable=protected-access
+    return ready
+
+def forget_fts_table(db_connection):
+    """ makes the next search on this connection check for the FTS5 table again """
+    db_connection._fts_table_ready = None  # pylint: disable=protected-access
+
+def search_backend():
+    """ which search implementation this database gets: 'postgres', 'fts5' or 'basic' """
+    if connection.vendor == 'postgresql':
+        return 'postgres'
+    if connection.vendor == 'sqlite' and _fts_table_ready():
+        return 'fts5'
+    return 'basic'
+
+def _fits_sql(fits):
+    # a WHERE clause leaving out courses that conflict with `fits`, and its params
+    meetings = conflicting_meetings(fits) if fits else None
+    if meetings is None:
+        return '', []
+    sql, params = meetings.values('course_id').query.sql_with_params()
+    return f" AND schedapp_course.class_nbr NOT IN ({sql})", list(params)
+
+def _postgres_ids(terms, strm, limit, offset, fits=None):
+    tsquery = ' & '.join(f'{term}:*' for term in terms)
+    sql = ("SELECT class_nbr FROM schedapp_course, to_tsquery('english', %s) query "
+           "WHERE search_vector @@ query")
+    params = [tsquery]
+    if strm:
+        sql += " AND strm = %s"
+        params.append(str(strm))
+    fits_sql, fits_params = _fits_sql(fits)
+    sql += fits_sql
+    params += fits_params
+    sql += " ORDER BY ts_rank_cd(search_vector, query) DESC, class_nbr LIMIT %s OFFSET %s"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+def _fts5_ids(terms, strm, limit, offset, fits=None):
+    match = ' '.join(f'"{term}"*' for term in terms)
+    # bm25 weights, in course_fts column order: a hit in the course number or title counts most
+    sql = ("SELECT course_fts.rowid FROM course_fts JOIN schedapp_course ON schedapp_course.class_nbr = course_fts.rowid "
+           "WHERE course_fts MATCH %s")
+    params = [match]
+    if strm:
+        sql += " AND schedapp_course.strm = %s"
+        params.append(str(strm))
+    fits_sql, fits_params = _fits_sql(fits)
+    sql += fits_sql
+    params += fits_params
+    sql += (" ORDER BY bm25(course_fts, 10.0, 10.0, 8.0, 4.0, 2.0, 2.0), course_fts.rowid"
+            " LIMIT %s OFFSET %s")
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+def _basic_courses(terms, strm, limit, offset, fits=None):
+    matches = [Q(subject__icontains=term) | Q(catalog_nbr__icontains=term) | Q(descr__icontains=term)
+               | Q(topic__icontains=term) | Q(subject_descr__icontains=term) | Q(instructors__icontains=term)
+               for term in terms]
+    courses = Course.objects.filter(reduce(and_, matches))
+    if strm:
+        courses = courses.filter(strm=strm)
+    if fits:
+        courses = exclude_conflicts(courses, fits)
+    return list(courses.order_by('subject', 'catalog_nbr', 'class_section')[offset:offset + limit])
+
+def search_courses(query, strm=None, page=1, page_size=20, fits=None):
+    """
+    one page of the courses matching every word of `query` (in term `strm`,
+    if given, and leaving out any that conflict with the courses in `fits`),
+    best match first. returns SearchPage(courses, page, has_next)
+    """
+    terms = search_terms(query)
+    page = max(page, 1)
+    if not terms:
+        return SearchPage([], page, False)
+
+    # one extra row tells us whether there's another page, without a count
+    limit, offset = page_size + 1, (page - 1) * page_size
+    backend = search_backend()
+    if backend == 'basic':
+        courses = _basic_courses(terms, strm, limit, offset, fits)
+    else:
+        ids = (_postgres_ids if backend == 'postgres' else _fts5_ids)(terms, strm, limit, offset, fits)
+        found = Course.objects.in_bulk(ids)
+        courses = [found[pk] for pk in ids if pk in found]
+    return SearchPage(courses[:page_size], page, len(courses) > page_size)
@@ -0,0 +1,183 @@
+# pylint: disable=no-member
+"""
+keeps seat counts fresh for the courses students are actually looking at.
+
+Seat counts (enrollment, waitlist, open/closed) are copied from SIS when a
+course is first seen and otherwise only change when someone happens to search
+for it again. refresh_seats polls SIS for the courses in any shopping cart or
+schedule, most wanted and longest unrefreshed first, and writes them back with
+bulk updates.
+
+One SIS search (term, subject and catalog number) returns every section of a
+course, a page at a time, so sections are refreshed a course at a time, and a
+TokenBucket keeps the whole run (every page) under SEATS_REQUESTS_PER_MINUTE. Run it with the refresh_seats
+management command, once from cron or continuously with --loop.
+"""
+import logging
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import CatalogSync, Course, Schedule, ShoppingCart, jsonCourseFields
+from .sis import SearchPages, iter_search_pages, normalize_course
+
+logger = logging.getLogger(__name__)
+
+# the Course fields a seat refresh updates
+SEAT_FIELDS = ('enrollment_available', 'enrollment_total', 'class_capacity', 'wait_tot', 'wait_cap',
+               'enrl_stat', 'enrl_stat_descr')
+
+RefreshStats = namedtuple('RefreshStats', ['requests', 'courses', 'changed', 'failed'])
+
+class TokenBucket:
+    """
+    allows `rate` requests a minute on average, in bursts of up to `burst`
+
+        bucket = TokenBucket(30)
+        bucket.take()  # waits until another request is allowed
+    """
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate / 60
+        self.capacity = burst or max(1, min(rate, 10))
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        """ takes a token if there is one, without waiting """
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def take(self):
+        """ waits for a token and takes it """
+        while not self.try_take():
+            with self._lock:
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+# ------- What to refresh -------
+def popularity():
+    """ class_nbr -> how many shopping carts and schedules it's in """
+    counts = Counter()
+    for through in (ShoppingCart.courses.through, Schedule.courses.through):
+        counts.update(dict(through.objects.values_list('course_id').annotate(count=Count('pk')).order_by()))
+    return counts
+
+def refresh_queue(min_age=None, now=None):
+    """
+    the courses in any cart or schedule that haven't been refreshed in the last
+    `min_age` seconds, grouped into one list of sections per SIS search, most
+    urgent first: never-refreshed courses, then by popularity times staleness
+    """
+    now = now or timezone.now()
+    min_age = getattr(settings, 'SEATS_MIN_AGE', 300) if min_age is None else min_age
+    wanted = popularity()
+    courses = (Course.objects.filter(pk__in=list(wanted))
+               .exclude(seats_refreshed_at__gt=now - timedelta(seconds=min_age))
+               .only('class_nbr', 'strm', 'subject', 'catalog_nbr', 'seats_refreshed_at', *SEAT_FIELDS))
+
+    def urgency(course):
+        if course.seats_refreshed_at is None:
+            return (0, -wanted[course.pk])
+        return (1, -wanted[course.pk] * (now - course.seats_refreshed_at).total_seconds())
+
+    searches = {}
+    for course in sorted(courses, key=urgency):
+        searches.setdefault((course.strm, course.subject, course.catalog_nbr), []).append(course)
+    return list(searches.items())
+
+# ------- Refreshing -------
+def page_sizes():
+    """
+    strm -> how many courses a full page of SIS search results has, as the
+    term's last catalog sync saw it, so a course whose sections fit on one
+    page costs one request even when SIS_PAGE_SIZE isn't set
+    """
+    return dict(CatalogSync.objects.exclude(page_size=None).values_list('strm', 'page_size'))
+
+def _apply(course, data):
+    # copies the seat fields of a SIS course dict onto `course`; returns whether any changed
+    fields = jsonCourseFields(normalize_course(data))
+    changed = False
+    for name in SEAT_FIELDS:
+        if getattr(course, name) != fields[name]:
+            setattr(course, name, fields[name])
+            changed = True
+    return changed
+
+def refresh_seats(rate=None, max_requests=None, min_age=None, bucket=None, batch_size=50, log=None):
+    """
+    polls SIS for the seat counts of the courses in refresh_queue, at most
+    `rate` requests a minute (SEATS_REQUESTS_PER_MINUTE) and `max_requests`
+    (pages) in all, writing them back every `batch_size` searches so a long
+    run makes progress as it goes. Only the sections SIS returned are marked
+    refreshed; the rest (from a failed page, one we didn't get to, or missing
+    from the results) count as failed and stay in the queue.
+    returns RefreshStats(requests, courses, changed, failed)
+    """
+    bucket = bucket or TokenBucket(rate or getattr(settings, 'SEATS_REQUESTS_PER_MINUTE', 30))
+    sizes = page_sizes()
+    requests = courses = changed = failed = 0
+    pending = []
+
+    def flush():
+        if pending:
+            Course.objects.bulk_update(pending, SEAT_FIELDS + ('seats_refreshed_at',), batch_size=500)
+            pending.clear()
+
+    def out_of_requests():
+        return max_requests is not None and requests >= max_requests
+
+    for searched, ((strm, subject, catalog_nbr), sections) in enumerate(refresh_queue(min_age), 1):
+        if out_of_requests():
+            break
+        found = {}
+        pages = SearchPages(page_size=sizes.get(str(strm)))
+        bucket.take()
+        requests += 1
+        # one page at a time, so each one waits for its own token
+        search = iter_search_pages({'term': strm, 'subject': subject, 'catalog_nbr': catalog_nbr},
+                                   max_workers=1, pages=pages)
+        for page, results in enumerate(search, 1):
+            if page in pages.failed:
+                break
+            found.update((course.get('class_nbr'), course) for course in results)
+            if page < pages.last_page:
+                if out_of_requests():
+                    break
+                # the next page is requested as the loop comes round
+                bucket.take()
+                requests += 1
+        search.close()
+
+        refreshed_at = timezone.now()
+        returned = [section for section in sections if section.pk in found]
+        for section in returned:
+            if _apply(section, found[section.pk]):
+                changed += 1
+            section.seats_refreshed_at = refreshed_at
+            pending.append(section)
+        courses += len(returned)
+        failed += len(sections) - len(returned)
+        if log:
+            log(f"{subject} {catalog_nbr} ({strm}): {len(returned)} of {len(sections)} sections")
+        if searched % batch_size == 0:
+            flush()
+    flush()
+    return RefreshStats(requests, courses, changed, failed)
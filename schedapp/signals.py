@@ -0,0 +1,101 @@
+# pylint: disable=no-member
+"""
+signal handlers, connected in SchedappConfig.ready
+"""
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .catalog_snapshot import invalidate_term
+from .models import CartSummary, Course, Schedule, ScheduleSummary, ShoppingCart, User
+from .search import forget_fts_table
+from .summaries import carts_changed, refresh_cart_summary, refresh_schedule_summaries
+
+def _changed_pks(sender, instance, action, reverse, pk_set, owner_field):
+    """ the pks of the schedules/carts whose courses an m2m_changed signal is about """
+    if not reverse:
+        return [instance.pk] if action in ('post_add', 'post_remove', 'post_clear') else []
+    # changed from the course's end: course.schedule_set.add(...)
+    if action in ('post_add', 'post_remove'):
+        return pk_set
+    if action == 'pre_clear':
+        # a clear doesn't say what it removed, so look before it happens
+        return list(sender.objects.filter(course=instance).values_list(owner_field, flat=True))
+    return []
+
+@receiver(m2m_changed, sender=Schedule.courses.through)
+def schedule_courses_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    adding or removing courses changes the schedule, as far as its updated_at
+    (and ETag) go, and its summary is worked out again
+    """
+    pks = _changed_pks(sender, instance, action, reverse, pk_set, 'schedule_id')
+    if pks:
+        Schedule.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+
+    # as with carts below, a clear from the course's end is worked out once it's done
+    if reverse and action == 'pre_clear':
+        instance._cleared_schedules = list(pks)  # pylint: disable=protected-access
+    elif reverse and action == 'post_clear':
+        refresh_schedule_summaries(instance.__dict__.pop('_cleared_schedules', []))
+    elif pks:
+        refresh_schedule_summaries(pks)
+
+@receiver(post_save, sender=Schedule)
+def schedule_created(sender, instance, created, raw=False, **kwargs):
+    """ a new schedule starts with an empty summary, so the list pages never have to build one """
+    if created and not raw:
+        ScheduleSummary.objects.get_or_create(schedule=instance)
+
+@receiver(m2m_changed, sender=ShoppingCart.courses.through)
+def cart_courses_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """ the same for shopping carts, which also have their owners' cart summaries brought up to date """
+    pks = _changed_pks(sender, instance, action, reverse, pk_set, 'shoppingcart_id')
+    if pks:
+        ShoppingCart.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+
+    # summaries are counted once the change is made, so a clear from the course's end has to remember its carts
+    if reverse and action == 'pre_clear':
+        instance._cleared_carts = list(pks)  # pylint: disable=protected-access
+    elif reverse and action == 'post_clear':
+        carts_changed(instance.__dict__.pop('_cleared_carts', []))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if reverse:
+            carts_changed(pks)
+        else:
+            refresh_cart_summary(instance.user_id, [instance.strm])
+
+@receiver(post_save, sender=ShoppingCart)
+def cart_saved(sender, instance, created, **kwargs):
+    """ a new cart gets its (empty) entry in its student's summary """
+    if created:
+        refresh_cart_summary(instance.user_id, [instance.strm])
+
+@receiver(post_delete, sender=ShoppingCart)
+def cart_deleted(sender, instance, **kwargs):
+    """ a deleted cart's entry goes; with create=False, so deleting the student as well doesn't make a new summary """
+    refresh_cart_summary(instance.user_id, [instance.strm], create=False)
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, raw=False, **kwargs):
+    """ a new student starts with an empty cart summary, so reading it never has to build one """
+    if created and not raw and not instance.is_advisor:
+        CartSummary.objects.get_or_create(user=instance)
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_changed(sender, instance, **kwargs):
+    """ a saved or deleted course makes its term's catalog snapshot stale """
+    invalidate_term(instance.strm)
+
+@receiver(connection_created)
+def database_connected(sender, connection, **kwargs):
+    """ a new connection looks for the full-text search table again, the first time it searches """
+    forget_fts_table(connection)
+
+@receiver(post_migrate)
+def database_migrated(sender, using, **kwargs):
+    """ a migration may have added or rebuilt the full-text search table """
+    forget_fts_table(connections[using])
@@ -0,0 +1,354 @@
+"""
+helpers for talking to the SIS class search api.
+
+Every request goes through fetch_search_page (or sis_async.afetch_search_page),
+which reuses pooled connections, times out, retries connection errors and
+429/5xx answers a couple of times with jittered exponential backoff, and keeps
+request counts and latencies for request_stats(). A circuit breaker per SIS url
+stops calling it after SIS_BREAKER_FAILURES failed calls in a row; while it's
+open, calls fail at once instead of each waiting out a timeout, and searches
+fall back to the local catalog (see sis_available). After SIS_BREAKER_RESET
+seconds one call is let through to see whether SIS is back.
+"""
+import contextvars
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .metrics import record_sis_call
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEARCH_URL = 'https://sisuva.admin.virginia.edu/psc/ihprd/UVSS/SA/s/WEBLIB_HCX_CM.H_CLASS_SEARCH.FieldFormula.IScript_ClassSearch'
+
+# the query parameters the class search endpoint understands, in the order we send them
+SEARCH_PARAMS = ('term', 'subject', 'acad_org', 'catalog_nbr', 'instruction_mode', 'keyword', 'session_code', 'location')
+
+# SIS sends times like 13.00.00.000000-05:00, we store and show them like 01:00 PM
+SIS_TIME_FORMAT = '%H.%M.%S.%f'
+DISPLAY_TIME_FORMAT = '%I:%M %p'
+
+_session = None
+_session_lock = threading.Lock()
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def get_session():
+    """
+    returns the shared requests session, so searches reuse pooled keep-alive
+    connections instead of doing a new tls handshake for every page
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                workers = _setting('SIS_MAX_WORKERS', 4)
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=workers)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+# ------- Retries, circuit breaker and metrics -------
+# answers worth asking again for; anything else is SIS's final answer
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# upper bounds, in seconds, of the request latency histogram in request_stats()
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class CircuitBreaker:
+    """
+    closed: calls go through. open (after `threshold` failed calls in a row):
+    calls are refused for `reset_after` seconds. half open: after that, one call
+    is let through, and closes the breaker if it works or opens it again if not
+    """
+    def __init__(self, threshold=5, reset_after=30, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'open' if self.clock() - self.opened_at < self.reset_after else 'half-open'
+
+    def available(self):
+        """ whether a call might go through now, without using up the half-open trial call """
+        return self.state != 'open'
+
+    def allow(self):
+        """ whether to make a call now; every allowed call must be followed by record() """
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def cancel(self):
+        """ an allowed call was abandoned before it finished, so let another one try """
+        with self._lock:
+            self.probing = False
+
+    def record(self, ok):
+        with self._lock:
+            self.probing = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.error("SIS failed %s times in a row, not calling it for %ss", self.failures, self.reset_after)
+                self.opened_at = self.clock()
+
+_breakers = {}
+_metrics = {'requests': 0, 'failures': 0, 'retries': 0, 'short_circuits': 0, 'latency_sum': 0.0}
+_latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+_metrics_lock = threading.Lock()
+
+def search_url():
+    return _setting('SIS_SEARCH_URL', DEFAULT_SEARCH_URL)
+
+def circuit_breaker(url=None):
+    """ the breaker for a SIS url (SIS_SEARCH_URL by default), shared by every thread """
+    url = url or search_url()
+    with _metrics_lock:
+        if url not in _breakers:
+            _breakers[url] = CircuitBreaker(_setting('SIS_BREAKER_FAILURES', 5), _setting('SIS_BREAKER_RESET', 30))
+        return _breakers[url]
+
+def sis_available():
+    """ whether SIS is worth calling, i.e. its circuit breaker isn't open """
+    return circuit_breaker().available()
+
+def _count(name):
+    with _metrics_lock:
+        _metrics[name] += 1
+
+def observe(seconds, ok):
+    """ records one request to SIS: how long it took and whether it worked """
+    with _metrics_lock:
+        _metrics['requests'] += 1
+        _metrics['failures'] += not ok
+        _metrics['latency_sum'] += seconds
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        _latency_counts[bucket] += 1
+    record_sis_call(seconds)
+
+def request_stats():
+    """
+    this process's SIS request counters: requests (every attempt), failures,
+    retries, short_circuits (calls refused by an open breaker), latency_sum in
+    seconds, latency_buckets (cumulative counts of requests at or under each
+    bound in LATENCY_BUCKETS, then all of them) and each url's breaker state
+    """
+    with _metrics_lock:
+        stats = dict(_metrics)
+        running = 0
+        buckets = []
+        for bound, bucket_count in zip(LATENCY_BUCKETS + (float('inf'),), _latency_counts):
+            running += bucket_count
+            buckets.append((bound, running))
+        stats['latency_buckets'] = buckets
+        breakers = dict(_breakers)
+    stats['breakers'] = {url: breaker.state for url, breaker in breakers.items()}
+    return stats
+
+def reset_request_stats():
+    """ zeroes the counters and closes every breaker """
+    with _metrics_lock:
+        for name in _metrics:
+            _metrics[name] = 0
+        _metrics['latency_sum'] = 0.0
+        _latency_counts[:] = [0] * len(_latency_counts)
+        _breakers.clear()
+
+def retry_delay(attempt):
+    """ seconds to wait before retry number `attempt` (from 1): exponential backoff, jittered so callers spread out """
+    backoff = min(_setting('SIS_RETRY_BACKOFF', 0.2) * 2 ** (attempt - 1), _setting('SIS_RETRY_MAX_BACKOFF', 2.0))
+    return backoff * random.uniform(0.5, 1.5)
+
+def search_query(params, page):
+    """ builds the query string parameters for one page of a class search """
+    query = {'institution': 'UVA01'}
+    for name in SEARCH_PARAMS:
+        value = params.get(name)
+        query[name] = '' if value is None else value
+    query['page'] = page
+    return query
+
+def fetch_search_page(params, page, session=None):
+    """
+    fetches a single page of search results. Anything other than a 200 with a json
+    list (including timeouts) is logged and treated as a page with no results.
+    returns (page, courses, ok)
+    """
+    session = session or get_session()
+    url = search_url()
+    breaker = circuit_breaker(url)
+    if not breaker.allow():
+        _count('short_circuits')
+        return page, [], False
+
+    for attempt in range(_setting('SIS_RETRIES', 2) + 1):
+        if attempt:
+            _count('retries')
+            time.sleep(retry_delay(attempt))
+        start = time.perf_counter()
+        try:
+            response = session.get(url, params=search_query(params, page), timeout=_setting('SIS_TIMEOUT', (3.05, 10)))
+        except requests.ReadTimeout as error:
+            # SIS took the request and sat on it; asking again would only hold this worker longer
+            observe(time.perf_counter() - start, False)
+            logger.warning("SIS search page %s timed out: %s", page, error)
+            break
+        except requests.RequestException as error:
+            observe(time.perf_counter() - start, False)
+            logger.warning("SIS search page %s failed: %s", page, error)
+            continue
+        observe(time.perf_counter() - start, response.status_code not in RETRY_STATUSES)
+        if response.status_code in RETRY_STATUSES:
+            logger.warning("SIS search page %s returned %s", page, response.status_code)
+            continue
+        breaker.record(True)
+        return page_result(page, response)
+
+    breaker.record(False)
+    return page, [], False
+
+def page_result(page, response):
+    """ (page, courses, ok) for a response to a search page request, from requests or httpx """
+    if response.status_code != 200:
+        logger.warning("SIS search page %s returned %s", page, response.status_code)
+        return page, [], False
+
+    try:
+        courses = response.json()
+    except ValueError:
+        logger.warning("SIS search page %s did not return json", page)
+        return page, [], False
+    return page, courses if isinstance(courses, list) else [], True
+
+class SearchPages:
+    """
+    the pages of one search as they come in, in any order, and which page is the last.
+
+    A page is the last one if it comes back empty, or shorter than a full page
+    (SIS_PAGE_SIZE if set, otherwise the length of page 1).
+    """
+    def __init__(self, max_pages=None, page_size=None):
+        self.results = {}
+        self.failed = set()
+        self.last_page = max_pages or _setting('SIS_MAX_PAGES', 7)
+        self.page_size = page_size or _setting('SIS_PAGE_SIZE', None)
+
+    def add(self, page, courses, ok):
+        self.results[page] = courses
+        if not ok:
+            self.failed.add(page)
+        elif not courses or (self.page_size and len(courses) < self.page_size):
+            self.last_page = min(self.last_page, page)
+
+        # once page 1 is in we know what a full page looks like
+        if not self.page_size and self.results.get(1):
+            self.page_size = len(self.results[1])
+            for other, other_courses in self.results.items():
+                if other not in self.failed and len(other_courses) < self.page_size:
+                    self.last_page = min(self.last_page, other)
+
+    @property
+    def complete(self):
+        """ whether every page up to the last one came back ok """
+        return not any(page <= self.last_page for page in self.failed)
+
+    def merged(self):
+        """ the courses of every page up to the last one, in page order """
+        merged = []
+        for page in sorted(self.results):
+            if page <= self.last_page:
+                merged.extend(self.results[page])
+        return merged
+
+def fetch_search_pages(params, max_pages=None, max_workers=None, session=None):
+    """
+    fetches every page of a class search with a bounded pool of workers.
+
+    Once we know the last page (see SearchPages) nothing after it is requested,
+    and anything after it that was already in flight is thrown away. Results
+    are returned merged in page order.
+    """
+    return _fetch_search_pages(params, max_pages, max_workers, session)[0]
+
+def _fetch_search_pages(params, max_pages=None, max_workers=None, session=None):
+    # returns (merged courses, whether every page up to the last one came back ok)
+    pages = SearchPages(max_pages)
+    for _ in iter_search_pages(params, max_workers=max_workers, session=session, pages=pages):
+        pass
+    return pages.merged(), pages.complete
+
+def iter_search_pages(params, max_pages=None, max_workers=None, session=None, pages=None):
+    """
+    fetches a class search like fetch_search_pages, but yields the courses of
+    each page, in page order, as soon as that page and the ones before it are
+    in. Pass a SearchPages as `pages` to see afterwards whether it was complete.
+    Closing the generator early stops the search.
+    """
+    max_workers = max_workers or _setting('SIS_MAX_WORKERS', 4)
+    session = session or get_session()
+    pages = pages if pages is not None else SearchPages(max_pages)
+    next_page = 1
+    next_to_yield = 1
+
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sis-search')
+    try:
+        pending = {}
+        while pending or next_page <= pages.last_page:
+            while next_page <= pages.last_page and len(pending) < max_workers:
+                # each page in the caller's context, so its time counts towards the caller's request
+                future = pool.submit(contextvars.copy_context().run, fetch_search_page, params, next_page, session)
+                pending[future] = next_page
+                next_page += 1
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+                pages.add(*future.result())
+
+            # anything still in flight past the last page is not worth waiting for
+            pending = {future: page for future, page in pending.items() if page <= pages.last_page}
+
+            while next_to_yield <= pages.last_page and next_to_yield in pages.results:
+                yield pages.results[next_to_yield]
+                next_to_yield += 1
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def readable_time(value):
+    """ turns a SIS meeting time into the 12 hour format we store, leaving anything else alone """
+    if not value or '.' not in value:
+        return value
+    return datetime.strptime(value[:-6], SIS_TIME_FORMAT).strftime(DISPLAY_TIME_FORMAT)
+
+def normalize_course(course):
+    """ rewrites the meeting times of a SIS course in place, and returns it """
+    for meeting in course.get('meetings') or []:
+        meeting['start_time'] = readable_time(meeting.get('start_time'))
+        meeting['end_time'] = readable_time(meeting.get('end_time'))
+    return course
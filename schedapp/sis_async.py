@@ -0,0 +1,130 @@
+"""
+the SIS class search for async views: the same paging as sis.fetch_search_pages,
+without tying up a thread per search while SIS thinks.
+
+Pages are fetched with httpx when it's installed. Without it each page request
+falls back to sis.fetch_search_page on a worker thread (SIS_ASYNC_THREADS of
+them, shared by every search), which still keeps the event loop free but costs
+a thread per page in flight.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .sis import (RETRY_STATUSES, SearchPages, _count, _setting, circuit_breaker, fetch_search_page, observe,
+                  page_result, retry_delay, search_query, search_url)
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - httpx is optional
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _fallback_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=_setting('SIS_ASYNC_THREADS', 32),
+                                           thread_name_prefix='sis-search-async')
+    return _pool
+
+def _timeout():
+    timeout = _setting('SIS_TIMEOUT', (3.05, 10))
+    if isinstance(timeout, (tuple, list)):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+def make_client(max_workers=None):
+    """ an httpx client with a keep-alive connection for each page fetched at once """
+    max_workers = max_workers or _setting('SIS_MAX_WORKERS', 4)
+    return httpx.AsyncClient(timeout=_timeout(),
+                             limits=httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers))
+
+async def afetch_search_page(params, page, client=None):
+    """ fetch_search_page for async code, with the same retries and circuit breaker. returns (page, courses, ok) """
+    if client is None:
+        return await asyncio.get_running_loop().run_in_executor(_fallback_pool(), contextvars.copy_context().run,
+                                                                 fetch_search_page, params, page)
+
+    url = search_url()
+    breaker = circuit_breaker(url)
+    if not breaker.allow():
+        _count('short_circuits')
+        return page, [], False
+
+    try:
+        for attempt in range(_setting('SIS_RETRIES', 2) + 1):
+            if attempt:
+                _count('retries')
+                await asyncio.sleep(retry_delay(attempt))
+            start = time.perf_counter()
+            try:
+                response = await client.get(url, params=search_query(params, page))
+            except httpx.ReadTimeout as error:
+                observe(time.perf_counter() - start, False)
+                logger.warning("SIS search page %s timed out: %s", page, error)
+                break
+            except httpx.HTTPError as error:
+                observe(time.perf_counter() - start, False)
+                logger.warning("SIS search page %s failed: %s", page, error)
+                continue
+            observe(time.perf_counter() - start, response.status_code not in RETRY_STATUSES)
+            if response.status_code in RETRY_STATUSES:
+                logger.warning("SIS search page %s returned %s", page, response.status_code)
+                continue
+            breaker.record(True)
+            return page_result(page, response)
+    except asyncio.CancelledError:
+        # a page past the end of the search, dropped while still in flight
+        breaker.cancel()
+        raise
+
+    breaker.record(False)
+    return page, [], False
+
+async def afetch_search_pages(params, max_pages=None, max_workers=None, client=None):
+    """ every page of a class search, merged in page order, like sis.fetch_search_pages """
+    return (await _afetch_search_pages(params, max_pages, max_workers, client))[0]
+
+async def _afetch_search_pages(params, max_pages=None, max_workers=None, client=None):
+    # returns (merged courses, whether every page up to the last one came back ok)
+    max_workers = max_workers or _setting('SIS_MAX_WORKERS', 4)
+    if client is None and httpx is not None:
+        # an httpx client belongs to the event loop it was opened on, and under
+        # wsgi every request gets a new loop, so each search opens its own
+        async with make_client(max_workers) as client:
+            return await _afetch_search_pages(params, max_pages, max_workers, client)
+
+    pages = SearchPages(max_pages)
+    next_page = 1
+    pending = {}
+    try:
+        while pending or next_page <= pages.last_page:
+            while next_page <= pages.last_page and len(pending) < max_workers:
+                pending[asyncio.ensure_future(afetch_search_page(params, next_page, client))] = next_page
+                next_page += 1
+
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                del pending[task]
+                pages.add(*task.result())
+
+            # anything still in flight past the last page is not worth waiting for
+            for task, page in list(pending.items()):
+                if page > pages.last_page:
+                    task.cancel()
+                    del pending[task]
+    finally:
+        for task in pending:
+            task.cancel()
+
+    return pages.merged(), pages.complete
@@ -0,0 +1,259 @@
+"""
+a response cache in front of the SIS class search.
+
+Results are kept in the 'sis' cache (see CACHES in settings) for
+SIS_CACHE_TIMEOUT seconds, keyed on the search params with case and stray
+whitespace normalized away, so "cs " and "CS" share an entry. Searches that
+didn't come back whole (a page failed or timed out) are never cached.
+
+When a popular search expires, everyone asking for it at once would otherwise
+go out to SIS together. Instead one caller fetches and the rest wait for its
+result: within a process they queue on a per-search lock, and across processes
+the fetcher holds a short-lived lock key in the cache (cache.add is atomic on
+every backend) while the others poll for the result.
+
+acached_search_pages is the same for async views, and stream_search_pages
+hands out each page as it arrives.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .sis import SEARCH_PARAMS, SearchPages, _fetch_search_pages, iter_search_pages
+from .sis_async import _afetch_search_pages
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = 'sis'
+KEY_PREFIX = 'sis-search'
+
+# params whose values are codes (CS, 1238, ...), matched case-insensitively by SIS
+_CODE_PARAMS = ('term', 'subject', 'acad_org', 'catalog_nbr', 'instruction_mode', 'session_code', 'location')
+
+_stats = {'hits': 0, 'misses': 0, 'waits': 0, 'uncached': 0}
+_stats_lock = threading.Lock()
+
+# search key -> [lock, how many callers are using it], dropped when the last one is done
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+# the same for async callers, per event loop, since an asyncio.Lock belongs to one loop
+_async_key_locks = weakref.WeakKeyDictionary()
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def cache_stats():
+    """ this process's cache counters: hits, misses, waits (served by another caller's fetch) and uncached """
+    with _stats_lock:
+        return dict(_stats)
+
+def reset_cache_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+def normalize_params(params):
+    """ the search params that matter, with whitespace collapsed and codes uppercased """
+    normalized = {}
+    for name in SEARCH_PARAMS:
+        value = ' '.join(str(params.get(name) or '').split())
+        if not value:
+            continue
+        normalized[name] = value.upper() if name in _CODE_PARAMS else value.lower()
+    return normalized
+
+def search_cache_key(params):
+    """ the cache key for a search; the same for any two searches SIS would answer the same way """
+    digest = hashlib.sha1(json.dumps(normalize_params(params), sort_keys=True).encode()).hexdigest()
+    return f'{KEY_PREFIX}:{digest}'
+
+@contextmanager
+def _key_lock(key):
+    with _key_locks_lock:
+        entry = _key_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _key_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _key_locks[key]
+
+@asynccontextmanager
+async def _async_key_lock(key):
+    # no awaits between looking the lock up and counting ourselves in, so no lock is needed here
+    locks = _async_key_locks.setdefault(asyncio.get_running_loop(), {})
+    entry = locks.setdefault(key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del locks[key]
+
+def _wait_for(cache, key, lock_key, timeout):
+    # another process is fetching this search; poll until it lands or their lock goes away
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        courses = cache.get(key)
+        if courses is not None:
+            return courses
+        if cache.get(lock_key) is None:
+            return cache.get(key)
+    return None
+
+async def _await_for(cache, key, lock_key, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        courses = await cache.aget(key)
+        if courses is not None:
+            return courses
+        if await cache.aget(lock_key) is None:
+            return await cache.aget(key)
+    return None
+
+def _fetch(cache, key, params, fetch_kwargs):
+    courses, complete = _fetch_search_pages(params, **fetch_kwargs)
+    if complete:
+        cache.set(key, courses, _setting('SIS_CACHE_TIMEOUT', 300))
+    else:
+        _count('uncached')
+        logger.info("not caching incomplete SIS search %s", key)
+    return courses
+
+async def _afetch(cache, key, params, fetch_kwargs):
+    courses, complete = await _afetch_search_pages(params, **fetch_kwargs)
+    if complete:
+        await cache.aset(key, courses, _setting('SIS_CACHE_TIMEOUT', 300))
+    else:
+        _count('uncached')
+        logger.info("not caching incomplete SIS search %s", key)
+    return courses
+
+def _sourced(courses, from_sis, with_source):
+    return (courses, from_sis) if with_source else courses
+
+def cached_search_pages(params, with_source=False, **fetch_kwargs):
+    """
+    every page of a class search, like sis.fetch_search_pages, but answered
+    from the cache when we can and fetched at most once at a time per search.
+    the courses returned are the caller's own copy, free to modify. With
+    with_source, returns (courses, from_sis): whether this call fetched them
+    from SIS rather than finding them cached
+    """
+    cache = caches[CACHE_ALIAS]
+    key = search_cache_key(params)
+
+    courses = cache.get(key)
+    if courses is not None:
+        _count('hits')
+        return _sourced(courses, False, with_source)
+
+    with _key_lock(key):
+        # whoever held the lock before us may have just filled it in
+        courses = cache.get(key)
+        if courses is not None:
+            _count('waits')
+            return _sourced(courses, False, with_source)
+
+        _count('misses')
+        lock_key = f'{key}:lock'
+        lock_timeout = _setting('SIS_CACHE_LOCK_TIMEOUT', 30)
+        if cache.add(lock_key, True, lock_timeout):
+            try:
+                return _sourced(_fetch(cache, key, params, fetch_kwargs), True, with_source)
+            finally:
+                cache.delete(lock_key)
+
+        courses = _wait_for(cache, key, lock_key, lock_timeout)
+        if courses is not None:
+            return _sourced(courses, False, with_source)
+        # the other process gave up or failed, so go ahead ourselves
+        return _sourced(_fetch(cache, key, params, fetch_kwargs), True, with_source)
+
+async def acached_search_pages(params, with_source=False, **fetch_kwargs):
+    """ cached_search_pages for async views, fetching with sis_async """
+    cache = caches[CACHE_ALIAS]
+    key = search_cache_key(params)
+
+    courses = await cache.aget(key)
+    if courses is not None:
+        _count('hits')
+        return _sourced(courses, False, with_source)
+
+    async with _async_key_lock(key):
+        courses = await cache.aget(key)
+        if courses is not None:
+            _count('waits')
+            return _sourced(courses, False, with_source)
+
+        _count('misses')
+        lock_key = f'{key}:lock'
+        lock_timeout = _setting('SIS_CACHE_LOCK_TIMEOUT', 30)
+        if await cache.aadd(lock_key, True, lock_timeout):
+            try:
+                return _sourced(await _afetch(cache, key, params, fetch_kwargs), True, with_source)
+            finally:
+                await cache.adelete(lock_key)
+
+        courses = await _await_for(cache, key, lock_key, lock_timeout)
+        if courses is not None:
+            return _sourced(courses, False, with_source)
+        return _sourced(await _afetch(cache, key, params, fetch_kwargs), True, with_source)
+
+def stream_search_pages(params, with_source=False, **fetch_kwargs):
+    """
+    yields the courses of a class search a page at a time, as they come in
+    from SIS, caching the whole search once it's done. A cached search comes
+    out as a single page, and if someone else is already fetching this search
+    we wait for theirs rather than stream a second copy of it. With
+    with_source, yields (courses, from_sis) like cached_search_pages
+    """
+    cache = caches[CACHE_ALIAS]
+    key = search_cache_key(params)
+
+    courses = cache.get(key)
+    if courses is not None:
+        _count('hits')
+        yield _sourced(courses, False, with_source)
+        return
+
+    lock_key = f'{key}:lock'
+    if not cache.add(lock_key, True, _setting('SIS_CACHE_LOCK_TIMEOUT', 30)):
+        yield cached_search_pages(params, with_source, **fetch_kwargs)
+        return
+
+    _count('misses')
+    try:
+        pages = SearchPages(fetch_kwargs.pop('max_pages', None))
+        fetched = []
+        for courses in iter_search_pages(params, pages=pages, **fetch_kwargs):
+            # callers may normalize these in place before they're cached, which is
+            # fine since normalize_course leaves already-normalized courses alone
+            fetched.extend(courses)
+            yield _sourced(courses, True, with_source)
+        if pages.complete:
+            cache.set(key, fetched, _setting('SIS_CACHE_TIMEOUT', 300))
+        else:
+            _count('uncached')
+            logger.info("not caching incomplete SIS search %s", key)
+    finally:
+        cache.delete(lock_key)
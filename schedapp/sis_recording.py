@@ -0,0 +1,124 @@
+"""
+recorded SIS class search responses, so searches can be replayed offline by
+the stub server (sis_stub.StubSISServer(recording=...)) with the same pages,
+statuses and courses SIS gave when they were recorded.
+
+A recording is one json file, gzipped if its name ends in .gz. Each course is
+stored once, by class_nbr, however many searches it turned up in, and each
+recorded page lists the class_nbrs it returned:
+
+    {"version": 1, "url": "...", "recorded_at": "...",
+     "courses": {"15529": {...}, ...},
+     "searches": {"subject=APMA&term=1228": {"1": {"status": 200, "classes": [15529, ...]},
+                                             "2": {"status": 200, "classes": []}}}}
+
+A page that wasn't a json list (an error page, say) keeps its status and text
+as "body" instead. A course seen in more than one search keeps the copy
+recorded last. Record with the record_sis management command and replay
+with sis_stub_server.
+"""
+import gzip
+import json
+import time
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from .sis import SEARCH_PARAMS, get_session, search_query, search_url
+
+VERSION = 1
+
+def search_key(query):
+    """ the search a query (a params dict, or a request's query string values) is for, page left out """
+    return urlencode(sorted((name, str(query[name])) for name in SEARCH_PARAMS if query.get(name) not in (None, '')))
+
+class SISRecording:
+    """
+    recorded class search pages, by search (search_key) and page number
+
+        recording = SISRecording.load('sis.json.gz')
+        status, body = recording.response({'term': '1228', 'subject': 'APMA'}, 1)
+    """
+    def __init__(self, courses=None, searches=None, url=None, recorded_at=None):
+        self.courses = courses if courses is not None else {}
+        self.searches = searches if searches is not None else {}
+        self.url = url
+        self.recorded_at = recorded_at
+
+    @classmethod
+    def load(cls, path):
+        opener = gzip.open if str(path).endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as file:
+            data = json.load(file)
+        if data.get('version') != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} SIS recording")
+        return cls(data['courses'], data['searches'], data.get('url'), data.get('recorded_at'))
+
+    def save(self, path):
+        data = {'version': VERSION, 'url': self.url, 'recorded_at': self.recorded_at,
+                'courses': self.courses, 'searches': self.searches}
+        opener = gzip.open if str(path).endswith('.gz') else open
+        with opener(path, 'wt', encoding='utf-8') as file:
+            json.dump(data, file, separators=(',', ':'))
+
+    def add(self, query, page, status, body):
+        """ records one page: `body` is the parsed json if it was a list of courses, otherwise the response text """
+        if isinstance(body, list):
+            for course in body:
+                self.courses[str(course['class_nbr'])] = course
+            entry = {'status': status, 'classes': [course['class_nbr'] for course in body]}
+        else:
+            entry = {'status': status, 'body': body}
+        self.searches.setdefault(search_key(query), {})[str(page)] = entry
+
+    def response(self, query, page):
+        """ (status, body) recorded for a page of a search, body as add() took it, or None if it wasn't recorded """
+        entry = self.searches.get(search_key(query), {}).get(str(page))
+        if entry is None:
+            return None
+        if 'classes' in entry:
+            return entry['status'], [self.courses[str(class_nbr)] for class_nbr in entry['classes']]
+        return entry['status'], entry['body']
+
+    def __contains__(self, query):
+        """ whether any page of this query's search was recorded """
+        return search_key(query) in self.searches
+
+    def __len__(self):
+        return sum(len(pages) for pages in self.searches.values())
+
+def record_search(recording, params, max_pages=None, delay=0, session=None):
+    """
+    fetches a class search from SIS (SIS_SEARCH_URL) a page at a time into
+    `recording`, up to and including the first page that's empty, short, or not
+    a 200, waiting `delay` seconds between pages. Nothing is retried: a failure
+    is recorded as SIS gave it. returns how many courses were recorded
+    """
+    session = session or get_session()
+    recording.url = search_url()
+    recording.recorded_at = timezone.now().isoformat()
+    page_size = None
+    found = 0
+    for page in range(1, (max_pages or getattr(settings, 'SIS_MAX_PAGES', 7)) + 1):
+        if page > 1 and delay:
+            time.sleep(delay)
+        try:
+            response = session.get(recording.url, params=search_query(params, page),
+                                   timeout=getattr(settings, 'SIS_TIMEOUT', (3.05, 10)))
+        except requests.RequestException as error:
+            raise OSError(f"could not fetch page {page} of {search_key(params)}: {error}") from error
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if response.status_code != 200 or not isinstance(body, list):
+            recording.add(params, page, response.status_code, response.text)
+            break
+        recording.add(params, page, 200, body)
+        found += len(body)
+        page_size = page_size or len(body)
+        if not body or len(body) < page_size:
+            break
+    return found
@@ -0,0 +1,125 @@
+"""
+a tiny local stand-in for the SIS class search api, so searches can be tested
+and benchmarked without talking to sisuva.admin.virginia.edu. It serves either
+a list of courses, paged, or a recording of real SIS responses (see
+sis_recording.py), and can be made slow, uneven and unreliable on purpose.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        stub = self.server.stub
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        stub.record(query)
+
+        delay, failing = stub.roll()
+        if delay:
+            time.sleep(delay)
+
+        try:
+            page = int(query.get('page', 1))
+        except ValueError:
+            page = 1
+        if failing:
+            status, body = stub.error_status, {'error': 'injected by the stub SIS server'}
+        else:
+            status, body = stub.response(query, page)
+        body = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubSISServer:
+    """
+    serves `courses` as class search results, `page_size` at a time, or
+    replays a SISRecording if one is given, after sleeping `latency` seconds
+    plus up to `jitter` more per request. `error_rate` of the requests (0 to 1)
+    are answered with `error_status` instead. The jitter and errors come from a
+    random.Random(`seed`), so a run with a seed goes the same way every time.
+    Every query it receives is kept in `requests` so tests can check what was
+    asked for, and queries for searches the recording doesn't have (answered
+    with no results) in `misses`. Change error_rate while it runs for an outage.
+
+        with StubSISServer(courses, page_size=50, latency=0.05) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                ...
+    """
+    def __init__(self, courses=None, page_size=50, latency=0.0, host='127.0.0.1', port=0, recording=None,
+                 jitter=0.0, error_rate=0.0, error_status=503, seed=None):
+        self.courses = list(courses or [])
+        self.page_size = page_size
+        self.latency = latency
+        self.recording = recording
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = []
+        self.misses = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/search'
+
+    def record(self, query):
+        with self._lock:
+            self.requests.append(query)
+
+    def roll(self):
+        """ (seconds to wait, whether to fail) for the next request """
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+            failing = bool(self.error_rate) and self._random.random() < self.error_rate
+        return delay, failing
+
+    def response(self, query, page):
+        """ (status, body) for a page of a search """
+        if self.recording is None:
+            start = (page - 1) * self.page_size
+            return 200, self.courses[start:start + self.page_size]
+        recorded = self.recording.response(query, page)
+        if recorded is not None:
+            return recorded
+        if query not in self.recording:
+            with self._lock:
+                self.misses.append(query)
+        # past the last recorded page, or a search nobody recorded: what SIS says when there's nothing more
+        return 200, []
+
+    def pages_requested(self):
+        with self._lock:
+            return sorted(int(query.get('page', 1)) for query in self.requests)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
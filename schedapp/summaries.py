@@ -0,0 +1,142 @@
+# pylint: disable=no-member
+"""
+precomputed summaries, so pages that only show totals (course counts, units,
+conflicts) read one row instead of adding up every course each time.
+
+A schedule's ScheduleSummary is worked out again, the same way, whenever its
+courses change; the schedule list pages read it with select_related, so they
+make the same queries however many courses the schedules have. Schedules from
+before summaries (or bulk inserted) get theirs built the first time a list
+page shows them.
+
+A student's CartSummary has an entry per cart. When a cart or its courses
+change (signals.py), only that cart's entry is worked out again, from its
+class_nbrs (one query) and the catalog snapshot, and the student's totals are
+summed from the entries; nothing else is touched. Recounting the one cart,
+rather than adding and subtracting what changed, keeps it right whatever the
+signal says: a remove lists the courses asked for, whether or not they were
+in the cart.
+
+Students start with an empty summary when they sign up. Students from before
+summaries, or made by bulk inserts that skip signals, get theirs built the
+first time the cart page reads it. A change to a course's units or meetings
+in the catalog doesn't reach the summaries of carts it's in until they next
+change.
+"""
+from django.db import transaction
+
+from .catalog_snapshot import catalog_courses
+from .conflicts import ScheduleIndex
+from .generator import parse_units
+from .meetings import MINUTES_PER_DAY
+from .models import CartSummary, Schedule, ScheduleSummary, ShoppingCart
+
+def _total(values):
+    # int when it's a whole number, so totals print as 3 rather than 3.0
+    total = sum(values)
+    return int(total) if float(total).is_integer() else total
+
+def _totals(courses):
+    units = [parse_units(course.units) for course in courses]
+    index = ScheduleIndex(courses)
+    conflicts = {}
+    for course in courses:
+        conflicting = index.conflicts_for(course)
+        if conflicting:
+            conflicts[str(course.pk)] = [str(other) for other in conflicting]
+    return {
+        'course_count': len(courses),
+        'min_units': _total(low for low, _ in units),
+        'max_units': _total(high for _, high in units),
+        'conflicts': conflicts,
+    }
+
+def course_totals(class_nbrs):
+    """ course_count, min_units, max_units and conflicts ({class_nbr: [course names]}) of a set of courses """
+    return _totals(list(catalog_courses(class_nbrs).values()))
+
+def schedule_totals(class_nbrs):
+    """
+    course_totals, with conflict_count in place of conflicts, and the earliest
+    start and latest end (minutes since midnight, on any day) of the courses
+    """
+    courses = list(catalog_courses(class_nbrs).values())
+    totals = _totals(courses)
+    totals['conflict_count'] = len(totals.pop('conflicts'))
+    intervals = [interval for course in courses for interval in course.get_meeting_times()]
+    totals['earliest_start'] = min((start % MINUTES_PER_DAY for start, _ in intervals), default=None)
+    totals['latest_end'] = max((end % MINUTES_PER_DAY for _, end in intervals), default=None)
+    return totals
+
+# ------- Carts -------
+def _cart_entry(cart):
+    class_nbrs = ShoppingCart.courses.through.objects.filter(shoppingcart_id=cart.pk).values_list('course_id', flat=True)
+    return dict(strm=cart.strm, **course_totals(list(class_nbrs)))
+
+def refresh_cart_summary(user_id, strms=None, create=True):
+    """
+    works out the entries of a student's carts in `strms` (every cart if None)
+    again and re-adds their totals, keeping the other entries as they are.
+    With create=False a student without a summary is left without one.
+    returns the CartSummary
+    """
+    with transaction.atomic():
+        summaries = CartSummary.objects.select_for_update()
+        summary = summaries.get_or_create(user_id=user_id)[0] if create else summaries.filter(user_id=user_id).first()
+        if summary is None:
+            return None
+        carts = ShoppingCart.objects.filter(user_id=user_id).only('pk', 'strm')
+        if strms is None:
+            terms = {}
+        else:
+            strms = {int(strm) for strm in strms}
+            carts = carts.filter(strm__in=strms)
+            terms = {term['strm']: term for term in summary.terms if term['strm'] not in strms}
+        for cart in carts:
+            terms[cart.strm] = _cart_entry(cart)
+
+        summary.set_terms(terms.values())
+        summary.save()
+    return summary
+
+def cart_summary(user):
+    """ a student's CartSummary, built first if they don't have one yet """
+    summary = CartSummary.objects.filter(user=user).first()
+    return summary if summary is not None else refresh_cart_summary(user.pk)
+
+def carts_changed(cart_pks):
+    """ refreshes the summary entries of these carts, by pk """
+    by_user = {}
+    for user_id, strm in ShoppingCart.objects.filter(pk__in=cart_pks).values_list('user_id', 'strm'):
+        by_user.setdefault(user_id, set()).add(strm)
+    for user_id, strms in by_user.items():
+        refresh_cart_summary(user_id, strms)
+
+# ------- Schedules -------
+_SUMMARY_FIELDS = ['course_count', 'min_units', 'max_units', 'conflict_count', 'earliest_start', 'latest_end',
+                   'updated_at']
+
+def refresh_schedule_summaries(schedule_pks):
+    """ works out the summaries of these schedules (by pk) again, making any that are missing """
+    by_schedule = {}
+    rows = Schedule.courses.through.objects.filter(schedule_id__in=schedule_pks).values_list('schedule_id', 'course_id')
+    for schedule_id, class_nbr in rows:
+        by_schedule.setdefault(schedule_id, []).append(class_nbr)
+    existing = Schedule.objects.filter(pk__in=schedule_pks).values_list('pk', flat=True)
+    summaries = [ScheduleSummary(schedule_id=pk, **schedule_totals(by_schedule.get(pk, []))) for pk in existing]
+    ScheduleSummary.objects.bulk_create(summaries, update_conflicts=True, unique_fields=['schedule'],
+                                        update_fields=_SUMMARY_FIELDS)
+    return summaries
+
+def with_summaries(schedules):
+    """
+    `schedules` (fetched with select_related('summary')), building the
+    summaries of any that don't have one yet
+    """
+    schedules = list(schedules)
+    missing = [schedule for schedule in schedules if not hasattr(schedule, 'summary')]
+    if missing:
+        built = {summary.schedule_id: summary for summary in refresh_schedule_summaries([schedule.pk for schedule in missing])}
+        for schedule in missing:
+            schedule.summary = built[schedule.pk]
+    return schedules
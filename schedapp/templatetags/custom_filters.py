@@ -1,10 +1,17 @@
 from django import template
 import re
 
+from schedapp.grid import slot_label
+
 register = template.Library()
 
 @register.filter(name='remove_symbols')
 def remove_symbols(value):
     # Replace any symbols you want to remove with an empty string
     cleaned_value = re.sub(r'[^\w\s]', '', value)
-    return cleaned_value
\ No newline at end of file
+    return cleaned_value
+
+@register.filter(name='clock_time')
+def clock_time(minutes):
+    """ 08:00am style time for minutes after midnight, or nothing for None """
+    return '' if minutes is None else slot_label(minutes)
@@ -1,18 +1,52 @@
 # pylint: disable=no-member
 # pylint: disable=missing-function-docstring
+import io
+import itertools
 import json
-from django.test import TestCase, Client
-from datetime import datetime
+import os
+import asyncio
+import tempfile
+import threading
+import requests
+from django.test import TestCase, Client, RequestFactory, override_settings
+from datetime import datetime, timedelta
 from django.urls import reverse
+from django.utils import timezone
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import patch, Mock
 from django.http import HttpRequest
 from .views import *
-from .models import Other_Course, User, Schedule, addJsonCourse
+from .models import Other_Course, User, Schedule, Course, CartSummary, ScheduleSummary, CatalogSync, Meeting, addJsonCourse, jsonCourseFields
+from .metrics import (QueryBudgetExceeded, end_request, prometheus_text, record_request, reset_totals, start_request,
+                      view_totals)
+from .seats import TokenBucket, refresh_queue, refresh_seats
+from .checks import check_shared_cache
+from .catalog_snapshot import CourseRecord, _snapshots, catalog_course, catalog_courses, clear_snapshots, term_snapshot
+from .catalog import SyncError, bulk_upsert_courses, file_pages, search_local, start_page, sync_term
+from .sis import (CircuitBreaker, fetch_search_page, fetch_search_pages, normalize_course, request_stats,
+                  reset_request_stats, sis_available)
+from .sis_stub import StubSISServer
+from .sis_recording import SISRecording, record_search
+from .sis_async import afetch_search_pages
+from .sis_cache import acached_search_pages, cache_stats, cached_search_pages, reset_cache_stats, search_cache_key
+from .benchmarks import make_cart, make_catalog, make_sis_courses, populate_users, time_pages
+from .meetings import parse_time, meeting_intervals, intervals_overlap
+from .conflicts import ScheduleIndex, conflicting_pairs, exclude_conflicts
+from .grid import schedule_grid, slot_label
+from .search import forget_fts_table, search_backend, search_courses, search_terms
+from .results import ResultAssembler, assemble_results
+from .approvals import approval_queue, make_cursor, parse_cursor, status_counts
+from .generator import Preferences, ScheduleGenerator, generate_schedules, parse_units
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
 
 
 User = get_user_model()
+# what SIS answered the searches in CourseListViewTests, in a SISRecording
+SIS_COURSE_LIST_RECORDING = os.path.join(os.path.dirname(__file__), 'testdata', 'sis_course_list.json')
 # ------- Functions for creating instances of models -------
 class Builders(TestCase):
     """
@@ -60,6 +94,17 @@ class Builders(TestCase):
             return addJsonCourse(course)
         return addJsonCourse(json_course)
 
+    def create_meeting_course(self, class_nbr, days, start, end, strm="1232", extra_meetings=None):
+        """
+        creates a course that meets on `days` from `start` to `end`
+        (e.g. "MoWe", "09:00 AM", "09:50 AM"), plus any `extra_meetings`
+        """
+        course = make_sis_courses(1, first_class_nbr=class_nbr)[0]
+        course['strm'] = strm
+        course['meetings'][0].update(days=days, start_time=start, end_time=end)
+        course['meetings'] += extra_meetings or []
+        return addJsonCourse(course)
+
     def create_user(
             self,
             is_advisor = False,
@@ -182,6 +227,16 @@ class CourseListViewTests(TestCase):
     """
     Tests for the course_list view
     """
+    def setUp(self):
+        # the searches below, as SIS answered them, replayed offline
+        caches['sis'].clear()
+        stub = StubSISServer(recording=SISRecording.load(SIS_COURSE_LIST_RECORDING)).start()
+        self.addCleanup(stub.stop)
+        settings_override = override_settings(SIS_SEARCH_URL=stub.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(lambda: self.assertEqual(stub.misses, []))
+
     #test to see if view works
     def test_url(self):
         response = self.client.get(reverse('course_list')) 
@@ -348,3 +403,1722 @@ class ScheduleListViewTests(TestCase):
         response = schedule_list(req)
         self.assertTrue(reverse('advisor-schedule-list') in response.url)
 
+# ------- SIS Tests -------
+class SISFetchTests(TestCase):
+    """
+    Tests for fetching class search pages, against a local stub SIS server
+    """
+    def setUp(self):
+        caches['sis'].clear()
+        reset_request_stats()
+
+    def test_pages_are_merged_in_order(self):
+        courses = make_sis_courses(120)
+        with StubSISServer(courses, page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                found = fetch_search_pages({'term': '1228', 'subject': 'APMA'}, max_workers=3)
+        self.assertEqual([course['class_nbr'] for course in found], [course['class_nbr'] for course in courses])
+
+    def test_stops_after_short_page(self):
+        with StubSISServer(make_sis_courses(120), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                fetch_search_pages({'term': '1228'}, max_workers=1)
+            self.assertEqual(stub.pages_requested(), [1, 2, 3])
+
+    def test_stops_after_empty_page(self):
+        with StubSISServer(make_sis_courses(100), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                found = fetch_search_pages({'term': '1228'}, max_workers=1)
+            self.assertEqual(len(found), 100)
+            self.assertEqual(stub.pages_requested(), [1, 2, 3])
+
+    def test_search_params_are_sent(self):
+        with StubSISServer([], page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                fetch_search_pages({'term': '1228', 'subject': 'CS', 'catalog_nbr': '3240'}, max_workers=1)
+            query = stub.requests[0]
+        self.assertEqual(query['term'], '1228')
+        self.assertEqual(query['subject'], 'CS')
+        self.assertEqual(query['catalog_nbr'], '3240')
+        self.assertEqual(query['page'], '1')
+
+    async def test_async_pages_are_merged_in_order(self):
+        courses = make_sis_courses(120)
+        with StubSISServer(courses, page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                found = await afetch_search_pages({'term': '1228', 'subject': 'APMA'}, max_workers=3)
+            self.assertEqual(sorted(stub.pages_requested())[:3], [1, 2, 3])
+        self.assertEqual([course['class_nbr'] for course in found], [course['class_nbr'] for course in courses])
+
+    async def test_async_unreachable_sis_gives_no_results(self):
+        with override_settings(SIS_SEARCH_URL='http://127.0.0.1:9/search', SIS_TIMEOUT=0.5):
+            self.assertEqual(await afetch_search_pages({'term': '1228'}, max_pages=2), [])
+
+    def test_unreachable_sis_gives_no_results(self):
+        with override_settings(SIS_SEARCH_URL='http://127.0.0.1:9/search', SIS_TIMEOUT=0.5):
+            self.assertEqual(fetch_search_pages({'term': '1228'}, max_pages=2), [])
+
+    def test_course_list_uses_stub(self):
+        user = Builders().create_user()
+        self.client.force_login(user)
+        with StubSISServer(make_sis_courses(3), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                response = self.client.get(reverse('course_list'), {'Term': '1228', 'subject': 'APMA'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "APMA 1000 - Single Variable Calculus II")
+        self.assertContains(response, "Start: 09:00 AM")
+
+class SISClientTests(TestCase):
+    """
+    Tests for SIS request retries, the circuit breaker and request metrics
+    """
+    def setUp(self):
+        caches['sis'].clear()
+        reset_request_stats()
+
+    def response(self, status, courses=()):
+        return Mock(status_code=status, json=Mock(return_value=list(courses)))
+
+    @override_settings(SIS_RETRY_BACKOFF=0)
+    def test_retries_server_errors(self):
+        session = Mock()
+        session.get.side_effect = [self.response(503), requests.ConnectionError("reset"), self.response(200, [{'class_nbr': 1}])]
+        self.assertEqual(fetch_search_page({'term': '1228'}, 1, session), (1, [{'class_nbr': 1}], True))
+        stats = request_stats()
+        self.assertEqual((stats['requests'], stats['failures'], stats['retries']), (3, 2, 2))
+        self.assertEqual(stats['latency_buckets'][-1], (float('inf'), 3))
+
+    @override_settings(SIS_RETRY_BACKOFF=0)
+    def test_gives_up_after_retries_and_on_read_timeouts(self):
+        session = Mock()
+        session.get.return_value = self.response(500)
+        self.assertEqual(fetch_search_page({'term': '1228'}, 1, session), (1, [], False))
+        self.assertEqual(session.get.call_count, 3)
+
+        session.get.reset_mock()
+        session.get.side_effect = requests.ReadTimeout("slow")
+        self.assertEqual(fetch_search_page({'term': '1228'}, 1, session)[2], False)
+        self.assertEqual(session.get.call_count, 1)
+
+    def test_not_found_is_not_retried(self):
+        session = Mock()
+        session.get.return_value = self.response(404)
+        self.assertEqual(fetch_search_page({'term': '1228'}, 1, session), (1, [], False))
+        self.assertEqual(session.get.call_count, 1)
+
+    def test_circuit_breaker(self):
+        now = [0.0]
+        breaker = CircuitBreaker(threshold=2, reset_after=30, clock=lambda: now[0])
+        for _ in range(2):
+            self.assertTrue(breaker.allow())
+            breaker.record(False)
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+        now[0] = 31
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # only one trial call at a time
+        breaker.record(False)
+        self.assertEqual(breaker.state, 'open')
+
+        now[0] = 62
+        self.assertTrue(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, 'closed')
+
+    @override_settings(SIS_SEARCH_URL='http://127.0.0.1:9/search', SIS_RETRY_BACKOFF=0, SIS_BREAKER_FAILURES=2)
+    def test_open_breaker_skips_sis(self):
+        session = Mock()
+        session.get.return_value = self.response(503)
+        fetch_search_page({'term': '1228'}, 1, session)
+        fetch_search_page({'term': '1228'}, 2, session)
+        self.assertFalse(sis_available())
+        session.get.reset_mock()
+        self.assertEqual(fetch_search_page({'term': '1228'}, 3, session), (3, [], False))
+        session.get.assert_not_called()
+        self.assertEqual(request_stats()['short_circuits'], 1)
+
+    def test_course_list_falls_back_to_local_catalog(self):
+        bulk_upsert_courses(make_sis_courses(2))
+        self.client.force_login(Builders().create_user())
+        with override_settings(SIS_SEARCH_URL='http://127.0.0.1:9/search', SIS_TIMEOUT=0.5, SIS_RETRY_BACKOFF=0,
+                               SIS_BREAKER_FAILURES=1):
+            response = self.client.get(reverse('course_list'), {'Term': '1228', 'subject': 'APMA'})
+            self.assertContains(response, "Section: 002")
+            self.assertContains(response, "isn&#x27;t responding")
+            self.assertEqual(request_stats()['breakers']['http://127.0.0.1:9/search'], 'open')
+
+    def test_search_results_redirect_is_encoded(self):
+        response = search_results(RequestFactory().get('/', {'term': '1228', 'subject': 'CS&x=1'}))
+        self.assertIn('subject=CS%26x%3D1', response.url)
+        self.assertIn('term=1228', response.url)
+
+class CourseStreamTests(TestCase):
+    """
+    Tests for streaming course search results a page at a time
+    """
+    def setUp(self):
+        caches['sis'].clear()
+        self.client.force_login(Builders().create_user())
+
+    def stream(self, params):
+        response = self.client.get(reverse('course-stream'), params)
+        return response, [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_pages_are_streamed_in_order(self):
+        with StubSISServer(make_sis_courses(120), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url, SIS_MAX_WORKERS=1):
+                response, lines = self.stream({'Term': '1228', 'subject': 'APMA'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([line.get('page') for line in lines], [1, 2, 3, None])
+        self.assertEqual([line.get('count') for line in lines], [50, 50, 20, None])
+        self.assertEqual(lines[-1], {'done': True, 'courses': 6, 'has_next': False})
+        self.assertIn("APMA 1000 - Single Variable Calculus II", lines[0]['html'])
+        self.assertIn("Start: 09:00 AM", lines[0]['html'])
+        self.assertEqual(Course.objects.count(), 120)
+
+    def test_streamed_search_is_cached(self):
+        with StubSISServer(make_sis_courses(60), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url, SIS_MAX_WORKERS=1):
+                self.stream({'Term': '1228', 'subject': 'APMA'})
+                _, lines = self.stream({'Term': '1228', 'subject': 'APMA'})
+            self.assertEqual(stub.pages_requested(), [1, 2])
+        self.assertEqual([line.get('count') for line in lines], [60, None])
+
+    def test_required_fields(self):
+        response = self.client.get(reverse('course-stream'), {'Term': '1228'})
+        self.assertEqual(response.status_code, 400)
+
+class SearchResultsTests(TestCase):
+    """
+    Tests for deduplicating, grouping and paginating course search results
+    """
+    def test_repeated_classes_are_dropped(self):
+        courses = make_sis_courses(30)
+        groups = assemble_results(courses + courses[10:25])
+        self.assertEqual(sum(len(group.sections) for group in groups), 30)
+
+    def test_sections_are_grouped_by_course(self):
+        groups = assemble_results(make_sis_courses(45))
+        self.assertEqual([(group.catalog_nbr, len(group.sections)) for group in groups],
+                         [('1000', 20), ('1001', 20), ('1002', 5)])
+        self.assertEqual([course['class_section'] for course in groups[2].sections], ['001', '002', '003', '004', '005'])
+
+    def test_incremental_batches_report_new_sections(self):
+        assembler = ResultAssembler()
+        courses = make_sis_courses(30)
+        self.assertEqual([(index, len(group.sections)) for index, group in assembler.add(courses[:25])], [(0, 20), (1, 5)])
+        self.assertEqual([(index, len(group.sections)) for index, group in assembler.add(courses[20:])], [(1, 5)])
+        self.assertEqual(len(assembler.results()[1].sections), 10)
+
+    def test_works_on_course_objects(self):
+        sync_term('1228', [(1, make_sis_courses(25)), (2, [])])
+        groups = assemble_results(Course.objects.order_by('class_nbr'))
+        self.assertEqual([len(group.sections) for group in groups], [20, 5])
+
+    def test_course_list_is_paginated(self):
+        self.client.force_login(Builders().create_user())
+        caches['sis'].clear()
+        with StubSISServer(make_sis_courses(25 * 20), page_size=500) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                first = self.client.get(reverse('course_list'), {'Term': '1228', 'subject': 'APMA'})
+                second = self.client.get(reverse('course_list'), {'Term': '1228', 'subject': 'APMA', 'page': 2})
+        self.assertEqual(len(first.context['groups']), 20)
+        self.assertEqual(len(second.context['groups']), 5)
+        self.assertContains(first, "APMA 1019 - Single Variable Calculus II", count=1)
+        self.assertNotContains(first, "APMA 1020")
+        self.assertContains(first, "page=2")
+        self.assertContains(second, "APMA 1020 - Single Variable Calculus II", count=1)
+
+class SchedulePickerTests(TestCase):
+    """
+    Tests for the per-course schedule picker on the course search page
+    """
+    def setUp(self):
+        caches['sis'].clear()
+        self.student = Builders().create_user(name="picker-student")
+        self.advisor = Builders().create_user(is_advisor=True, name="picker-advisor")
+        self.client.force_login(self.student)
+
+    def add_schedules(self, count):
+        return [Schedule.objects.create(student=self.student, approver=self.advisor, name=f"Plan {i}") for i in range(count)]
+
+    def test_picker_lists_schedules_and_marks_ones_with_the_course(self):
+        course = Builders().create_course()
+        first, second = self.add_schedules(2)
+        first.courses.add(course)
+        response = self.client.get(reverse('course-schedule-picker', args=(course.class_nbr,)))
+        self.assertContains(response, 'name="csrfmiddlewaretoken"', count=1)
+        self.assertContains(response, f'<option value="{first.pk}" disabled>Plan 0 (already added)</option>', html=True)
+        self.assertContains(response, f'<option value="{second.pk}" >Plan 1</option>', html=True)
+
+    def test_picker_without_schedules(self):
+        response = self.client.get(reverse('course-schedule-picker', args=(12345,)))
+        self.assertContains(response, reverse('schedule-create'))
+
+    def test_search_page_does_not_grow_with_schedules(self):
+        sizes = []
+        with StubSISServer(make_sis_courses(40), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                for count in (0, 10):
+                    self.add_schedules(count)
+                    response = self.client.get(reverse('course_list'), {'Term': '1228', 'subject': 'APMA'})
+                    self.assertNotContains(response, 'student-schedule-add-course')
+                    sizes.append(len(response.content))
+        self.assertEqual(sizes[0], sizes[1])
+
+class JsonApiTests(TestCase):
+    """
+    Tests for the json api over courses, schedules and carts
+    """
+    def setUp(self):
+        self.student = Builders().create_user(name="api-student")
+        self.advisor = Builders().create_user(is_advisor=True, name="api-advisor")
+        self.courses = [Course.objects.create(**jsonCourseFields(normalize_course(course))) for course in make_sis_courses(3)]
+        self.schedule = Schedule.objects.create(student=self.student, approver=self.advisor, name="Plan")
+        self.schedule.courses.add(*self.courses[:2])
+        self.client.force_login(self.student)
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(reverse('api-schedule-detail', args=(self.schedule.pk,)))
+        self.assertEqual(response.status_code, 401)
+
+    def test_course_lookup(self):
+        response = self.client.get(reverse('api-course-lookup'), {'class_nbr': [10002, 10000, 99999, 'x']})
+        self.assertEqual([course['class_nbr'] for course in response.json()['courses']], [10002, 10000])
+        self.assertEqual(response.json()['courses'][0]['enrollment_available'], 1)
+
+    def test_course_etag(self):
+        url = reverse('api-course-detail', args=(10000,))
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Course.objects.filter(pk=10000).update(enrollment_available=0)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_schedule_detail(self):
+        response = self.client.get(reverse('api-schedule-detail', args=(self.schedule.pk,)))
+        data = response.json()
+        self.assertEqual([course['class_nbr'] for course in data['courses']], [10000, 10001])
+        # make_sis_courses are all MoWeFr 9:00
+        self.assertEqual(data['conflicts'], [[10000, 10001]])
+        self.assertEqual(data['approval_status'], 'unsubmitted')
+        self.assertIn('Last-Modified', response)
+
+    def test_schedule_not_modified_in_one_query(self):
+        url = reverse('api-schedule-detail', args=(self.schedule.pk,))
+        etag = self.client.get(url)['ETag']
+        self.client.get(url, HTTP_IF_NONE_MATCH=etag)  # let the session load
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len([query for query in queries if 'schedapp_schedule' in query['sql']]), 1)
+
+    def test_course_changes_change_schedule_etag(self):
+        url = reverse('api-schedule-detail', args=(self.schedule.pk,))
+        etag = self.client.get(url)['ETag']
+        self.courses[2].schedule_set.add(self.schedule)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['courses']), 3)
+
+    def test_other_students_schedules_are_hidden(self):
+        self.client.force_login(Builders().create_user(name="someone-else"))
+        response = self.client.get(reverse('api-schedule-detail', args=(self.schedule.pk,)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_approval_transitions(self):
+        url = reverse('api-schedule-status', args=(self.schedule.pk,))
+        response = self.client.post(url, {'status': 'pending'}, content_type='application/json')
+        self.assertEqual(response.json()['approval_status'], 'pending')
+        self.assertEqual(self.client.post(url, {'status': 'approved'}, content_type='application/json').status_code, 400)
+
+        self.client.force_login(self.advisor)
+        response = self.client.post(url, {'status': 'approved'})
+        self.assertEqual(response.json()['approval_status'], 'approved')
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.approval_status, 'approved')
+
+    def test_stale_write_is_refused(self):
+        url = reverse('api-schedule-status', args=(self.schedule.pk,))
+        etag = self.client.get(reverse('api-schedule-detail', args=(self.schedule.pk,)))['ETag']
+        self.schedule.courses.remove(self.courses[0])
+        response = self.client.post(url, {'status': 'pending'}, content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.approval_status, 'unsubmitted')
+
+    def test_same_second_changes_go_by_etag(self):
+        url = reverse('api-schedule-status', args=(self.schedule.pk,))
+        changed_at = timezone.now().replace(microsecond=100)
+        Schedule.objects.filter(pk=self.schedule.pk).update(updated_at=changed_at)
+        response = self.client.get(reverse('api-schedule-detail', args=(self.schedule.pk,)))
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        # a second change in the same second keeps the Last-Modified, but not the ETag
+        Schedule.objects.filter(pk=self.schedule.pk).update(updated_at=changed_at + timedelta(microseconds=1))
+        detail = self.client.get(reverse('api-schedule-detail', args=(self.schedule.pk,)), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(detail.status_code, 200)
+        response = self.client.post(url, {'status': 'pending'}, content_type='application/json',
+                                    HTTP_IF_UNMODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 428)
+        response = self.client.post(url, {'status': 'pending'}, content_type='application/json',
+                                    HTTP_IF_MATCH=etag, HTTP_IF_UNMODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 412)
+        self.schedule.refresh_from_db()
+        self.assertEqual(self.schedule.approval_status, 'unsubmitted')
+
+    def test_cart_course_must_be_in_the_term(self):
+        response = self.client.post(reverse('api-cart-courses', args=(1232,)), {'class_nbr': 10000},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ShoppingCart.objects.filter(user=self.student).exists())
+
+    def test_cart(self):
+        detail = reverse('api-cart-detail', args=(1228,))
+        self.assertEqual(self.client.get(detail).json()['courses'], [])
+
+        response = self.client.post(reverse('api-cart-courses', args=(1228,)), {'class_nbr': 10000}, content_type='application/json')
+        self.assertEqual([course['class_nbr'] for course in response.json()['courses']], [10000])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(detail, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        response = self.client.delete(reverse('api-cart-course', args=(1228, 10000)))
+        self.assertEqual(response.json()['courses'], [])
+        self.assertNotEqual(response['ETag'], etag)
+
+class ScheduleBatchTests(TestCase):
+    """
+    Tests for adding, removing and swapping a schedule's courses in one batch
+    """
+    def setUp(self):
+        self.student = Builders().create_user(name="batch-student")
+        self.advisor = Builders().create_user(is_advisor=True, name="batch-advisor")
+        # 10000-10002 are sections of one course, all MoWeFr 9:00; 10003 is another course on TuTh
+        sis_courses = make_sis_courses(3) + make_sis_courses(1, first_class_nbr=10003)
+        sis_courses[3]['crse_id'] = '002000'
+        sis_courses[3]['meetings'][0]['days'] = 'TuTh'
+        self.courses = [Course.objects.create(**jsonCourseFields(normalize_course(course))) for course in sis_courses]
+        self.schedule = Schedule.objects.create(student=self.student, approver=self.advisor, name="Plan")
+        self.schedule.courses.add(self.courses[0])
+        self.url = reverse('api-schedule-courses', args=(self.schedule.pk,))
+        self.client.force_login(self.student)
+
+    def post(self, operations, **extra):
+        return self.client.post(self.url, {'operations': operations}, content_type='application/json', **extra)
+
+    def class_nbrs(self):
+        return sorted(self.schedule.courses.values_list('pk', flat=True))
+
+    def test_swap_and_add_together(self):
+        response = self.post([{'op': 'swap', 'from': 10000, 'to': 10001}, {'op': 'add', 'class_nbr': 10003}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([course['class_nbr'] for course in response.json()['courses']], [10001, 10003])
+        self.assertEqual(response.json()['conflicts'], [])
+        self.assertEqual(self.class_nbrs(), [10001, 10003])
+
+    def test_conflict_changes_nothing(self):
+        response = self.post([{'op': 'add', 'class_nbr': 10003}, {'op': 'add', 'class_nbr': 10002}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['conflicts'], [[10000, 10002]])
+        self.assertEqual(self.class_nbrs(), [10000])
+
+    def test_remove_then_add_in_same_slot(self):
+        response = self.post([{'op': 'remove', 'class_nbr': 10000}, {'op': 'add', 'class_nbr': 10002}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.class_nbrs(), [10002])
+
+    def test_bad_operations_are_refused(self):
+        for operations in ([{'op': 'swap', 'from': 10001, 'to': 10002}],   # 10001 isn't in the schedule
+                           [{'op': 'swap', 'from': 10000, 'to': 10003}],   # not a section of the same course
+                           [{'op': 'add', 'class_nbr': 99999}],
+                           [{'op': 'drop', 'class_nbr': 10000}],
+                           'add 10001'):
+            self.assertEqual(self.post(operations).status_code, 400, operations)
+        self.assertEqual(self.class_nbrs(), [10000])
+
+    def test_stale_batch_is_refused(self):
+        etag = self.client.get(reverse('api-schedule-detail', args=(self.schedule.pk,)))['ETag']
+        self.schedule.courses.add(self.courses[3])
+        response = self.post([{'op': 'remove', 'class_nbr': 10000}], HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(self.class_nbrs(), [10000, 10003])
+
+    def test_only_the_student_can_change_it(self):
+        self.client.force_login(self.advisor)
+        self.assertEqual(self.post([{'op': 'add', 'class_nbr': 10003}]).status_code, 403)
+
+class SISCacheTests(TestCase):
+    """
+    Tests for the SIS search response cache
+    """
+    def setUp(self):
+        caches['sis'].clear()
+        reset_cache_stats()
+
+    def test_key_ignores_case_whitespace_and_blanks(self):
+        self.assertEqual(search_cache_key({'term': '1238', 'subject': 'cs ', 'keyword': 'Machine  Learning'}),
+                         search_cache_key({'term': '1238', 'subject': 'CS', 'keyword': 'machine learning', 'location': ''}))
+        self.assertNotEqual(search_cache_key({'term': '1238', 'subject': 'CS'}),
+                            search_cache_key({'term': '1238', 'subject': 'CS', 'catalog_nbr': '3240'}))
+
+    def test_repeat_search_is_served_from_cache(self):
+        with StubSISServer(make_sis_courses(60), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                first, first_from_sis = cached_search_pages({'term': '1238', 'subject': 'CS'}, with_source=True,
+                                                            max_workers=1)
+                second, second_from_sis = cached_search_pages({'term': '1238', 'subject': 'cs'}, with_source=True,
+                                                              max_workers=1)
+            self.assertEqual(stub.pages_requested(), [1, 2])
+        self.assertEqual(first, second)
+        self.assertEqual((first_from_sis, second_from_sis), (True, False))
+        self.assertEqual(cache_stats()['hits'], 1)
+        self.assertEqual(cache_stats()['misses'], 1)
+
+    def test_results_expire(self):
+        with StubSISServer(make_sis_courses(3), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url, SIS_CACHE_TIMEOUT=0):
+                cached_search_pages({'term': '1238', 'subject': 'CS'}, max_workers=1)
+                cached_search_pages({'term': '1238', 'subject': 'CS'}, max_workers=1)
+            self.assertEqual(stub.pages_requested().count(1), 2)
+
+    def test_concurrent_misses_fetch_once(self):
+        found = []
+        with StubSISServer(make_sis_courses(120), page_size=50, latency=0.1) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                threads = [threading.Thread(target=lambda: found.append(cached_search_pages({'term': '1238', 'subject': 'CS'})))
+                           for _ in range(5)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            pages = stub.pages_requested()
+        self.assertEqual(len(pages), len(set(pages)))
+        self.assertEqual([len(courses) for courses in found], [120] * 5)
+        self.assertEqual(cache_stats()['misses'], 1)
+
+    def test_failed_search_is_not_cached(self):
+        with override_settings(SIS_SEARCH_URL='http://127.0.0.1:9/search', SIS_TIMEOUT=0.5):
+            self.assertEqual(cached_search_pages({'term': '1238', 'subject': 'CS'}, max_pages=2), [])
+        self.assertIsNone(caches['sis'].get(search_cache_key({'term': '1238', 'subject': 'CS'})))
+        self.assertEqual(cache_stats()['uncached'], 1)
+
+    async def test_async_concurrent_misses_fetch_once(self):
+        with StubSISServer(make_sis_courses(120), page_size=50, latency=0.1) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                found = await asyncio.gather(*[acached_search_pages({'term': '1238', 'subject': 'CS'}) for _ in range(5)])
+            pages = stub.pages_requested()
+        self.assertEqual(len(pages), len(set(pages)))
+        self.assertEqual([len(courses) for courses in found], [120] * 5)
+        self.assertEqual(cache_stats()['misses'], 1)
+
+    def test_cached_copy_is_not_changed_by_callers(self):
+        with StubSISServer(make_sis_courses(1), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                cached_search_pages({'term': '1238'}, max_workers=1)[0]['descr'] = 'changed'
+                self.assertNotEqual(cached_search_pages({'term': '1238'}, max_workers=1)[0]['descr'], 'changed')
+
+    def test_cached_searches_are_not_stored_again(self):
+        self.client.force_login(Builders().create_user())
+        search = {'Term': '1228', 'subject': 'APMA'}
+        with StubSISServer(make_sis_courses(3), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url), \
+                 patch('schedapp.views.bulk_upsert_courses', wraps=bulk_upsert_courses) as upsert:
+                self.client.get(reverse('course_list'), search)
+                second = self.client.get(reverse('course_list'), search)
+                b''.join(self.client.get(reverse('course-stream'), search).streaming_content)
+        self.assertEqual(upsert.call_count, 1)
+        self.assertEqual(cache_stats()['hits'], 2)
+        self.assertContains(second, "APMA 1000")
+        self.assertEqual(Course.objects.count(), 3)
+
+class CatalogSyncTests(TestCase):
+    """
+    Tests for syncing a term into the local course catalog mirror
+    """
+    def write_dump(self, courses):
+        dump = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        json.dump(courses, dump)
+        dump.close()
+        self.addCleanup(os.remove, dump.name)
+        return dump.name
+
+    def test_sync_from_file(self):
+        path = self.write_dump(make_sis_courses(250))
+        call_command('sync_catalog', '1228', '--file', path, '--page-size', '100', stdout=open(os.devnull, 'w'))
+        self.assertEqual(Course.objects.filter(strm='1228').count(), 250)
+        sync = CatalogSync.objects.get(strm='1228')
+        self.assertEqual(sync.courses_synced, 250)
+        self.assertEqual(sync.next_page, 1)
+        self.assertIsNotNone(sync.completed_at)
+        self.assertEqual(Course.objects.get(pk=10000).meetings[0]['start_time'], "09:00 AM")
+
+    def test_sync_from_sis(self):
+        with StubSISServer(make_sis_courses(120), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                call_command('sync_catalog', '1228', '--delay', '0', stdout=open(os.devnull, 'w'))
+            self.assertEqual(stub.pages_requested(), [1, 2, 3])
+        self.assertEqual(Course.objects.count(), 120)
+
+    def test_interrupted_sync_resumes(self):
+        path = self.write_dump(make_sis_courses(250))
+
+        def interrupted():
+            yield next(file_pages(path, 1, 100))
+            raise SyncError("SIS went away")
+
+        with self.assertRaises(SyncError):
+            sync_term('1228', interrupted())
+        self.assertEqual(CatalogSync.objects.get(strm='1228').next_page, 2)
+        self.assertEqual(Course.objects.count(), 100)
+
+        resume_at = start_page('1228')
+        self.assertEqual(resume_at, 2)
+        sync = sync_term('1228', file_pages(path, resume_at, 100))
+        self.assertEqual(sync.courses_synced, 250)
+        self.assertEqual(Course.objects.count(), 250)
+
+    def test_search_local(self):
+        courses = make_sis_courses(3)
+        courses[1]['subject'] = 'CS'
+        courses[2]['instructors'] = [{"name": "Ada Lovelace", "email": "al@virginia.edu"}]
+        sync_term('1228', [(1, courses), (2, [])])
+        self.assertEqual(search_local({'term': '1228', 'subject': 'CS'}).count(), 1)
+        self.assertEqual(search_local({'term': '1228', 'keyword': 'lovelace'}).get().class_nbr, 10002)
+        self.assertEqual(search_local({'term': '1238', 'subject': 'CS'}).count(), 0)
+
+    @override_settings(SIS_LOCAL_MIRROR=True, SIS_SEARCH_URL='http://127.0.0.1:9/search')
+    def test_course_list_from_mirror(self):
+        sync_term('1228', [(1, make_sis_courses(2)), (2, [])])
+        self.client.force_login(Builders().create_user())
+        response = self.client.get(reverse('course_list'), {'Term': '1228', 'subject': 'APMA'})
+        # both sections, under one heading for the course
+        self.assertContains(response, "APMA 1000 - Single Variable Calculus II", count=1)
+        self.assertContains(response, "Section: 001")
+        self.assertContains(response, "Section: 002")
+
+class BulkUpsertTests(TestCase):
+    """
+    Tests for bulk_upsert_courses
+    """
+    def test_inserts_new_courses(self):
+        stats = bulk_upsert_courses(make_sis_courses(30))
+        self.assertEqual((stats.inserted, stats.updated, stats.unchanged), (30, 0, 0))
+        self.assertEqual(Course.objects.count(), 30)
+
+    def test_unchanged_courses_are_not_written(self):
+        bulk_upsert_courses(make_sis_courses(30))
+        stats = bulk_upsert_courses(make_sis_courses(30))
+        self.assertEqual((stats.inserted, stats.updated, stats.unchanged), (0, 0, 30))
+
+    def test_enrollment_changes_are_updated(self):
+        bulk_upsert_courses(make_sis_courses(3))
+        courses = make_sis_courses(4)
+        courses[0]['enrollment_total'] = 45
+        courses[0]['enrollment_available'] = 0
+        stats = bulk_upsert_courses(courses)
+        self.assertEqual((stats.inserted, stats.updated, stats.unchanged), (1, 1, 2))
+        course = Course.objects.get(pk=10000)
+        self.assertEqual(course.enrollment_total, 45)
+        self.assertEqual(course.enrollment_available, 0)
+
+    def test_query_count_is_batched(self):
+        bulk_upsert_courses(make_sis_courses(50))
+        courses = make_sis_courses(200)
+        courses[0]['wait_tot'] = 3
+        # the old per-course path was 2-3 queries per course; sqlite's parameter
+        # limit splits the bulk insert into a few statements, but no more
+        with CaptureQueriesContext(connection) as queries:
+            bulk_upsert_courses(courses)
+        self.assertLess(len(queries), 20)
+
+    def test_add_json_course_keeps_existing(self):
+        course = make_sis_courses(1)[0]
+        addJsonCourse(course)
+        course['descr'] = "Something else"
+        self.assertEqual(addJsonCourse(course).descr, "Single Variable Calculus II")
+
+class RequestMetricsTests(TestCase):
+    """
+    Tests for the request metrics middleware, query budgets and the metrics endpoint
+    """
+    def setUp(self):
+        reset_totals()
+        reset_request_stats()
+        reset_cache_stats()
+        caches['sis'].clear()
+        self.student = Builders().create_user(name="metrics-student")
+        self.advisor = Builders().create_user(is_advisor=True, name="metrics-advisor")
+        self.client.force_login(self.student)
+
+    def test_requests_are_measured(self):
+        with override_settings(METRICS_SERVER_TIMING=True):
+            response = self.client.get(reverse('shopping_cart'))
+        self.assertIn('db;desc=', response['Server-Timing'])
+        totals = view_totals()['shopping_cart']
+        self.assertEqual(totals['requests'], 1)
+        self.assertEqual(totals['queries'], response.wsgi_request.metrics.queries)
+        self.assertGreater(totals['queries'], 0)
+        self.assertGreater(totals['template_seconds'], 0)
+
+    def test_sis_calls_are_counted_for_async_views(self):
+        with StubSISServer(make_sis_courses(3), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                self.client.get(reverse('course_list'), {'Term': '1228', 'subject': 'APMA'})
+            calls = len(stub.requests)
+        totals = view_totals()['course_list']
+        # pages fetched ahead past the last one may finish after the response, and aren't waited for
+        self.assertGreaterEqual(totals['sis_calls'], 1)
+        self.assertLessEqual(totals['sis_calls'], calls)
+        self.assertGreater(totals['sis_seconds'], 0)
+        self.assertGreater(totals['queries'], 0)
+
+    def test_late_sis_calls_are_counted_as_dropped(self):
+        metrics, token = start_request()
+        try:
+            metrics.add_sis_call(0.01)
+            metrics.finish()
+            record_request('course_list', metrics)
+            metrics.add_sis_call(0.01)
+        finally:
+            end_request(token)
+        totals = view_totals()['course_list']
+        self.assertEqual((totals['sis_calls'], totals['sis_calls_dropped']), (1, 1))
+        self.assertIn('schedris_request_sis_calls_dropped_total{view="course_list"} 1', prometheus_text())
+
+    def test_over_budget_fails_when_strict(self):
+        with patch.object(shopping_cart, 'query_budget', 1):
+            with override_settings(QUERY_BUDGET_STRICT=True):
+                with self.assertRaises(QueryBudgetExceeded):
+                    self.client.get(reverse('shopping_cart'))
+            with override_settings(QUERY_BUDGET_STRICT=False):
+                with self.assertLogs('schedapp.metrics', 'WARNING'):
+                    self.assertEqual(self.client.get(reverse('shopping_cart')).status_code, 200)
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_budgets_hold_for_bigger_schedules(self):
+        courses = [Course.objects.create(**jsonCourseFields(normalize_course(course))) for course in make_sis_courses(25)]
+        schedule = Schedule.objects.create(student=self.student, approver=self.advisor, name="Big")
+        schedule.courses.add(*courses)
+        ShoppingCart.objects.create(user=self.student, strm=1228).courses.add(*courses)
+        for url in (reverse('student-schedule-detail', args=(schedule.pk,)), reverse('schedule-validate', args=(schedule.pk,)),
+                    reverse('shopping_cart') + '?strm=1228', reverse('course-schedule-picker', args=(10000,)),
+                    reverse('api-schedule-detail', args=(schedule.pk,)), reverse('api-cart-detail', args=(1228,))):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+        self.client.force_login(self.advisor)
+        self.assertEqual(self.client.get(reverse('advisor-schedule-detail', args=(schedule.pk,))).status_code, 200)
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('home'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+        self.student.is_staff = True
+        self.student.save()
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('# TYPE schedris_request_duration_seconds histogram', text)
+        self.assertIn('schedris_request_duration_seconds_count{view="home"} 1', text)
+        self.assertIn('schedris_sis_cache_hits_total 0', text)
+
+        self.client.logout()
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+class CatalogSnapshotTests(TestCase):
+    """
+    Tests for the in-process catalog snapshot
+    """
+    def setUp(self):
+        clear_snapshots()
+        bulk_upsert_courses(make_sis_courses(3))
+
+    def test_records_match_courses(self):
+        record = term_snapshot('1228').get(10001)
+        course = Course.objects.get(pk=10001)
+        self.assertEqual(str(record), str(course))
+        self.assertEqual(record.pk, course.pk)
+        self.assertEqual([list(interval) for interval in record.get_meeting_times()], course.get_meeting_times())
+        self.assertEqual(conflicting_pairs([record, Course.objects.get(pk=10000)])[0][0].pk, 10000)
+
+    def test_lookups_skip_the_database(self):
+        catalog_course(10000)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(catalog_course(10002).class_section, '003')
+            self.assertEqual(sorted(catalog_courses([10000, 10001])), [10000, 10001])
+        self.assertEqual(len(queries), 0)
+        self.assertIsNone(catalog_course(99999))
+
+    def test_rebuilt_when_meetings_change(self):
+        before = term_snapshot('1228')
+        courses = make_sis_courses(3)
+        courses[0]['meetings'][0]['days'] = 'TuTh'
+        bulk_upsert_courses(courses)
+        after = term_snapshot('1228')
+        self.assertIsNot(before, after)
+        self.assertEqual(after.get(10000).get_meeting_times(), [(1980, 2030), (4860, 4910)])
+
+    def test_seat_changes_keep_it(self):
+        before = term_snapshot('1228')
+        courses = make_sis_courses(3)
+        courses[0]['enrollment_available'] = 0
+        bulk_upsert_courses(courses)
+        self.assertIs(term_snapshot('1228'), before)
+
+    def test_saved_course_is_seen(self):
+        term_snapshot('1228')
+        course = Course.objects.get(pk=10000)
+        course.class_section = '010'
+        course.save()
+        self.assertEqual(catalog_course(10000, '1228').class_section, '010')
+
+    def test_course_added_elsewhere_is_found(self):
+        # another worker's upsert, whose invalidation this process never saw
+        before = term_snapshot('1228')
+        with patch('schedapp.catalog.invalidate_term'):
+            bulk_upsert_courses(make_sis_courses(4))
+        self.assertIs(term_snapshot('1228'), before)
+        self.assertEqual(catalog_course(10003).class_section, '004')
+        self.assertEqual(sorted(catalog_courses([10000, 10003])), [10000, 10003])
+        # and the term is rebuilt for the next lookup
+        self.assertIn(10003, term_snapshot('1228'))
+
+    def test_only_recent_terms_with_courses_are_kept(self):
+        spring = [dict(course, strm='1232') for course in make_sis_courses(2, first_class_nbr=20000)]
+        bulk_upsert_courses(spring)
+        catalog_course(10000, 'junk')
+        self.assertEqual(list(_snapshots), ['1228'])
+        with override_settings(CATALOG_SNAPSHOT_TERMS=1):
+            catalog_course(20000)
+            self.assertEqual(list(_snapshots), ['1232'])
+        self.assertIsNone(catalog_course(99999, '9999'))
+        self.assertEqual(list(_snapshots), ['1232'])
+
+    def test_stale_term_is_rebuilt_in_the_background(self):
+        term_snapshot('1228')
+        courses = make_sis_courses(3)
+        courses[0]['meetings'][0]['days'] = 'TuTh'
+        bulk_upsert_courses(courses)
+        with override_settings(CATALOG_SNAPSHOT_BACKGROUND=True):
+            with patch('schedapp.catalog_snapshot.threading.Thread') as thread:
+                # the table answers until the new snapshot is in
+                self.assertIsInstance(catalog_course(10000), Course)
+                self.assertIsInstance(catalog_courses([10000, 10001])[10001], Course)
+                self.assertEqual(thread.call_count, 1)
+                thread.call_args.kwargs['target'](*thread.call_args.kwargs['args'])
+        record = catalog_course(10000)
+        self.assertIsInstance(record, CourseRecord)
+        self.assertEqual(record.get_meeting_times(), [(1980, 2030), (4860, 4910)])
+
+    def test_deploy_needs_a_shared_cache(self):
+        self.assertEqual([error.id for error in check_shared_cache(None)], ['schedapp.E001'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_cart_and_schedule_views(self):
+        student = Builders().create_user(name="snapshot-student")
+        advisor = Builders().create_user(is_advisor=True, name="snapshot-advisor")
+        self.client.force_login(student)
+        self.assertEqual(self.client.get(reverse('add_to_cart', args=(10000, 1228))).status_code, 302)
+        self.assertEqual(self.client.get(reverse('add_to_cart', args=(99999, 1228))).status_code, 404)
+        self.assertEqual(list(ShoppingCart.objects.get(user=student).courses.values_list('pk', flat=True)), [10000])
+
+        schedule = Schedule.objects.create(student=student, approver=advisor, name="Plan")
+        url = reverse('student-schedule-add-course')
+        self.client.post(url, {'sched-id': schedule.pk, 'class_nbr': 10000})
+        # every section meets MoWeFr 9:00, so the second one conflicts
+        self.client.post(url, {'sched-id': schedule.pk, 'class_nbr': 10001})
+        self.assertEqual(list(schedule.courses.values_list('pk', flat=True)), [10000])
+
+class SeatRefreshTests(TestCase):
+    """
+    Tests for the seat count refresher
+    """
+    def setUp(self):
+        # 10000 and 10001 are two sections of one course, 10020 another course, 10021 in no cart or schedule
+        bulk_upsert_courses(make_sis_courses(22))
+        student = Builders().create_user(name="seats-student")
+        advisor = Builders().create_user(is_advisor=True, name="seats-advisor")
+        cart = ShoppingCart.objects.create(user=student, strm=1228)
+        cart.courses.add(10000, 10001, 10020)
+        Schedule.objects.create(student=student, approver=advisor, name="Plan").courses.add(10020)
+
+    def sis_courses(self):
+        courses = make_sis_courses(22)
+        courses[0]['enrollment_available'] = 0
+        courses[0]['enrl_stat'] = 'C'
+        courses[20]['wait_tot'] = 7
+        return courses
+
+    def test_token_bucket(self):
+        now = [0.0]
+        bucket = TokenBucket(60, burst=2, clock=lambda: now[0], sleep=lambda seconds: now.__setitem__(0, now[0] + seconds))
+        self.assertTrue(bucket.try_take())
+        self.assertTrue(bucket.try_take())
+        self.assertFalse(bucket.try_take())
+        bucket.take()
+        self.assertAlmostEqual(now[0], 1.0)
+
+    def test_queue_is_popular_and_stale_first(self):
+        queue = refresh_queue()
+        self.assertEqual([[section.pk for section in sections] for _, sections in queue], [[10020], [10000, 10001]])
+        Course.objects.filter(pk=10020).update(seats_refreshed_at=timezone.now())
+        self.assertEqual([key for key, _ in refresh_queue()], [('1228', 'APMA', '1000')])
+
+    def test_refresh_from_stub(self):
+        # a short first page is the last one once SIS's page size is known
+        with StubSISServer(self.sis_courses(), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url, SIS_PAGE_SIZE=50):
+                with CaptureQueriesContext(connection) as queries:
+                    stats = refresh_seats(rate=6000)
+        self.assertEqual(stats, (2, 3, 2, 0))
+        self.assertEqual([(query['subject'], query['catalog_nbr']) for query in stub.requests],
+                         [('APMA', '1001'), ('APMA', '1000')])
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        course = Course.objects.get(pk=10000)
+        self.assertEqual((course.enrollment_available, course.enrl_stat), (0, 'C'))
+        self.assertEqual(Course.objects.get(pk=10020).wait_tot, 7)
+        self.assertIsNone(Course.objects.get(pk=10021).seats_refreshed_at)
+        # everything is fresh now
+        self.assertEqual(refresh_seats(rate=6000).requests, 0)
+
+    def test_budget_and_failures(self):
+        with patch('schedapp.sis.fetch_search_page', return_value=(1, [], False)) as fetch:
+            stats = refresh_seats(rate=6000, max_requests=1)
+        self.assertEqual((fetch.call_count, stats.failed), (1, 1))
+        self.assertFalse(Course.objects.exclude(seats_refreshed_at=None).exists())
+
+    def test_every_page_is_read(self):
+        # 10020 is on the third page of 10; 10001 isn't in the results at all
+        courses = [course for course in self.sis_courses() if course['class_nbr'] != 10001]
+        with StubSISServer(courses, page_size=10) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url, SIS_PAGE_SIZE=None):
+                stats = refresh_seats(rate=6000)
+        self.assertEqual(stub.pages_requested(), [1, 1, 2, 2, 3, 3])
+        self.assertEqual(stats, (6, 2, 2, 1))
+        self.assertEqual(Course.objects.get(pk=10020).wait_tot, 7)
+        self.assertIsNone(Course.objects.get(pk=10001).seats_refreshed_at)
+        self.assertEqual([sections for _, sections in refresh_queue()], [[Course.objects.get(pk=10001)]])
+
+    def test_page_size_from_catalog_sync(self):
+        # a short page is the last one without asking for the next
+        CatalogSync.objects.create(strm='1228', page_size=50)
+        with StubSISServer(self.sis_courses(), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url, SIS_PAGE_SIZE=None):
+                stats = refresh_seats(rate=6000)
+        self.assertEqual(stub.pages_requested(), [1, 1])
+        self.assertEqual(stats, (2, 3, 2, 0))
+
+    def test_command(self):
+        output = io.StringIO()
+        with StubSISServer(self.sis_courses(), page_size=50) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                call_command('refresh_seats', '--rate', '6000', '--max-requests', '1', stdout=output)
+        self.assertIn("refreshed 1 sections in 1 requests", output.getvalue())
+
+    def test_search_results_keep_refresh_time(self):
+        Course.objects.filter(pk=10000).update(seats_refreshed_at=timezone.now())
+        bulk_upsert_courses(self.sis_courses())
+        self.assertIsNotNone(Course.objects.get(pk=10000).seats_refreshed_at)
+
+class MeetingTimesTests(TestCase):
+    """
+    Tests for the precomputed meeting intervals behind Course.conflicts_with
+    """
+    def test_parse_time(self):
+        self.assertEqual(parse_time("12:30 PM"), 750)
+        self.assertEqual(parse_time("12:15 AM"), 15)
+        self.assertEqual(parse_time("01:45 PM"), 825)
+        self.assertEqual(parse_time("13.45.00.000000-05:00"), 825)
+        self.assertIsNone(parse_time(""))
+        self.assertIsNone(parse_time("TBA"))
+
+    def test_meeting_intervals(self):
+        intervals = meeting_intervals([{"days": "TuTh", "start_time": "12:30 PM", "end_time": "01:45 PM"}])
+        self.assertEqual(intervals, [[1440 + 750, 1440 + 825], [3 * 1440 + 750, 3 * 1440 + 825]])
+
+    def test_intervals_overlap(self):
+        self.assertTrue(intervals_overlap([[0, 10], [100, 110]], [[50, 60], [105, 120]]))
+        self.assertFalse(intervals_overlap([[0, 10], [100, 110]], [[20, 60], [111, 120]]))
+
+    def test_meeting_times_are_stored(self):
+        course = Builders().create_course()
+        course.refresh_from_db()
+        self.assertEqual(course.meeting_times, [[1440 + 750, 1440 + 825], [3 * 1440 + 750, 3 * 1440 + 825]])
+
+    def test_conflicts_with_self(self):
+        course = Builders().create_course()
+        self.assertTrue(course.conflicts_with(course))
+
+    def test_different_days_do_not_conflict(self):
+        course = Builders().create_course()
+        other = Builders().create_meeting_course(1, "MoWe", "12:30 PM", "01:45 PM")
+        self.assertFalse(course.conflicts_with(other))
+
+    def test_one_shared_day_conflicts(self):
+        course = Builders().create_course()
+        other = Builders().create_meeting_course(1, "TuWe", "12:30 PM", "01:45 PM")
+        self.assertTrue(course.conflicts_with(other))
+
+    def test_different_terms_do_not_conflict(self):
+        course = Builders().create_course()
+        other = Builders().create_meeting_course(1, "TuTh", "12:30 PM", "01:45 PM", strm="1238")
+        self.assertFalse(course.conflicts_with(other))
+
+    def test_back_to_back_classes_conflict(self):
+        course = Builders().create_course()
+        other = Builders().create_meeting_course(1, "TuTh", "01:45 PM", "03:00 PM")
+        self.assertTrue(course.conflicts_with(other))
+
+    def test_later_meetings_are_checked(self):
+        course = Builders().create_course()
+        other = Builders().create_meeting_course(1, "Mo", "09:00 AM", "09:50 AM", extra_meetings=[
+            {"days": "Th", "start_time": "01:00 PM", "end_time": "01:50 PM"}])
+        self.assertTrue(course.conflicts_with(other))
+        self.assertTrue(other.conflicts_with(course))
+
+class ScheduleConflictTests(TestCase):
+    """
+    Tests for ScheduleIndex, conflicting_pairs and the views that use them
+    """
+    def setUp(self):
+        self.lecture = Builders().create_meeting_course(1, "MoWeFr", "09:00 AM", "09:50 AM")
+        self.lab = Builders().create_meeting_course(2, "Tu", "09:00 AM", "11:45 AM")
+        self.seminar = Builders().create_meeting_course(3, "We", "09:30 AM", "10:45 AM")
+        self.evening = Builders().create_meeting_course(4, "TuTh", "07:00 PM", "08:15 PM")
+
+    def test_fits(self):
+        index = ScheduleIndex([self.lecture, self.lab, self.evening])
+        self.assertFalse(index.fits(self.seminar))
+        self.assertTrue(index.fits(Builders().create_meeting_course(5, "Th", "09:00 AM", "09:50 AM")))
+        self.assertTrue(index.fits(Builders().create_meeting_course(6, "We", "09:30 AM", "10:45 AM", strm="1238")))
+
+    def test_conflicts_for(self):
+        index = ScheduleIndex([self.lecture, self.lab, self.evening])
+        self.assertEqual(index.conflicts_for(self.seminar), [self.lecture])
+        self.assertEqual(index.conflicts_for(Builders().create_meeting_course(5, "TuWe", "10:00 AM", "08:00 PM")),
+                         [self.lab, self.evening])
+
+    def test_conflicting_pairs(self):
+        late_lab = Builders().create_meeting_course(5, "Tu", "11:00 AM", "12:15 PM")
+        pairs = conflicting_pairs([self.lecture, self.lab, self.seminar, self.evening, late_lab])
+        self.assertEqual(pairs, [(self.lecture, self.seminar), (self.lab, late_lab)])
+
+    def test_conflicting_pairs_matches_pairwise(self):
+        courses = [self.lecture, self.lab, self.seminar, self.evening,
+                   Builders().create_meeting_course(5, "MoTuWeThFr", "09:45 AM", "10:00 AM"),
+                   Builders().create_meeting_course(6, "Fr", "08:00 AM", "09:00 AM")]
+        pairwise = [(first, second) for i, first in enumerate(courses) for second in courses[i + 1:]
+                    if first.conflicts_with(second)]
+        self.assertEqual(conflicting_pairs(courses), pairwise)
+
+    def test_add_course_rejects_conflict(self):
+        student = Builders().create_student()
+        schedule = Builders().create_schedule(student=student, courses=[self.lecture])
+        self.client.force_login(student)
+        self.client.post(reverse('student-schedule-add-course'), {'sched-id': schedule.pk, 'class_nbr': self.seminar.pk})
+        self.client.post(reverse('student-schedule-add-course'), {'sched-id': schedule.pk, 'class_nbr': self.lab.pk})
+        self.assertEqual(list(schedule.courses.order_by('pk')), [self.lecture, self.lab])
+
+    def test_validate_schedule(self):
+        student = Builders().create_student()
+        schedule = Builders().create_schedule(student=student, courses=[self.lecture, self.seminar, self.evening])
+        self.client.force_login(student)
+        response = self.client.get(reverse('schedule-validate', args=(schedule.pk,)))
+        self.assertFalse(response.json()['valid'])
+        self.assertEqual(response.json()['conflicts'], [[str(self.lecture), 1, str(self.seminar), 3]])
+
+    def test_validate_schedule_is_private(self):
+        schedule = Builders().create_schedule(courses=[self.lecture])
+        self.client.force_login(Builders().create_student(name="someone else"))
+        response = self.client.get(reverse('schedule-validate', args=(schedule.pk,)))
+        self.assertEqual(response.status_code, 403)
+
+class ScheduleGeneratorTests(TestCase):
+    """
+    Tests for generating schedules from a shopping cart
+    """
+    def section(self, class_nbr, catalog_nbr, days, start, end, units="3"):
+        course = make_sis_courses(1, first_class_nbr=class_nbr)[0]
+        course['catalog_nbr'] = catalog_nbr
+        course['units'] = units
+        course['meetings'][0].update(days=days, start_time=start, end_time=end)
+        return addJsonCourse(course)
+
+    def brute_force(self, cart, preferences=Preferences()):
+        """ every conflict-free schedule with one section per course, scored the slow way """
+        groups = {}
+        for course in cart:
+            groups.setdefault(course.catalog_nbr, []).append(course)
+        scored = []
+        for courses in itertools.product(*groups.values()):
+            if conflicting_pairs(courses):
+                continue
+            spans = {}
+            early = 0
+            for start, end in (interval for course in courses for interval in course.get_meeting_times()):
+                day = start // 1440
+                first, last = spans.get(day, (start, end))
+                spans[day] = (min(first, start), max(last, end))
+                early += max(0, preferences.earliest - start % 1440)
+            score = (early * preferences.early_weight + len(spans) * preferences.day_weight
+                     + sum(last - first for first, last in spans.values()) * preferences.span_weight)
+            scored.append(round(score, 2))
+        return sorted(scored)
+
+    def test_parse_units(self):
+        self.assertEqual(parse_units("3"), (3, 3))
+        self.assertEqual(parse_units("1 - 3"), (1, 3))
+        self.assertEqual(parse_units("1.5"), (1.5, 1.5))
+        self.assertEqual(parse_units(""), (0, 0))
+        self.assertEqual(parse_units(None), (0, 0))
+
+    def test_one_section_per_course_without_conflicts(self):
+        cart = [self.section(1, "1000", "MoWe", "09:00 AM", "10:15 AM"),
+                self.section(2, "1000", "TuTh", "11:00 AM", "12:15 PM"),
+                self.section(3, "2000", "MoWe", "09:30 AM", "10:45 AM"),
+                self.section(4, "2000", "Fr", "01:00 PM", "03:45 PM")]
+        schedules = generate_schedules(cart)
+        self.assertEqual([[course.pk for course in schedule.courses] for schedule in schedules],
+                         [[1, 4], [2, 4], [2, 3]])
+        self.assertEqual(schedules[0].units, 6)
+
+    def test_prefers_later_classes(self):
+        cart = [self.section(1, "1000", "MoWe", "08:00 AM", "09:15 AM"),
+                self.section(2, "1000", "MoWe", "11:00 AM", "12:15 PM")]
+        self.assertEqual(generate_schedules(cart)[0].courses, [cart[1]])
+        early_bird = generate_schedules(cart, preferences=Preferences(earliest=7 * 60))
+        self.assertEqual(early_bird[0].score, early_bird[1].score)
+
+    def test_matches_brute_force(self):
+        for seed in range(3):
+            cart = make_cart(4, 5, seed)
+            for course in cart:
+                course.save()
+            schedules = generate_schedules(cart, limit=5)
+            self.assertEqual([schedule.score for schedule in schedules], self.brute_force(cart)[:5])
+            for schedule in schedules:
+                self.assertEqual(len({course.catalog_nbr for course in schedule.courses}), 4)
+                self.assertEqual(conflicting_pairs(schedule.courses), [])
+            Course.objects.all().delete()
+
+    def test_unit_limits(self):
+        cart = [self.section(1, "1000", "MoWe", "11:00 AM", "12:15 PM", units="4"),
+                self.section(2, "2000", "TuTh", "11:00 AM", "12:15 PM", units="3"),
+                self.section(3, "3000", "Fr", "11:00 AM", "12:15 PM", units="1 - 3")]
+        for schedule in generate_schedules(cart, min_units=5, max_units=7):
+            low, high = parse_units(schedule.units)
+            self.assertLessEqual(low, 7)
+            self.assertGreaterEqual(high, 5)
+        self.assertEqual([schedule.courses for schedule in generate_schedules(cart, max_units=2)], [[cart[2]]])
+        self.assertEqual(generate_schedules(cart, min_units=20), [])
+
+    def test_time_budget(self):
+        generator = ScheduleGenerator(make_cart(10, 12), time_budget=0)
+        self.assertEqual(list(generator), [])
+        self.assertFalse(generator.complete)
+
+    def test_streams_improvements(self):
+        cart = [self.section(1, "1000", "MoWe", "08:00 AM", "09:15 AM"),
+                self.section(2, "1000", "MoWe", "11:00 AM", "12:15 PM")]
+        generator = ScheduleGenerator(cart, limit=1)
+        streamed = list(generator)
+        self.assertTrue(generator.complete)
+        self.assertEqual(streamed[-1], generator.results()[0])
+
+    def test_cart_schedules_view(self):
+        student = Builders().create_student()
+        cart = ShoppingCart.objects.create(user=student, strm=1228)
+        cart.courses.add(self.section(1, "1000", "MoWe", "09:00 AM", "10:15 AM"),
+                         self.section(2, "2000", "TuTh", "09:00 AM", "10:15 AM"))
+        self.client.force_login(student)
+        response = self.client.get(reverse('cart-schedules'), {'strm': 1228})
+        self.assertEqual(len(response.context['generated']), 1)
+        self.assertContains(response, "Option 1")
+
+    def test_save_generated_schedule(self):
+        student = Builders().create_student()
+        advisor = student.symbiotes.first()
+        courses = [self.section(1, "1000", "MoWe", "09:00 AM", "10:15 AM"),
+                   self.section(2, "2000", "TuTh", "09:00 AM", "10:15 AM")]
+        self.client.force_login(student)
+        response = self.client.post(reverse('cart-schedule-save'),
+                                    {'name': "plan A", 'approver': advisor.pk, 'class_nbr': [1, 2]})
+        schedule = Schedule.objects.get(name="plan A")
+        self.assertRedirects(response, reverse('student-schedule-detail', args=(schedule.pk,)))
+        self.assertEqual(list(schedule.courses.order_by('pk')), courses)
+
+    def test_save_rejects_conflicts(self):
+        student = Builders().create_student()
+        self.section(1, "1000", "MoWe", "09:00 AM", "10:15 AM")
+        self.section(2, "2000", "MoWe", "10:00 AM", "11:15 AM")
+        self.client.force_login(student)
+        self.client.post(reverse('cart-schedule-save'),
+                         {'name': "plan B", 'approver': student.symbiotes.first().pk, 'class_nbr': [1, 2]})
+        self.assertFalse(Schedule.objects.filter(name="plan B").exists())
+
+    def test_save_needs_an_approver(self):
+        student = Builders().create_student()
+        self.section(1, "1000", "MoWe", "09:00 AM", "10:15 AM")
+        self.client.force_login(student)
+        for data in ({'name': "plan C", 'class_nbr': [1]}, {'name': "plan C", 'approver': "", 'class_nbr': [1]}):
+            response = self.client.post(reverse('cart-schedule-save'), data)
+            self.assertRedirects(response, reverse('cart-schedules'), fetch_redirect_response=False)
+        self.assertFalse(Schedule.objects.filter(name="plan C").exists())
+
+class ScheduleGridTests(TestCase):
+    """
+    Tests for the weekly grid on the schedule detail pages
+    """
+    def cell(self, grid, time, day):
+        row = next(row for row in grid.rows if row.time == time)
+        return [entry.course.pk for entry in row.cells[grid.days.index(day)]]
+
+    def test_slot_label(self):
+        self.assertEqual(slot_label(8 * 60), "08:00am")
+        self.assertEqual(slot_label(12 * 60), "12:00pm")
+        self.assertEqual(slot_label(22 * 60 + 30), "10:30pm")
+
+    def test_empty_grid(self):
+        grid = schedule_grid([])
+        self.assertEqual(grid.days, ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday'))
+        self.assertEqual([row.time for row in grid.rows][0], "08:00am")
+        self.assertEqual([row.time for row in grid.rows][-1], "10:00pm")
+
+    def test_courses_fill_every_slot_they_overlap(self):
+        grid = schedule_grid([Builders().create_meeting_course(1, "TuTh", "09:30 AM", "10:45 AM"),
+                              Builders().create_meeting_course(2, "MoWeFr", "11:00 AM", "11:50 AM")])
+        self.assertEqual(self.cell(grid, "09:00am", "Tuesday"), [1])
+        self.assertEqual(self.cell(grid, "10:00am", "Thursday"), [1])
+        self.assertEqual(self.cell(grid, "11:00am", "Tuesday"), [])
+        self.assertEqual(self.cell(grid, "11:00am", "Friday"), [2])
+        self.assertEqual(self.cell(grid, "12:00pm", "Friday"), [])
+
+    def test_arbitrary_times_and_multiple_meetings(self):
+        lab = {"days": "Sa", "start_time": "07:10 AM", "end_time": "07:55 AM"}
+        grid = schedule_grid([Builders().create_meeting_course(1, "We", "02:05 PM", "03:20 PM", extra_meetings=[lab])])
+        self.assertEqual(grid.rows[0].time, "07:00am")
+        self.assertEqual(grid.days[-1], "Saturday")
+        self.assertEqual(self.cell(grid, "07:00am", "Saturday"), [1])
+        self.assertEqual(self.cell(grid, "02:00pm", "Wednesday"), [1])
+        self.assertEqual(self.cell(grid, "03:00pm", "Wednesday"), [1])
+
+    def test_detail_page_queries_dont_grow_with_courses(self):
+        student = Builders().create_student()
+        schedule = Builders().create_schedule(student=student)
+        self.client.force_login(student)
+        url = reverse('student-schedule-detail', args=(schedule.pk,))
+        with CaptureQueriesContext(connection) as empty:
+            self.client.get(url)
+        schedule.courses.add(*[Builders().create_meeting_course(i, "MoWe", "10:00 AM", "11:15 AM") for i in range(1, 9)])
+        with CaptureQueriesContext(connection) as full:
+            response = self.client.get(url)
+        self.assertEqual(len(full), len(empty))
+        self.assertContains(response, "10:00 AM - 11:15 AM")
+
+    def test_advisor_detail_page(self):
+        advisor = Builders().create_advisor()
+        schedule = Builders().create_schedule(approver=advisor, courses=[Builders().create_meeting_course(1, "Fr", "01:00 PM", "01:50 PM")])
+        self.client.force_login(advisor)
+        response = self.client.get(reverse('advisor-schedule-detail', args=(schedule.pk,)))
+        self.assertEqual(len(response.context['grid'].rows), 15)
+        self.assertContains(response, "01:00 PM - 01:50 PM")
+
+class ApprovalQueueTests(TestCase):
+    """
+    Tests for the advisor approval queue
+    """
+    def setUp(self):
+        self.advisor = Builders().create_advisor()
+        self.other_advisor = Builders().create_user(is_advisor=True, name="other advisor")
+        self.student = self.advisor.symbiotes.first()
+        self.schedules = []
+        for i, status in enumerate(["pending", "approved", "unsubmitted", "denied", "pending", "pending"]):
+            self.schedules.append(Schedule.objects.create(student=self.student, approver=self.advisor,
+                                                          name=f"schedule {i}", approval_status=status))
+        Schedule.objects.create(student=self.student, approver=self.other_advisor, name="elsewhere", approval_status="pending")
+
+    def test_submitted_at(self):
+        unsubmitted = self.schedules[2]
+        self.assertIsNone(unsubmitted.submitted_at)
+        unsubmitted.set_approval_status("pending")
+        unsubmitted.save()
+        self.assertIsNotNone(unsubmitted.submitted_at)
+
+        # an advisor sending an approved schedule back to pending doesn't move it in the queue
+        approved = self.schedules[1]
+        submitted_at = approved.submitted_at
+        approved.set_approval_status("pending")
+        self.assertEqual(approved.submitted_at, submitted_at)
+
+    def test_queue_filters_by_approver_and_status(self):
+        schedules, cursor = approval_queue(self.advisor)
+        self.assertEqual(schedules, [self.schedules[i] for i in (0, 1, 3, 4, 5)])
+        self.assertIsNone(cursor)
+        schedules, _ = approval_queue(self.advisor, "pending")
+        self.assertEqual(schedules, [self.schedules[i] for i in (0, 4, 5)])
+
+    def test_keyset_pages(self):
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = approval_queue(self.advisor, after=cursor, limit=2)
+            seen += page
+            if not cursor:
+                break
+        self.assertEqual(seen, [self.schedules[i] for i in (0, 1, 3, 4, 5)])
+
+    def test_cursor(self):
+        schedule = self.schedules[0]
+        self.assertEqual(parse_cursor(make_cursor(schedule)), (schedule.submitted_at, schedule.pk))
+        self.assertIsNone(parse_cursor("nonsense"))
+        self.assertIsNone(parse_cursor(None))
+
+    def test_status_counts(self):
+        with self.assertNumQueries(1):
+            counts = status_counts(self.advisor)
+        self.assertEqual(counts, {"pending": 3, "approved": 1, "denied": 1})
+
+    def test_queue_page(self):
+        self.client.force_login(self.advisor)
+        response = self.client.get(reverse('advisor-schedule-list'), {'status': 'pending'})
+        self.assertEqual(list(response.context['schedules']), [self.schedules[i] for i in (0, 4, 5)])
+        self.assertNotContains(response, "elsewhere")
+        self.assertNotContains(response, "schedule 2")
+
+    def test_queue_page_queries(self):
+        self.client.force_login(self.advisor)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('advisor-schedule-list'))
+        for i in range(10):
+            Schedule.objects.create(student=Builders().create_user(name=f"student {i}"), approver=self.advisor,
+                                    name=f"more {i}", approval_status="pending")
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('advisor-schedule-list'))
+        self.assertEqual(len(many), len(few))
+
+class MeetingTableTests(TestCase):
+    """
+    Tests for the Meeting rows kept alongside Course.meetings
+    """
+    def rows(self, course):
+        return list(Meeting.objects.filter(course=course).order_by('day', 'start_min')
+                                   .values_list('day', 'start_min', 'end_min', 'facility', 'instructor'))
+
+    def test_rows_for_new_course(self):
+        lab = {"days": "Fr", "start_time": "02:00 PM", "end_time": "03:15 PM", "facility_descr": "Rice Hall 130", "instructor": "Ada"}
+        course = Builders().create_meeting_course(1, "MoWe", "09:00 AM", "09:50 AM", extra_meetings=[lab])
+        self.assertEqual(self.rows(course), [(0, 540, 590, "Olsson Hall 005", "Monika Abramenko"),
+                                             (2, 540, 590, "Olsson Hall 005", "Monika Abramenko"),
+                                             (4, 840, 915, "Rice Hall 130", "Ada")])
+
+    def test_bulk_upsert_keeps_rows_in_sync(self):
+        courses = make_sis_courses(3)
+        bulk_upsert_courses(courses)
+        self.assertEqual(Meeting.objects.count(), 9)
+
+        courses[0]['meetings'][0]['days'] = "TuTh"
+        courses[1]['enrollment_total'] = 45
+        bulk_upsert_courses(courses)
+        self.assertEqual(Meeting.objects.count(), 8)
+        self.assertEqual([row[0] for row in self.rows(Course.objects.get(pk=courses[0]['class_nbr']))], [1, 3])
+
+    def test_rows_only_rewritten_when_meetings_change(self):
+        course = Builders().create_meeting_course(1, "MoWe", "09:00 AM", "09:50 AM")
+        ids = sorted(Meeting.objects.values_list('pk', flat=True))
+        course.enrollment_total = 12
+        with CaptureQueriesContext(connection) as queries:
+            course.save()
+        self.assertFalse([query for query in queries if query['sql'].startswith(('DELETE', 'INSERT'))])
+        course.save(update_fields=['enrollment_total'])
+        bulk_upsert_courses([dict(make_sis_courses(1, first_class_nbr=1)[0], strm="1232", enrollment_total=3,
+                                  meetings=course.meetings)])
+        self.assertEqual(sorted(Meeting.objects.values_list('pk', flat=True)), ids)
+
+        # changed in place, the way the admin or a shell session might
+        course = Course.objects.get(pk=1)
+        course.meetings[0]['days'] = "Fr"
+        course.save()
+        self.assertEqual([row[0] for row in self.rows(course)], [4])
+        self.assertEqual(course.meeting_times, [[4 * 24 * 60 + 540, 4 * 24 * 60 + 590]])
+
+    def test_save_repairs_drifted_rows(self):
+        course = Builders().create_meeting_course(1, "MoWe", "09:00 AM", "09:50 AM")
+        Meeting.objects.filter(course=course).delete()
+        Course.objects.get(pk=1).save()
+        self.assertEqual([row[0] for row in self.rows(course)], [0, 2])
+
+    def test_rows_deleted_with_course(self):
+        course = Builders().create_meeting_course(1, "MoWe", "09:00 AM", "09:50 AM")
+        course.delete()
+        self.assertFalse(Meeting.objects.exists())
+
+    def test_exclude_conflicts(self):
+        schedule = [Builders().create_meeting_course(1, "MoWeFr", "09:00 AM", "09:50 AM"),
+                    Builders().create_meeting_course(2, "TuTh", "02:00 PM", "03:15 PM")]
+        overlaps = Builders().create_meeting_course(3, "We", "09:30 AM", "10:45 AM")
+        back_to_back = Builders().create_meeting_course(4, "Th", "03:15 PM", "04:30 PM")
+        fits = Builders().create_meeting_course(5, "MoWe", "10:00 AM", "10:50 AM")
+        other_term = Builders().create_meeting_course(6, "We", "09:30 AM", "10:45 AM", strm="1238")
+        candidates = Course.objects.filter(pk__in=[3, 4, 5, 6]).order_by('pk')
+        self.assertEqual(list(exclude_conflicts(candidates, schedule)), [fits, other_term])
+        self.assertEqual(list(exclude_conflicts(candidates, [])), [overlaps, back_to_back, fits, other_term])
+
+    def test_exclude_conflicts_matches_conflicts_with(self):
+        catalog = make_cart(6, 5)
+        for course in catalog:
+            course.save()
+        schedule = catalog[:3]
+        expected = [course.pk for course in catalog[3:] if not any(course.conflicts_with(taken) for taken in schedule)]
+        found = exclude_conflicts(Course.objects.filter(pk__in=[course.pk for course in catalog[3:]]), schedule)
+        self.assertEqual(sorted(found.values_list('pk', flat=True)), expected)
+
+class CourseSearchTests(TestCase):
+    """
+    Tests for full-text search over the local course catalog
+    """
+    def add(self, class_nbr, subject, catalog_nbr, descr, topic="", instructor="Monika Abramenko", strm="1228"):
+        course = make_sis_courses(1, first_class_nbr=class_nbr)[0]
+        course.update(subject=subject, catalog_nbr=catalog_nbr, descr=descr, topic=topic, strm=strm,
+                      instructors=[{"name": instructor, "email": "someone@virginia.edu"}])
+        return addJsonCourse(course)
+
+    def setUp(self):
+        self.calc2 = self.add(1, "APMA", "1110", "Single Variable Calculus II")
+        self.calc1 = self.add(2, "APMA", "1090", "Single Variable Calculus I", instructor="Thomas Lidbetter")
+        self.linear = self.add(3, "APMA", "3080", "Linear Algebra", topic="calculus review")
+        self.dsa = self.add(4, "CS", "2100", "Data Structures and Algorithms 1", strm="1238")
+
+    def found(self, query, **kwargs):
+        return [course.pk for course in search_courses(query, **kwargs).courses]
+
+    def test_search_terms(self):
+        self.assertEqual(search_terms("  CS-2100, Data  "), ["cs", "2100", "data"])
+        self.assertEqual(search_terms(None), [])
+
+    def test_uses_fts5_on_sqlite(self):
+        self.assertEqual(search_backend(), 'fts5')
+
+    def test_fts_table_checked_once_per_connection(self):
+        search_backend()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(search_backend(), 'fts5')
+        self.assertEqual(len(queries), 0)
+        forget_fts_table(connection)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(search_backend(), 'fts5')
+        self.assertEqual(len(queries), 1)
+
+    def test_ranked_prefix_search(self):
+        # a title hit beats a topic hit
+        self.assertEqual(self.found("calc"), [1, 2, 3])
+        self.assertEqual(self.found("calculus ii"), [1])
+        self.assertEqual(self.found("lidb"), [2])
+        self.assertEqual(self.found("cs 2100"), [4])
+        self.assertEqual(self.found(""), [])
+
+    def test_term_filter(self):
+        self.assertEqual(self.found("a", strm="1238"), [4])
+
+    def test_pages(self):
+        first = search_courses("apma", page_size=2)
+        second = search_courses("apma", page=2, page_size=2)
+        self.assertTrue(first.has_next)
+        self.assertFalse(second.has_next)
+        self.assertEqual(sorted(course.pk for course in first.courses + second.courses), [1, 2, 3])
+
+    def test_index_follows_updates_and_deletes(self):
+        changed = make_sis_courses(1, first_class_nbr=3)[0]
+        changed.update(subject="APMA", catalog_nbr="3080", descr="Matrix Theory", strm="1228")
+        bulk_upsert_courses([changed])
+        self.assertEqual(self.found("linear"), [])
+        self.assertEqual(self.found("matrix"), [3])
+        self.calc1.delete()
+        self.assertEqual(self.found("calculus"), [1])
+
+    def test_basic_fallback(self):
+        with patch('schedapp.search.search_backend', return_value='basic'):
+            self.assertEqual(self.found("calculus"), [2, 1, 3])
+            self.assertEqual(self.found("lidbetter"), [2])
+
+    def test_search_endpoint(self):
+        self.client.force_login(Builders().create_student())
+        response = self.client.get(reverse('course-search'), {'q': 'data str', 'term': '1238'})
+        data = response.json()
+        self.assertEqual([result['class_nbr'] for result in data['results']], [4])
+        self.assertEqual(data['results'][0]['instructors'], ["Monika Abramenko"])
+        self.assertFalse(data['has_next'])
+
+    def test_fits_a_schedule(self):
+        # the sample courses all meet MoWeFr 9:00 to 9:50
+        morning = Builders().create_meeting_course(10, "We", "09:30 AM", "10:45 AM", strm="1228")
+        afternoon = Builders().create_meeting_course(11, "TuTh", "02:00 PM", "03:15 PM", strm="1228")
+        for backend in ('fts5', 'basic'):
+            with patch('schedapp.search.search_backend', return_value=backend):
+                self.assertEqual(self.found("calc", strm="1228", fits=[morning]), [11])
+                self.assertEqual(sorted(self.found("calc", strm="1228", fits=[afternoon])), [1, 2, 3, 10])
+
+        student = Builders().create_student()
+        schedule = Builders().create_schedule(student=student, courses=[morning])
+        self.client.force_login(student)
+        response = self.client.get(reverse('course-search'), {'q': 'calc', 'term': '1228', 'fits': schedule.pk})
+        self.assertEqual([result['class_nbr'] for result in response.json()['results']], [11])
+        self.client.force_login(Builders().create_student(name="someone else"))
+        response = self.client.get(reverse('course-search'), {'q': 'calc', 'fits': schedule.pk})
+        self.assertEqual(response.status_code, 404)
+
+class BenchmarkSuiteTests(TestCase):
+    """
+    Tests for the benchmark helpers and the benchmark command
+    """
+    def test_catalog_ingests(self):
+        catalog = make_catalog(40, sections=4)
+        self.assertEqual(len({course['class_nbr'] for course in catalog}), 40)
+        self.assertEqual(len({(course['subject'], course['catalog_nbr']) for course in catalog}), 10)
+        self.assertEqual(make_catalog(40, sections=4), catalog)
+        self.assertEqual(bulk_upsert_courses(catalog).inserted, 40)
+        self.assertTrue(all(course.get_meeting_times() for course in Course.objects.all()))
+
+    def test_catalog_from_fixture(self):
+        fixture = make_sis_courses(2)
+        fixture[1]['descr'] = "Recorded Course"
+        catalog = make_catalog(4, fixture=fixture)
+        self.assertEqual([course['descr'] for course in catalog][:2], [fixture[0]['descr'], "Recorded Course"])
+        self.assertEqual(fixture[1]['class_nbr'], 10001)
+
+    def test_pages(self):
+        catalog = make_catalog(60)
+        bulk_upsert_courses(catalog)
+        schedules, advisors = populate_users(4, [course['class_nbr'] for course in catalog], schedule_size=3)
+        self.assertEqual(len(advisors), 1)
+        self.assertEqual(Schedule.objects.filter(approver=advisors[0]).count(), 4)
+        self.assertEqual(schedules[0].courses.count(), 3)
+        self.assertEqual(ScheduleSummary.objects.get(schedule=schedules[0]).course_count, 3)
+        with override_settings(QUERY_BUDGET_STRICT=False):
+            report = time_pages(schedules, advisors, iterations=2)
+        self.assertEqual(set(report), {'schedule_detail', 'schedule_list', 'advisor_queue', 'cart'})
+        self.assertTrue(all(page['queries'] > 0 for page in report.values()))
+
+    def test_command_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            call_command('benchmark', 'conflicts', '--iterations', '1', '--output', path, stdout=io.StringIO())
+            with open(path, encoding='utf-8') as file:
+                report = json.load(file)
+        self.assertEqual(report['meta']['database'], connection.vendor)
+        self.assertIn('speedup', report['benchmarks']['conflicts'])
+
+@override_settings(SIS_RETRY_BACKOFF=0)
+class SISRecordingTests(TestCase):
+    """
+    Tests for recording SIS searches and replaying them from the stub server
+    """
+    def setUp(self):
+        caches['sis'].clear()
+        reset_request_stats()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def record(self, stub, *searches):
+        recording = SISRecording()
+        with override_settings(SIS_SEARCH_URL=stub.url):
+            found = [record_search(recording, params) for params in searches]
+        return recording, found
+
+    def test_record_and_replay(self):
+        with StubSISServer(make_sis_courses(120), page_size=50) as sis:
+            recording, found = self.record(sis, {'term': '1228', 'subject': 'APMA'})
+        self.assertEqual(found, [120])
+        self.assertEqual(len(recording), 3)
+        path = os.path.join(self.directory.name, 'sis.json.gz')
+        recording.save(path)
+        recording = SISRecording.load(path)
+
+        with StubSISServer(recording=recording) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url):
+                courses = fetch_search_pages({'subject': 'APMA', 'term': '1228'})
+                self.assertEqual(fetch_search_pages({'term': '1228', 'subject': 'CS'}), [])
+        self.assertEqual([course['class_nbr'] for course in courses], list(range(10000, 10120)))
+        self.assertEqual({query['subject'] for query in stub.misses}, {'CS'})
+
+    def test_courses_are_stored_once(self):
+        with StubSISServer(make_sis_courses(10), page_size=50) as sis:
+            recording, found = self.record(sis, {'term': '1228', 'subject': 'APMA'}, {'term': '1228', 'keyword': 'calc'})
+        self.assertEqual(found, [10, 10])
+        self.assertEqual(len(recording.courses), 10)
+        self.assertEqual(recording.response({'term': '1228', 'keyword': 'calc'}, 1)[1][0]['class_nbr'], 10000)
+
+    def test_error_pages_are_recorded(self):
+        with StubSISServer(make_sis_courses(10), error_rate=1.0, error_status=502) as sis:
+            recording, found = self.record(sis, {'term': '1228'})
+        self.assertEqual(found, [0])
+        status, body = recording.response({'term': '1228'}, 1)
+        self.assertEqual(status, 502)
+        self.assertIn("injected", body)
+
+    @override_settings(SIS_RETRIES=1)
+    def test_error_injection_and_jitter(self):
+        with StubSISServer(make_sis_courses(10), error_rate=1.0, error_status=500) as stub:
+            with override_settings(SIS_SEARCH_URL=stub.url), self.assertLogs('schedapp.sis', 'WARNING'):
+                self.assertEqual(fetch_search_page({'term': '1228'}, 1), (1, [], False))
+                stub.error_rate = 0
+                self.assertEqual(len(fetch_search_page({'term': '1228'}, 1)[1]), 10)
+        self.assertEqual(len(stub.requests), 3)
+        self.assertEqual(request_stats()['failures'], 2)
+
+        rolls = [[stub.roll() for _ in range(20)]
+                 for stub in (StubSISServer(latency=0.1, jitter=0.05, error_rate=0.5, seed=7) for _ in range(2))]
+        self.assertEqual(rolls[0], rolls[1])
+        self.assertTrue(all(0.1 <= delay <= 0.15 for delay, _ in rolls[0]))
+        self.assertTrue(any(failing for _, failing in rolls[0]) and not all(failing for _, failing in rolls[0]))
+
+    def test_record_command(self):
+        path = os.path.join(self.directory.name, 'sis.json')
+        with StubSISServer(make_sis_courses(5)) as sis:
+            with override_settings(SIS_SEARCH_URL=sis.url):
+                call_command('record_sis', path, 'term=1228&subject=APMA', '--delay', '0', stdout=io.StringIO())
+                call_command('record_sis', path, 'term=1228&subject=CS', '--delay', '0', '--append', stdout=io.StringIO())
+        self.assertEqual(sorted(SISRecording.load(path).searches), ['subject=APMA&term=1228', 'subject=CS&term=1228'])
+
+class CartSummaryTests(TestCase):
+    """
+    Tests for the cart summaries and the pages that read them
+    """
+    def setUp(self):
+        clear_snapshots()
+        # every section meets MoWeFr 9:00 except 10002; 10001 is worth 1 to 3 units, the rest 4
+        courses = make_sis_courses(3)
+        courses[1]['units'] = '1 - 3'
+        courses[2]['meetings'][0]['days'] = 'TuTh'
+        spring = make_sis_courses(1, first_class_nbr=20000)[0]
+        spring['strm'] = '1232'
+        bulk_upsert_courses(courses + [spring])
+        self.other = Builders().create_user(name="other-student")
+        ShoppingCart.objects.create(user=self.other, strm=1228).courses.add(10000, 10002)
+        self.student = Builders().create_user(name="cart-student")
+        self.cart = ShoppingCart.objects.create(user=self.student, strm=1228)
+        self.client.force_login(self.student)
+
+    def summary(self, user=None):
+        return CartSummary.objects.get(user=user or self.student)
+
+    def test_kept_up_to_date(self):
+        self.assertEqual(self.summary().terms, [{'strm': 1228, 'course_count': 0, 'min_units': 0, 'max_units': 0,
+                                                 'conflicts': {}}])
+        self.cart.courses.add(10000, 10001, 10002)
+        summary = self.summary()
+        self.assertEqual((summary.course_count, summary.min_units, summary.max_units, summary.conflict_count), (3, 9, 11, 2))
+        self.assertEqual(summary.term(1228)['conflicts'], {'10000': ['APMA 1000'], '10001': ['APMA 1000']})
+
+        # removing something that isn't there changes nothing
+        self.cart.courses.remove(10001, 20000)
+        ShoppingCart.objects.create(user=self.student, strm=1232).courses.add(20000)
+        summary = self.summary()
+        self.assertEqual([term['strm'] for term in summary.terms], [1228, 1232])
+        self.assertEqual((summary.course_count, summary.min_units, summary.conflict_count), (3, 12, 0))
+
+        Course.objects.get(pk=10002).shoppingcart_set.clear()
+        self.assertEqual(self.summary().course_count, 2)
+        self.assertEqual(self.summary(self.other).course_count, 1)
+
+        ShoppingCart.objects.get(user=self.student, strm=1232).delete()
+        self.assertEqual([term['strm'] for term in self.summary().terms], [1228])
+        self.student.delete()
+        self.assertFalse(CartSummary.objects.filter(user_id=self.cart.user_id).exists())
+
+    def test_missing_summary_is_built(self):
+        self.cart.courses.add(10000, 10002)
+        CartSummary.objects.all().delete()
+        # building one is a one-off, and isn't held to the page's query budget
+        with override_settings(QUERY_BUDGET_STRICT=False), self.assertLogs('schedapp.metrics', 'WARNING'):
+            response = self.client.get(reverse('shopping_cart'))
+        self.assertEqual(response.context['term']['course_count'], 2)
+        self.assertEqual(self.summary().min_units, 8)
+
+    def test_cart_page(self):
+        self.cart.courses.add(10000, 10001)
+        ShoppingCart.objects.create(user=self.student, strm=1232).courses.add(20000)
+
+        # with no term, the student's latest cart (not whichever cart is first in the table)
+        response = self.client.get(reverse('shopping_cart'))
+        self.assertEqual([course.pk for course in response.context['courses']], [20000])
+        self.assertContains(response, '<span class="badge bg-secondary">3</span>', html=True)
+
+        response = self.client.get(reverse('shopping_cart'), {'strm': 1228})
+        self.assertEqual(sorted(course.pk for course in response.context['courses']), [10000, 10001])
+        self.assertContains(response, "Total Units:</strong> 5 - 7")
+        self.assertContains(response, "Conflicts with:</strong> APMA 1000")
+
+    def test_remove_without_term(self):
+        self.cart.courses.add(10000)
+        response = self.client.post(reverse('remove_from_cart', args=(10000,)))
+        self.assertRedirects(response, reverse('shopping_cart') + '?strm=1228')
+        self.assertFalse(self.cart.courses.exists())
+        # the other student's cart is left alone
+        self.assertEqual(self.summary(self.other).course_count, 2)
+
+class ScheduleSummaryTests(TestCase):
+    """
+    Tests for the schedule summaries and the list pages that read them
+    """
+    def setUp(self):
+        clear_snapshots()
+        # 10000 and 10001 meet MoWeFr 9:00-9:50, 10002 TuTh 14:00-15:15 and is worth 1 to 3 units
+        courses = make_sis_courses(3)
+        courses[2]['units'] = '1 - 3'
+        courses[2]['meetings'][0].update(days='TuTh', start_time='14.00.00.000000-05:00', end_time='15.15.00.000000-05:00')
+        bulk_upsert_courses(courses)
+        self.advisor = Builders().create_user(is_advisor=True, name="summary-advisor")
+        self.student = Builders().create_user(name="summary-student")
+        self.schedule = Schedule.objects.create(student=self.student, approver=self.advisor, name="fall",
+                                                approval_status="pending")
+
+    def summary(self, schedule=None):
+        return ScheduleSummary.objects.get(schedule=schedule or self.schedule)
+
+    def test_kept_up_to_date(self):
+        summary = self.summary()
+        self.assertEqual((summary.course_count, summary.min_units, summary.earliest_start), (0, 0, None))
+
+        self.schedule.courses.add(10000, 10001, 10002)
+        summary = self.summary()
+        self.assertEqual((summary.course_count, summary.min_units, summary.max_units, summary.conflict_count),
+                         (3, 9, 11, 2))
+        self.assertEqual((summary.earliest_start, summary.latest_end), (9 * 60, 15 * 60 + 15))
+
+        self.schedule.courses.remove(10001)
+        self.assertEqual(self.summary().conflict_count, 0)
+        Course.objects.get(pk=10002).schedule_set.clear()
+        summary = self.summary()
+        self.assertEqual((summary.course_count, summary.latest_end), (1, 9 * 60 + 50))
+
+        self.schedule.delete()
+        self.assertFalse(ScheduleSummary.objects.exists())
+
+    def test_list_pages(self):
+        self.schedule.courses.add(10000, 10002)
+        self.client.force_login(self.student)
+        response = self.client.get(reverse('student-schedule-list'))
+        self.assertContains(response, "2 courses &middot; 5 - 7 units &middot; 09:00am to 03:15pm")
+
+        self.client.force_login(self.advisor)
+        response = self.client.get(reverse('advisor-schedule-list'))
+        self.assertContains(response, "2 courses &middot; 5 - 7 units")
+
+    def test_list_queries_dont_grow(self):
+        self.client.force_login(self.student)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('student-schedule-list'))
+        for i in range(5):
+            Schedule.objects.create(student=self.student, approver=self.advisor, name=f"more {i}").courses.add(10000, 10001)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('student-schedule-list'))
+        self.assertEqual(len(many), len(few))
+
+    def test_missing_summaries_are_built(self):
+        self.schedule.courses.add(10000, 10001)
+        ScheduleSummary.objects.all().delete()
+        self.client.force_login(self.advisor)
+        with override_settings(QUERY_BUDGET_STRICT=False):
+            response = self.client.get(reverse('advisor-schedule-list'))
+        self.assertEqual(response.context['schedules'][0].summary.conflict_count, 2)
+        self.assertEqual(self.summary().course_count, 2)
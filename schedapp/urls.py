@@ -1,7 +1,7 @@
 from django.shortcuts import render
 from django.urls import path
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.home, name='home'),
@@ -11,6 +11,9 @@ urlpatterns = [
     path('advisor/schedule-detail-<int:pk>/', views.AdvisorScheduleDetailView.as_view(), name='advisor-schedule-detail'),
     path('student/', views.StudentIndexView.as_view(), name='student'),
     path('courses/', views.course_list, name='course_list'),
+    path('courses/search/', views.course_search, name='course-search'),
+    path('courses/stream/', views.course_stream, name='course-stream'),
+    path('courses/<int:class_nbr>/schedules/', views.course_schedule_picker, name='course-schedule-picker'),
     path('student/schedule-list/', views.StudentScheduleListView.as_view(), name='student-schedule-list'),
     path('student/schedule-detail-<int:pk>/', views.StudentScheduleDetailView.as_view(), name='student-schedule-detail'),
     path('student/schedule-add-course/', views.student_schedule_add_course, name='student-schedule-add-course'),
@@ -22,9 +25,21 @@ urlpatterns = [
     path('shopping_cart/', views.shopping_cart, name='shopping_cart'),
     path('add_to_cart/<int:class_nbr>/<int:strm>/', views.add_to_cart, name='add_to_cart'),
     path('remove_from_cart/<int:class_nbr>/', views.remove_from_cart, name='remove_from_cart'),
+    path('shopping_cart/schedules/', views.cart_schedules, name='cart-schedules'),
+    path('shopping_cart/schedules/save/', views.cart_schedule_save, name='cart-schedule-save'),
     path('schedule-list/', views.schedule_list, name='schedule-list'),
     path('schedule-detail-<int:pk>/', views.schedule_detail, name='schedule-detail'),
+    path('schedule-validate-<int:pk>/', views.schedule_validate, name='schedule-validate'),
     path('schedule-change-approval-status', views.schedule_change_approval_status, name='schedule-change-approval-status'),
     path('flexible-index/', views.flexible_index, name='flexible-index'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('api/courses/', api.course_lookup, name='api-course-lookup'),
+    path('api/courses/<int:class_nbr>/', api.course_detail, name='api-course-detail'),
+    path('api/schedules/<int:pk>/', api.schedule_detail, name='api-schedule-detail'),
+    path('api/schedules/<int:pk>/status/', api.schedule_status, name='api-schedule-status'),
+    path('api/schedules/<int:pk>/courses/', api.schedule_courses, name='api-schedule-courses'),
+    path('api/carts/<int:strm>/', api.cart_detail, name='api-cart-detail'),
+    path('api/carts/<int:strm>/courses/', api.cart_courses, name='api-cart-courses'),
+    path('api/carts/<int:strm>/courses/<int:class_nbr>/', api.cart_courses, name='api-cart-course'),
 ]
 urlpatterns += staticfiles_urlpatterns()
\ No newline at end of file
@@ -1,21 +1,47 @@
 # pylint: disable=no-member
 
-from datetime import datetime
-import requests
+import hmac
+import json
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.views.generic.edit import CreateView, DeleteView
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render, get_object_or_404
+from django.template.loader import render_to_string
 from django.utils.decorators import method_decorator
+from django.db.models import Exists, OuterRef
 from django.urls import reverse, reverse_lazy
 from django.views import generic
-from .models import Course, ShoppingCart, Schedule, addJsonCourse, ApprovalStatus
-from .decorators import advisor_required, student_required
+from .models import Course, ShoppingCart, Schedule
+from .decorators import advisor_required, async_login_required, student_required
+from .sis import normalize_course, request_stats, search_query, search_url, sis_available
+from .sis_cache import acached_search_pages, cache_stats, stream_search_pages
+from .metrics import prometheus_text, query_budget
+from .conflicts import ScheduleIndex, conflicting_pairs
+from .catalog import bulk_upsert_courses, search_local
+from .catalog_snapshot import catalog_course, catalog_courses
+from .generator import Preferences, ScheduleGenerator
+from .grid import schedule_grid
+from .approvals import SUBMITTED_STATUSES, allowed_statuses, approval_queue, status_counts
+from .search import search_courses
+from .summaries import cart_summary, with_summaries
+from .api import course_json
+from .results import COURSES_PER_PAGE, ResultAssembler, assemble_results, paginate_results
 
 User = get_user_model()
 
+def _int_param(request, name, default=None, method='GET'):
+    """ an integer query (or, with method='POST', form) parameter, or default if it's missing or not a number """
+    try:
+        return int(getattr(request, method)[name])
+    except (KeyError, ValueError):
+        return default
+
 # ------- Method-Based views for simple things ------
 def home(request):
     """
@@ -39,89 +65,193 @@ def About(request):
 
     return render(request, 'common/about.html')
 
-@login_required
-def course_list(request):
-    # Make a GET request to the SIS API endpoint to retrieve the course data
+def _search_params(request):
+    """ the SIS search params from the course search form, or None if no required field was filled in """
+    term = request.GET.get('Term')
+    keyword = request.GET.get('keyword')
+    subject = request.GET.get('subject')
+    catalog = request.GET.get('catalog')
+    department = request.GET.get('department')
+    instruct = request.GET.get('instruct_modes')
+    session_code = request.GET.get('session_code')
+    location = request.GET.get('location')
+
+    if not (keyword or subject or catalog or department):
+        return None
+
+    return {
+        'term': term,
+        'subject': subject,
+        'acad_org': department,
+        'catalog_nbr': catalog,
+        'instruction_mode': instruct,
+        'keyword': keyword,
+        'session_code': session_code,
+        'location': location,
+    }
+
+@async_login_required
+async def course_list(request):
+    # Search SIS (or the local course catalog mirror) for courses. This view is
+    # async so a slow SIS search doesn't hold a worker; the database work is
+    # done with sync_to_async
     courses = []
 
     if request.method == 'GET' and request.GET:
 
-        term = request.GET.get('Term')
-        keyword = request.GET.get('keyword')
-        subject = request.GET.get('subject')
-        catalog = request.GET.get('catalog')
-        department = request.GET.get('department')
-        instruct = request.GET.get('instruct_modes')
-        session_code = request.GET.get('session_code')
-        location = request.GET.get('location')
-
-        if not (keyword or subject or catalog or department):
+        search = _search_params(request)
+        if search is None:
             messages.error(request, 'Please fill one of the required fields (*) before searching.')
-            return render(request, 'common/course_list.html')
-
-        page = 1
-            
-        while page < 8:
-            api_url = f'https://sisuva.admin.virginia.edu/psc/ihprd/UVSS/SA/s/WEBLIB_HCX_CM.H_CLASS_SEARCH.FieldFormula.IScript_ClassSearch?institution=UVA01&term={term}&subject={subject}&acad_org={department}&catalog_nbr={catalog}&instruction_mode={instruct}&keyword={keyword}&session_code={session_code}&location={location}&page={page}'
-            response = requests.get(api_url)
-            
-            if response.status_code == 200:
-                course_data = response.json()
+            return await sync_to_async(render)(request, 'common/course_list.html')
+
+        if settings.SIS_LOCAL_MIRROR:
+            # answer from the synced course catalog instead of going out to SIS
+            courses = search_local(search)
+        elif not sis_available():
+            courses = _sis_fallback(request, search)
+        else:
+            courses, from_sis = await acached_search_pages(search, with_source=True)
+            if not courses and not sis_available():
+                # this search is the one that found SIS down
+                courses = _sis_fallback(request, search)
             else:
-                course_data = []
-
-            for course in course_data: 
-                # Process start_time
-                if course['meetings']:
-                    start_str = course['meetings'][0]['start_time']
-                    if start_str:
-                        start_str = start_str[:-6]
-                        start_obj = datetime.strptime(start_str, '%H.%M.%S.%f')
-                        start_readable = start_obj.strftime('%I:%M %p')
-                        course['meetings'][0]['start_time'] = start_readable
-                    else:
-                        start_readable = 'No start time available'
-
-                    # Process end_time
-                    end_str = course['meetings'][0]['end_time']
-                    if end_str:
-                        end_str = end_str[:-6]
-                        end_obj = datetime.strptime(end_str, '%H.%M.%S.%f')
-                        end_readable = end_obj.strftime('%I:%M %p')
-                        course['meetings'][0]['end_time'] = end_readable
-                    else:
-                        end_readable = 'No start time available'
-
-                    # Add course to user's schedules
-                addJsonCourse(course)
-
-                # Append course to the courses list
-                courses.append(course)
-
-            courses.extend(course_data)
-            page += 1
+                for course in courses:
+                    normalize_course(course)
 
-    schedules = Schedule.objects.filter(student=request.user)
+                # store (or refresh) every course we found in a few queries; a cached search
+                # was stored by the request that fetched it
+                if from_sis:
+                    await sync_to_async(bulk_upsert_courses)(courses)
+
+    return await sync_to_async(_render_course_list)(request, courses)
+
+def _sis_fallback(request, search):
+    # SIS isn't answering (its circuit breaker is open), so search the courses we have
+    messages.warning(request, "SIS isn't responding right now, so these results are from our copy of the "
+                              "course catalog and seat counts may be out of date.")
+    return search_local(search)
 
-    return render(request, 'common/course_list.html', {'courses': courses, 'schedules':schedules})
+def _render_course_list(request, courses):
+    # each class once, sections grouped under their course, one page of courses at a time
+    page = paginate_results(assemble_results(courses), request.GET.get('page'))
+    query = request.GET.copy()
+    query.pop('page', None)
+
+    return render(request, 'common/course_list.html', {'groups': page.object_list, 'page': page,
+                                                       'query': query.urlencode()})
 
 
+@login_required
+def course_stream(request):
+    """
+    the course search form's results as json lines, one line per SIS page as it
+    arrives, so the course list can show the first page after one round trip:
+        {"page": 1, "count": 50, "html": "<rendered course cards>"}
+        ...
+        {"done": true, "courses": 64, "has_next": true}
+    takes the same query string as course_list, including ?page= for which page
+    of courses to show. A course with sections on more than one SIS page gets
+    its heading again with the later sections.
+
+    Django 4.1 iterates streaming responses synchronously, even under ASGI, so
+    this is a sync view and streams best from WSGI workers.
+    """
+    search = _search_params(request)
+    if search is None:
+        return JsonResponse({'error': 'Please fill one of the required fields (*) before searching.'}, status=400)
+
+    page = max(_int_param(request, 'page', 1), 1)
+    first, last = (page - 1) * COURSES_PER_PAGE, page * COURSES_PER_PAGE
+
+    def render_pages():
+        # the local catalog when we mirror it, or when SIS is down
+        local = settings.SIS_LOCAL_MIRROR or not sis_available()
+        if local:
+            pages = [(search_local(search), False)]
+        else:
+            pages = stream_search_pages(search, with_source=True)
+
+        assembler = ResultAssembler()
+        for number, (courses, from_sis) in enumerate(pages, 1):
+            if not local:
+                for course in courses:
+                    normalize_course(course)
+            # pages from the cache were stored by the request that fetched them
+            if from_sis:
+                bulk_upsert_courses(courses)
+
+            # only the sections of courses on the page asked for are sent; the rest of the
+            # search is still read through so it's upserted and cached, and we know if there's more
+            groups = [group for index, group in assembler.add(courses) if first <= index < last]
+            html = render_to_string('common/includes/course_cards.html',
+                                    {'groups': groups}, request=request) if groups else ''
+            yield json.dumps({'page': number, 'count': sum(len(group.sections) for group in groups), 'html': html}) + '\n'
+
+        yield json.dumps({'done': True, 'courses': len(assembler.groups), 'has_next': len(assembler.groups) > last}) + '\n'
+
+    response = StreamingHttpResponse(render_pages(), content_type='application/x-ndjson')
+    # ask proxies (nginx, heroku's router) to pass each line on as it's written
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@query_budget(6)
+@login_required
+@student_required
+def course_schedule_picker(request, class_nbr):
+    """
+    the "Add to Schedule" picker for one course, loaded when a student opens it on
+    the course search page, so the page itself doesn't carry a form per schedule
+    for every course. Schedules the course is already in are marked.
+    """
+    in_schedule = Schedule.courses.through.objects.filter(schedule=OuterRef('pk'), course_id=class_nbr)
+    schedules = (Schedule.objects.filter(student=request.user)
+                                 .annotate(has_course=Exists(in_schedule))
+                                 .only('pk', 'name')
+                                 .order_by('name'))
+    return render(request, 'common/includes/schedule_picker.html', {'class_nbr': class_nbr, 'schedules': schedules})
+
+@login_required
+def course_search(request):
+    """
+    ranked full-text search over the local course catalog, as json, for
+    search-as-you-type: ?q=calc&term=1238&page=1. With &fits=<schedule id>,
+    only courses that don't conflict with one of the user's schedules
+    """
+    fits = None
+    if _int_param(request, 'fits'):
+        schedule = get_object_or_404(Schedule, pk=_int_param(request, 'fits'), student=request.user)
+        fits = list(schedule.courses.only('class_nbr', 'strm', 'meeting_times'))
+    page = search_courses(request.GET.get('q'), strm=request.GET.get('term') or None,
+                          page=_int_param(request, 'page', 1), fits=fits)
+    return JsonResponse({
+        'query': request.GET.get('q', ''),
+        'page': page.page,
+        'has_next': page.has_next,
+        'results': [course_json(course) for course in page.courses],
+    })
+
+@query_budget(10)
 @login_required
 @student_required
 def shopping_cart(request):
-    strm = request.GET.get('strm')
-    if strm: 
-        cart = ShoppingCart.objects.filter(user=request.user, strm=int(strm)).first()
-    else: 
-        cart = ShoppingCart.objects.first()
-    courses = cart.courses.all() if cart else []
+    # the totals and conflicts come from the student's cart summary (also what the navbar reads)
+    summary = request.cart_summary = cart_summary(request.user)
+    strm = _int_param(request, 'strm')
+    if strm:
+        term = summary.term(strm)
+    else:
+        # the latest term they have a cart for
+        term = summary.terms[-1] if summary.terms else None
+    courses = list(Course.objects.filter(shoppingcart__user=request.user, shoppingcart__strm=term['strm'])) if term else []
 
-    total_units = sum(int(course.units) for course in courses)
+    # flag the courses in the cart that can't be taken together
+    for course in courses:
+        course.conflicting = term['conflicts'].get(str(course.pk), [])
 
     # Get the list of schedules for the current user
     schedules = Schedule.objects.filter(student=request.user)
 
-    strms = ShoppingCart.objects.filter(user=request.user).values_list('strm', flat=True).distinct()
     strm_mapping = {
         1232: "Spring 2023",
         1238: "Fall 2023",
@@ -133,12 +263,13 @@ def shopping_cart(request):
         1208: "Fall 2020",
     }
 
-    strm_names = [(strm, strm_mapping.get(strm, "")) for strm in strms]
+    strm_names = [(term['strm'], strm_mapping.get(term['strm'], "")) for term in summary.terms]
 
     return render(request, 'student/cart.html', {
         'courses': courses,
         'strm_names': strm_names,
-        'total_units': total_units,
+        'selected_strm': term['strm'] if term else strm,
+        'term': term,
         'schedules': schedules,  # Include the schedules queryset in the context
     })
 
@@ -147,31 +278,96 @@ def shopping_cart(request):
 @login_required
 @student_required   
 def add_to_cart(request, class_nbr, strm): 
-    course = Course.objects.get(class_nbr=class_nbr)
+    course = catalog_course(class_nbr, strm)
+    if course is None:
+        raise Http404("No such course.")
     cart, created = ShoppingCart.objects.get_or_create(user= request.user, strm=strm)
-    cart.courses.add(course)
+    cart.courses.add(course.pk)
     return redirect('shopping_cart')
 
 @login_required
 @student_required
 def remove_from_cart(request, class_nbr):
-    course = Course.objects.get(class_nbr=class_nbr)
-    strm = request.GET.get('strm')
+    strm = _int_param(request, 'strm')
+    # without a term, take it out of whichever of the student's carts it's in
+    carts = ShoppingCart.objects.filter(user=request.user, courses=class_nbr)
     if strm:
-        cart = ShoppingCart.objects.filter(user = request.user, strm=int(strm)).first()
-    else:
-        cart = ShoppingCart.objects.first()
-    
-    if cart:
-        cart.courses.remove(course)
+        carts = carts.filter(strm=strm)
+    for cart in carts:
+        cart.courses.remove(class_nbr)
+        strm = cart.strm
+    if strm:
+        return redirect(f"{reverse('shopping_cart')}?strm={strm}")
     return redirect('shopping_cart')
 
+@query_budget(10)
+@login_required
+@student_required
+def cart_schedules(request):
+    """ conflict-free schedules generated from one of the student's carts """
+    strm = _int_param(request, 'strm')
+    carts = ShoppingCart.objects.filter(user=request.user)
+    cart = carts.filter(strm=strm).first() if strm else carts.first()
+
+    min_units = _int_param(request, 'min_units')
+    max_units = _int_param(request, 'max_units')
+    earliest = _int_param(request, 'earliest', 9)
+    generator = ScheduleGenerator(cart.courses.all() if cart else [],
+                                  min_units=min_units,
+                                  max_units=max_units,
+                                  preferences=Preferences(earliest=earliest * 60),
+                                  limit=settings.SCHEDULE_GENERATOR_LIMIT,
+                                  time_budget=settings.SCHEDULE_GENERATOR_TIME_BUDGET)
+    for _ in generator:
+        pass
+
+    return render(request, 'student/cart_schedules.html', {
+        'cart': cart,
+        'generated': generator.results(),
+        'complete': generator.complete,
+        'min_units': min_units,
+        'max_units': max_units,
+        'earliest': earliest,
+        'advisors': User.objects.filter(is_advisor=True),
+    })
+
+@login_required
+@student_required
+def cart_schedule_save(request):
+    """ save one of the generated schedules as a new schedule """
+    courses = list(Course.objects.filter(pk__in=request.POST.getlist('class_nbr')))
+    approver_pk = _int_param(request, 'approver', method='POST')
+    if approver_pk is None:
+        messages.error(request, "Choose an advisor to send that schedule to.")
+        return HttpResponseRedirect(reverse('cart-schedules'))
+    approver = get_object_or_404(User, pk=approver_pk, is_advisor=True)
+
+    conflicts = conflicting_pairs(courses)
+    if not courses or conflicts:
+        messages.error(request, "That schedule can't be saved because some of its courses conflict.")
+        return HttpResponseRedirect(reverse('cart-schedules'))
+
+    schedule = Schedule.objects.create(student=request.user, approver=approver,
+                                       name=request.POST.get('name') or "Generated schedule")
+    schedule.courses.set(courses)
+    return HttpResponseRedirect(reverse('student-schedule-detail', args=(schedule.pk,)))
+
 def search_results(request):
-    base_url = 'https://sisuva.admin.virginia.edu/psc/ihprd/UVSS/SA/s/WEBLIB_HCX_CM.H_CLASS_SEARCH.FieldFormula.IScript_ClassSearch'
-    term = request.GET.get('term')
-    subject = request.GET.get('subject')
-    url = f'{base_url}?institution=UVA01&term={term}&subject={subject}&page=1'
-    return redirect(url)
+    """ sends the browser to SIS's own results for a term and subject """
+    query = search_query({'term': request.GET.get('term'), 'subject': request.GET.get('subject')}, 1)
+    return redirect(f'{search_url()}?{urlencode(query)}')
+
+def metrics(request):
+    """
+    request, SIS and SIS cache metrics for this process, in prometheus text
+    format. Staff can read it, and so can anyone sending
+    `Authorization: Bearer <METRICS_TOKEN>` (for the scraper)
+    """
+    token = settings.METRICS_TOKEN
+    authorized = token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not (authorized or request.user.is_staff):
+        return HttpResponse(status=403)
+    return HttpResponse(prometheus_text(request_stats(), cache_stats()), content_type='text/plain; version=0.0.4')
 
 @login_required
 def flexible_index(request):
@@ -203,22 +399,22 @@ def student_schedule_add_course(request):
     """ add a course to a schedule """
     schedule_id = request.POST['sched-id']
     schedule = get_object_or_404(Schedule, pk=schedule_id)
-    class_nbr = request.POST['class_nbr']
-    course = Course.objects.get(pk = class_nbr)
-
+    course = catalog_course(request.POST['class_nbr'])
+    if course is None:
+        raise Http404("No such course.")
+    # the schedule's courses, from the catalog snapshot rather than their rows
+    scheduled = catalog_courses(schedule.courses.values_list('pk', flat=True))
 
     # if the course isn't in the schedule already
-    add_class = not schedule.courses.filter(pk=class_nbr).exists()
-    conflicting_courses = []
+    add_class = course.pk not in scheduled
 
     # check to see if the course conflicts with any course currently in the schedule
-    for current_course in schedule.courses.all():
-        if course.conflicts_with(current_course):
-            conflicting_courses.append(current_course)
-            add_class = False
+    conflicting_courses = ScheduleIndex(scheduled.values()).conflicts_for(course)
+    if conflicting_courses:
+        add_class = False
 
     if add_class:
-        schedule.courses.add(course)
+        schedule.courses.add(course.pk)
     else:
         messages.error(request, f"{course} could not be added to this schedule because it conflicts with these courses: {*conflicting_courses,} ")
 
@@ -230,12 +426,24 @@ def student_schedule_remove_course(request):
     """ remove a course from a schedule"""
     schedule_id = request.POST['sched-id']
     schedule = get_object_or_404(Schedule, pk=schedule_id)
-    class_nbr = request.POST['class_nbr']
-    course = Course.objects.get(pk = class_nbr)
-
-    schedule.courses.remove(course)
+    schedule.courses.remove(request.POST['class_nbr'])
     return HttpResponseRedirect(reverse("student-schedule-detail", args=(schedule_id,)))
 
+@query_budget(8)
+@login_required
+def schedule_validate(request, pk):
+    """ every pair of conflicting courses in a schedule, as json """
+    schedule = get_object_or_404(Schedule, pk=pk)
+    if request.user != schedule.student and request.user != schedule.approver:
+        return JsonResponse({'error': 'You do not have access to this schedule.'}, status=403)
+
+    pairs = conflicting_pairs(schedule.courses.all())
+    return JsonResponse({
+        'schedule': schedule.pk,
+        'valid': not pairs,
+        'conflicts': [[str(first), first.pk, str(second), second.pk] for first, second in pairs],
+    })
+
 @login_required
 def schedule_change_approval_status(request):
     """ Change the approval status of a schedule """
@@ -243,22 +451,32 @@ def schedule_change_approval_status(request):
     schedule = get_object_or_404(Schedule, pk=schedule_id)
     new_status = request.POST['new-status']
     
-    if request.user.is_advisor:
-        if new_status == ApprovalStatus.AP.value or new_status == ApprovalStatus.DN.value or new_status == ApprovalStatus.PD.value:
-            schedule.approval_status = ApprovalStatus(new_status).value
-            schedule.save()
-        else:
-            messages.error(request, "Not a valid status for an advisor")
+    if new_status in allowed_statuses(request.user):
+        schedule.set_approval_status(new_status)
+        schedule.save()
+    elif request.user.is_advisor:
+        messages.error(request, "Not a valid status for an advisor")
     else:
-        if new_status == ApprovalStatus.PD.value or new_status == ApprovalStatus.UN.value:
-            schedule.approval_status = ApprovalStatus(new_status).value
-            schedule.save()
-        else:
-            messages.error(request, "Not a valid status for a student")
+        messages.error(request, "Not a valid status for a student")
     return HttpResponseRedirect(reverse("schedule-detail", args=(schedule_id,)))
 
 # ------- Class-Based views for use with models and other more complex things -------
 
+class ScheduleGridMixin:
+    """
+    for schedule detail views: loads the schedule's courses in one query and
+    lays them out on the weekly grid once, for the template to walk
+    """
+    def get_queryset(self):
+        return super().get_queryset().prefetch_related('courses')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        courses = list(self.object.courses.all())
+        context['courses'] = courses
+        context['grid'] = schedule_grid(courses)
+        return context
+
 # ------- ------- Advisor Views ------- -------
 @method_decorator([login_required, advisor_required], name='dispatch')
 class AdvisorIndexView(generic.ListView):
@@ -268,23 +486,39 @@ class AdvisorIndexView(generic.ListView):
     template_name = 'advisor/index.html'
     model = User
 
+@query_budget(6)
 @method_decorator([login_required, advisor_required], name='dispatch')
 class AdvisorScheduleListView(generic.ListView):
     """
-    list of an advisor's schedules
+    an advisor's approval queue: the schedules submitted to them, oldest
+    first, optionally just those with one status (?status=pending), a page
+    at a time (?after=<cursor from the previous page>)
     """
     model = Schedule
     template_name = 'advisor/schedule_list.html'
     context_object_name = 'schedules'
+    page_size = 25
 
     def get_queryset(self):
         """
-        grab all of the advisor's schedules
+        grab one page of the schedules submitted to this advisor
         """
-        return Schedule.objects.all()
-
+        status = self.request.GET.get('status')
+        self.status = status if status in SUBMITTED_STATUSES else None
+        schedules, self.next_cursor = approval_queue(self.request.user, self.status,
+                                                     self.request.GET.get('after'), self.page_size)
+        return schedules
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['status'] = self.status
+        context['next_cursor'] = self.next_cursor
+        context['status_counts'] = status_counts(self.request.user)
+        return context
+
+@query_budget(8)
 @method_decorator([login_required, advisor_required], name='dispatch')
-class AdvisorScheduleDetailView(generic.DetailView):
+class AdvisorScheduleDetailView(ScheduleGridMixin, generic.DetailView):
     """
     detail view for one of an advisor's schedules
     """
@@ -302,6 +536,7 @@ class StudentIndexView(generic.ListView):
     template_name = 'student/index.html'
     model = User
 
+@query_budget(6)
 @method_decorator([login_required, student_required], name='dispatch')
 class StudentScheduleListView(generic.ListView):
     """
@@ -313,12 +548,15 @@ class StudentScheduleListView(generic.ListView):
 
     def get_queryset(self):
         """
-        grab all of the student's schedules
+        grab all of the student's schedules, with their summaries
         """
-        return Schedule.objects.filter(student=self.request.user)
+        return with_summaries(Schedule.objects.filter(student=self.request.user)
+                                              .select_related('approver', 'student', 'summary')
+                                              .order_by('pk'))
 
+@query_budget(8)
 @method_decorator([login_required, student_required], name='dispatch')
-class StudentScheduleDetailView(generic.DetailView):
+class StudentScheduleDetailView(ScheduleGridMixin, generic.DetailView):
     """
     detial view of one of a student's schedules
     """
@@ -2,6 +2,8 @@
 ASGI config for schedris project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with ``gunicorn schedris.asgi:application -k uvicorn.workers.UvicornWorker``
+so async views (course search) don't hold a worker while they wait on SIS.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
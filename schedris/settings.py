@@ -61,6 +61,8 @@ CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"
 CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 MIDDLEWARE = [
+    # first, so the numbers it keeps include every other middleware (see schedapp/metrics.py)
+    'schedapp.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
@@ -85,6 +87,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'schedapp.context_processors.cart',
             ],
         },
     },
@@ -136,6 +139,94 @@ if os.environ.get('CI', '') == 'True':
         }
     }
 
+# SIS class search API
+# point SIS_SEARCH_URL at a local stub (see schedapp/sis_stub.py, or manage.py sis_stub_server
+# to replay a recording made with record_sis) to test or benchmark offline
+SIS_SEARCH_URL = os.environ.get('SIS_SEARCH_URL',
+        'https://sisuva.admin.virginia.edu/psc/ihprd/UVSS/SA/s/WEBLIB_HCX_CM.H_CLASS_SEARCH.FieldFormula.IScript_ClassSearch')
+# searches never go past this many pages
+SIS_MAX_PAGES = 7
+# how many pages of one search are fetched at once
+SIS_MAX_WORKERS = int(os.environ.get('SIS_MAX_WORKERS', '4'))
+# threads shared by async searches for fetching pages when httpx isn't installed
+SIS_ASYNC_THREADS = 32
+# (connect, read) timeouts in seconds for each page
+SIS_TIMEOUT = (3.05, 10)
+# extra attempts for a page after a connection error or a 429/5xx, waiting about
+# SIS_RETRY_BACKOFF seconds before the first and twice as long before each next one (at most
+# SIS_RETRY_MAX_BACKOFF); read timeouts aren't retried
+SIS_RETRIES = 2
+SIS_RETRY_BACKOFF = 0.2
+SIS_RETRY_MAX_BACKOFF = 2.0
+# after this many failed requests in a row stop calling SIS, and search the local catalog,
+# for SIS_BREAKER_RESET seconds
+SIS_BREAKER_FAILURES = 5
+SIS_BREAKER_RESET = 30
+# rows in a full page of results; leave as None to use the size of the first page (seat
+# refreshes use the page size the term's last catalog sync saw, if there was one)
+SIS_PAGE_SIZE = None
+# answer course searches from the local catalog mirror (kept up to date by
+# `python manage.py sync_catalog`) instead of going out to SIS on every search
+SIS_LOCAL_MIRROR = os.environ.get('SIS_LOCAL_MIRROR', '') == 'True'
+# seconds a class search stays in the 'sis' cache (see schedapp/sis_cache.py), and how
+# long one worker may hold a search's fetch lock before the others give up waiting on it
+SIS_CACHE_TIMEOUT = int(os.environ.get('SIS_CACHE_TIMEOUT', '300'))
+SIS_CACHE_LOCK_TIMEOUT = 30
+# seat refreshes (`python manage.py refresh_seats`, see schedapp/seats.py): the most SIS
+# searches a minute they may make, and how many seconds a course's seats count as fresh
+SEATS_REQUESTS_PER_MINUTE = int(os.environ.get('SEATS_REQUESTS_PER_MINUTE', '30'))
+SEATS_MIN_AGE = 300
+
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# locmem is per-process and evicts the least recently used entries past MAX_ENTRIES.
+# With more than one worker, set SIS_CACHE_URL so they share one cache (and one fetch
+# per expired search): redis://localhost:6379/1, or file:///var/tmp/schedris-sis for a
+# file-based cache on a single machine. CACHE_URL does the same for the default cache,
+# which holds the catalog snapshot versions (schedapp/catalog_snapshot.py); every worker
+# and management command has to share it, and `manage.py check --deploy` says so.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sis': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sis-search',
+        'TIMEOUT': SIS_CACHE_TIMEOUT,
+        'OPTIONS': {'MAX_ENTRIES': 500},
+    },
+}
+CACHE_URL = os.environ.get('CACHE_URL', '')
+if CACHE_URL.startswith('file://'):
+    CACHES['default'].update(BACKEND='django.core.cache.backends.filebased.FileBasedCache',
+                             LOCATION=CACHE_URL[len('file://'):])
+elif CACHE_URL:
+    CACHES['default'].update(BACKEND='django.core.cache.backends.redis.RedisCache', LOCATION=CACHE_URL)
+# catalog snapshots (schedapp/catalog_snapshot.py): how many terms each process keeps, and
+# whether a stale one is rebuilt in a background thread (meanwhile lookups read the Course
+# table) or in the request that finds it stale, as the tests do so they see their own rows
+CATALOG_SNAPSHOT_TERMS = 4
+CATALOG_SNAPSHOT_BACKGROUND = "test" not in sys.argv
+SIS_CACHE_URL = os.environ.get('SIS_CACHE_URL', '')
+if SIS_CACHE_URL.startswith('file://'):
+    CACHES['sis'].update(BACKEND='django.core.cache.backends.filebased.FileBasedCache',
+                         LOCATION=SIS_CACHE_URL[len('file://'):])
+elif SIS_CACHE_URL:
+    CACHES['sis'].update(BACKEND='django.core.cache.backends.redis.RedisCache',
+                         LOCATION=SIS_CACHE_URL, OPTIONS={})
+
+# request metrics (see schedapp/metrics.py): send each request's timings back in a
+# Server-Timing header, fail requests that go over their view's @query_budget instead of
+# just logging them, and the bearer token that may read /metrics (staff always can)
+METRICS_SERVER_TIMING = DEBUG
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', str(DEBUG)) == 'True'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# schedule generator (shopping cart -> conflict-free schedules)
+# seconds a single request may spend searching, and how many schedules it shows
+SCHEDULE_GENERATOR_TIME_BUDGET = 1.0
+SCHEDULE_GENERATOR_LIMIT = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 